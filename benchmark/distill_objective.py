@@ -0,0 +1,258 @@
+r"""Benchmark fused distillation objective against per-term backward passes.
+
+Compare one distillation step which calls `backward(retain_graph=True)` on
+every loss term with one which sums all terms by
+`fine_tune.objective.distill_objective` and calls `backward` once. Teacher
+outputs are random tensors so no pre-trained teacher is needed. Each mode is
+run in its own process so that peak memory is measured separately.
+
+Usage:
+    python -m benchmark.distill_objective
+    python -m benchmark.distill_objective --device_id 0 --batch_size 32
+
+Run `python -m benchmark.distill_objective -h` for help.
+"""
+
+# built-in modules
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+from typing import Tuple
+
+# 3rd party modules
+
+import torch
+
+# my own modules
+
+import fine_tune
+
+
+def distill_step(
+        args: argparse.Namespace,
+        fused: bool
+) -> Tuple[float, float]:
+    r"""Run distillation steps and measure speed and peak memory.
+
+    Args:
+        args:
+            Benchmark arguments.
+        fused:
+            Use `fine_tune.objective.distill_objective` with one backward pass
+            if `True`, otherwise backward on each loss term.
+
+    Returns:
+        Seconds per step and peak memory in MiB. Peak memory is CUDA allocated
+        memory when running on GPU and process maximum resident set size when
+        running on CPU.
+    """
+    torch.manual_seed(args.seed)
+
+    device = torch.device('cpu')
+    if args.device_id > -1:
+        device = torch.device(f'cuda:{args.device_id}')
+
+    # Construct student model and adaptive layers.
+    model = fine_tune.model.StudentBert(
+        d_ff=args.d_ff,
+        d_model=args.d_model,
+        dropout=0.1,
+        max_seq_len=args.seq_len,
+        num_attention_heads=args.num_attention_heads,
+        num_class=3,
+        num_hidden_layers=args.num_hidden_layers,
+        type_vocab_size=2,
+        vocab_size=30522
+    ).to(device)
+    adaptive_layers = [
+        torch.nn.Linear(args.d_model, args.teacher_d_model).to(device)
+        for _ in range(args.num_hidden_layers)
+    ]
+    model.train()
+
+    # Random inputs and teacher outputs.
+    input_ids = torch.randint(
+        30522,
+        (args.batch_size, args.seq_len),
+        device=device
+    )
+    attention_mask = torch.ones_like(input_ids)
+    token_type_ids = torch.zeros_like(input_ids)
+    label = torch.randint(3, (args.batch_size,), device=device)
+    teacher_logits = torch.randn(args.batch_size, 3, device=device)
+    teacher_hiddens = [
+        torch.randn(
+            args.batch_size,
+            args.seq_len,
+            args.teacher_d_model,
+            device=device
+        )
+        for _ in range(args.num_hidden_layers)
+    ]
+    teacher_attns = [
+        torch.softmax(
+            torch.randn(
+                args.batch_size,
+                args.num_attention_heads,
+                args.seq_len,
+                args.seq_len,
+                device=device
+            ),
+            dim=-1
+        )
+        for _ in range(args.num_hidden_layers)
+    ]
+
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+    for step in range(args.warmup_step + args.step):
+        # Exclude warmup steps from timing.
+        if step == args.warmup_step:
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+
+        model.zero_grad()
+        logits, hiddens, attns = model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+            return_hidden_and_attn=True
+        )
+
+        if fused:
+            loss, _ = fine_tune.objective.distill_objective(
+                hard_target=label,
+                student_outputs=(logits, hiddens[1:], attns),
+                teacher_outputs=(
+                    teacher_logits,
+                    teacher_hiddens,
+                    teacher_attns
+                ),
+                adaptive_layers=adaptive_layers
+            )
+            loss.backward()
+            continue
+
+        # Previous implementation: one backward pass for each loss term.
+        fine_tune.objective.distill_loss(
+            hard_target=label,
+            student_logits=logits,
+            teacher_logits=teacher_logits
+        ).backward(retain_graph=True)
+        for t_hidden, s_hidden, adaptive_layer in zip(
+                teacher_hiddens,
+                hiddens[1:],
+                adaptive_layers
+        ):
+            fine_tune.objective.hidden_MSE_loss(
+                teacher_hidden=t_hidden,
+                student_hidden=adaptive_layer(s_hidden)
+            ).backward(retain_graph=True)
+        for t_attn, s_attn in zip(teacher_attns, attns):
+            fine_tune.objective.attention_KL_loss(
+                teacher_attn=t_attn,
+                student_attn=s_attn
+            ).backward(retain_graph=True)
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        peak = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    else:
+        # `ru_maxrss` is in KiB on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+    return (time.perf_counter() - start) / args.step, peak
+
+
+if __name__ == '__main__':
+    # Parse arguments from STDIN.
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--batch_size',
+        default=16,
+        help='Mini-batch size.',
+        type=int,
+    )
+    parser.add_argument(
+        '--d_ff',
+        default=1024,
+        help='Student feed forward dimension.',
+        type=int,
+    )
+    parser.add_argument(
+        '--d_model',
+        default=256,
+        help='Student hidden dimension.',
+        type=int,
+    )
+    parser.add_argument(
+        '--device_id',
+        default=-1,
+        help='Run on CUDA device with this ID. Run on CPU if set to `-1`.',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_attention_heads',
+        default=4,
+        help='Number of attention heads.',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_hidden_layers',
+        default=6,
+        help='Number of student Transformer layers.',
+        type=int,
+    )
+    parser.add_argument(
+        '--seed',
+        default=42,
+        help='Control random seed.',
+        type=int,
+    )
+    parser.add_argument(
+        '--seq_len',
+        default=128,
+        help='Input sequence length.',
+        type=int,
+    )
+    parser.add_argument(
+        '--step',
+        default=10,
+        help='Number of timed steps.',
+        type=int,
+    )
+    parser.add_argument(
+        '--teacher_d_model',
+        default=768,
+        help='Teacher hidden dimension.',
+        type=int,
+    )
+    parser.add_argument(
+        '--warmup_step',
+        default=2,
+        help='Number of untimed warmup steps.',
+        type=int,
+    )
+    args = parser.parse_args()
+
+    # Run each mode in a fresh process to measure peak memory separately.
+    context = multiprocessing.get_context('spawn')
+    result = {}
+    for fused in (False, True):
+        with context.Pool(1) as pool:
+            result[fused] = pool.apply(distill_step, (args, fused))
+
+    for fused, name in ((False, 'per-term backward'), (True, 'fused backward')):
+        print(
+            f'{name:>18}: {result[fused][0] * 1000:8.2f} ms/step, ' +
+            f'peak memory {result[fused][1]:8.1f} MiB'
+        )
+    print(
+        f'{"speedup":>18}: {result[False][0] / result[True][0]:8.2f}x, ' +
+        f'memory saved {result[False][1] - result[True][1]:8.1f} MiB'
+    )
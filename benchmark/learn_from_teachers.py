@@ -0,0 +1,229 @@
+r"""Benchmark bulk vocabulary merge against per-token merge.
+
+Compare the previous implementation of
+`bertgang.bertgang_tokenizer.Tokenizer.learn_from_teachers`, which converts,
+normalizes and adds teacher tokens one id at a time, with the current one
+which normalizes each teacher vocabulary in one pass and adds all tokens with
+a single `add_tokens` call. Teacher tokenizers are built from synthetic
+vocabularies and student sentencepiece model is trained on a synthetic
+corpus, so no pre-trained tokenizer is needed.
+
+Usage:
+    python -m benchmark.learn_from_teachers
+    python -m benchmark.learn_from_teachers --vocab_size 30000
+
+Run `python -m benchmark.learn_from_teachers -h` for help.
+"""
+
+# built-in modules
+
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+
+from typing import Dict
+
+# 3rd party modules
+
+import sentencepiece
+import transformers
+
+# my own modules
+
+import bertgang
+
+# Stand-in teachers and their sentencepiece indicators.
+TEACHERS = ['bert', 'roberta']
+
+
+class SyntheticConfig(bertgang.bertgang_config.PreTrainConfig):
+    r"""Pre-train config which returns synthetic teacher tokenizers."""
+
+    def __init__(
+            self,
+            teacher_tokenizers: Dict[str, transformers.PreTrainedTokenizer],
+            **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.teacher_tokenizers = teacher_tokenizers
+
+    def get_teacher_tokenizer_instance(
+            self,
+            teacher: str
+    ) -> transformers.PreTrainedTokenizer:
+        return self.teacher_tokenizers[teacher]
+
+
+def per_token_merge(
+        tokenizer: bertgang.bertgang_tokenizer.Tokenizer,
+        config: bertgang.bertgang_config.PreTrainConfig
+) -> None:
+    r"""Previous implementation of `learn_from_teachers`.
+
+    Args:
+        tokenizer:
+            Student tokenizer to add tokens into.
+        config:
+            Source of teachers list.
+    """
+    albert_sp_indicator = (bertgang.bertgang_config
+                           .VALID_TEACHERS['albert']['sp_indicator'])
+
+    for teacher in config.teachers:
+        teacher_tokenizer = config.get_teacher_tokenizer_instance(teacher)
+        teacher_sp_indicator = config.get_teacher_sp_indicator(teacher)
+
+        for idx in range(teacher_tokenizer.vocab_size):
+            if idx in teacher_tokenizer.all_special_ids:
+                continue
+
+            token = teacher_tokenizer.convert_ids_to_tokens([idx])[0]
+            token = re.sub(teacher_sp_indicator, '', token)
+            if config.do_lower_case:
+                token = token.lower()
+            token = albert_sp_indicator + token
+
+            tokenizer.add_tokens([token])
+
+
+def synthetic_teacher(
+        path: str,
+        sp_indicator: str,
+        vocab_size: int,
+        rng: random.Random
+) -> transformers.PreTrainedTokenizer:
+    r"""Build teacher tokenizer from random vocabulary.
+
+    About half of the words carry `sp_indicator` and some words differ only
+    in case, so that normalization produces duplicates as real vocabularies
+    do.
+
+    Args:
+        path:
+            Vocabulary file path.
+        sp_indicator:
+            sentencepiece indicator of teacher.
+        vocab_size:
+            Number of tokens in vocabulary.
+        rng:
+            Random number generator.
+
+    Returns:
+        Teacher tokenizer.
+    """
+    special_tokens = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+    words = set()
+    while len(words) < vocab_size - len(special_tokens):
+        word = ''.join(
+            rng.choice('abcdefghijklmnopqrstuvwxyzABC')
+            for _ in range(rng.randint(2, 8))
+        )
+        if rng.random() < 0.5:
+            word = sp_indicator + word
+        words.add(word)
+
+    with open(path, 'w', encoding='utf-8') as vocab_file:
+        vocab_file.write('\n'.join(special_tokens + sorted(words)) + '\n')
+
+    return transformers.BertTokenizer(path, do_lower_case=False)
+
+
+def student_tokenizer(path: str) -> bertgang.bertgang_tokenizer.Tokenizer:
+    r"""Load student tokenizer from sentencepiece model.
+
+    Args:
+        path:
+            Path of sentencepiece model.
+
+    Returns:
+        Fresh student tokenizer without added tokens.
+    """
+    return bertgang.bertgang_tokenizer.Tokenizer(path)
+
+
+if __name__ == '__main__':
+    # Parse arguments from STDIN.
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--seed',
+        default=42,
+        help='Control random seed.',
+        type=int,
+    )
+    parser.add_argument(
+        '--skip_per_token',
+        action='store_true',
+        help='Skip per-token merge, which is slow for large vocabularies.',
+    )
+    parser.add_argument(
+        '--vocab_size',
+        default=3000,
+        help='Vocabulary size of each synthetic teacher.',
+        type=int,
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Train a tiny student sentencepiece model.
+        corpus_path = os.path.join(tmp_dir, 'corpus.txt')
+        with open(corpus_path, 'w', encoding='utf-8') as corpus_file:
+            for _ in range(1000):
+                corpus_file.write(' '.join(
+                    rng.choice(['the', 'cat', 'sat', 'on', 'a', 'mat'])
+                    for _ in range(10)
+                ) + '\n')
+        sentencepiece.SentencePieceTrainer.train(
+            input=corpus_path,
+            model_prefix=os.path.join(tmp_dir, 'spiece'),
+            vocab_size=20,
+            minloglevel=2
+        )
+        sp_path = os.path.join(tmp_dir, 'spiece.model')
+
+        config = SyntheticConfig(
+            batch_size=1,
+            do_lower_case=True,
+            path=tmp_dir,
+            teachers=TEACHERS,
+            teacher_tokenizers={
+                teacher: synthetic_teacher(
+                    path=os.path.join(tmp_dir, f'{teacher}.txt'),
+                    sp_indicator=(bertgang.bertgang_config
+                                  .VALID_TEACHERS[teacher]['sp_indicator']),
+                    vocab_size=args.vocab_size,
+                    rng=rng
+                )
+                for teacher in TEACHERS
+            }
+        )
+
+        result = {}
+        vocab = {}
+        modes = [('bulk', None)]
+        if not args.skip_per_token:
+            modes.insert(0, ('per-token', per_token_merge))
+        for name, merge in modes:
+            tokenizer = student_tokenizer(sp_path)
+            start = time.perf_counter()
+            if merge is None:
+                tokenizer.learn_from_teachers(config)
+            else:
+                merge(tokenizer, config)
+            result[name] = time.perf_counter() - start
+            vocab[name] = tokenizer.get_vocab()
+
+    for name, elapsed in result.items():
+        print(
+            f'{name:>10}: {elapsed:8.3f} s, ' +
+            f'vocabulary size {len(vocab[name])}'
+        )
+    if 'per-token' in result:
+        speedup = result['per-token'] / result['bulk']
+        print(
+            f'{"speedup":>10}: {speedup:8.2f}x, ' +
+            f'identical vocabulary {vocab["per-token"] == vocab["bulk"]}'
+        )
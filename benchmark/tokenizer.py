@@ -0,0 +1,150 @@
+r"""Benchmark slow and fast tokenizer backends.
+
+Both backends encode the same dataset with `fine_tune.task.encode_dataset`,
+throughput is reported as sentence pairs per second.
+
+Usage:
+    python -m benchmark.tokenizer
+    python -m benchmark.tokenizer --dataset dev_matched --num_workers 4
+
+Run `python -m benchmark.tokenizer -h` for help, or see
+'doc/fine_tune_mnli.md' for more information.
+"""
+
+# built-in modules
+
+import argparse
+import logging
+import time
+
+# 3rd party modules
+
+import numpy as np
+import torch
+import torch.utils
+import torch.utils.data
+
+# my own modules
+
+import fine_tune
+
+# Get main logger.
+logger = logging.getLogger('fine_tune.benchmark')
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+    datefmt='%Y/%m/%d %H:%M:%S',
+    level=logging.INFO
+)
+
+# Filter out message not begin with name 'fine_tune'.
+for handler in logging.getLogger().handlers:
+    handler.addFilter(logging.Filter('fine_tune'))
+
+if __name__ == '__main__':
+    # Parse arguments from STDIN.
+    parser = argparse.ArgumentParser()
+
+    # Optional parameters.
+    parser.add_argument(
+        '--task',
+        default='mnli',
+        help='Name of the fine-tune task.',
+        type=str,
+    )
+    parser.add_argument(
+        '--dataset',
+        default='train',
+        help='Dataset name of the fine-tune task.',
+        type=str,
+    )
+    parser.add_argument(
+        '--model',
+        default='bert',
+        help='Name of the model paired with tokenizer.',
+        type=str,
+    )
+    parser.add_argument(
+        '--ptrain_ver',
+        default='bert-base-uncased',
+        help='Pretrained tokenizer version provided by `transformers` ' +
+            'package.',
+        type=str,
+    )
+    parser.add_argument(
+        '--batch_size',
+        default=1000,
+        help='Number of samples to tokenize at once.',
+        type=int,
+    )
+    parser.add_argument(
+        '--max_seq_len',
+        default=128,
+        help='Maximum input sequence length.',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_sample',
+        default=0,
+        help='Number of samples to encode. Set to `0` to encode all samples.',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_workers',
+        default=0,
+        help='Number of dataloader worker processes running tokenizer.',
+        type=int,
+    )
+
+    # Parse arguments.
+    args = parser.parse_args()
+
+    # Load fine-tune dataset.
+    dataset = fine_tune.util.load_dataset(
+        dataset=args.dataset,
+        task=args.task
+    )
+    if args.num_sample:
+        dataset = torch.utils.data.Subset(
+            dataset,
+            range(min(args.num_sample, len(dataset)))
+        )
+    logger.info('Number of samples: %d', len(dataset))
+
+    encodings = {}
+    for backend, use_fast in [('slow', False), ('fast', True)]:
+        tokenizer = fine_tune.util.load_teacher_tokenizer(
+            model=args.model,
+            ptrain_ver=args.ptrain_ver,
+            use_fast=use_fast
+        )
+        if tokenizer.is_fast != use_fast:
+            logger.info('Skip %s backend: not available.', backend)
+            continue
+
+        start = time.perf_counter()
+        encodings[backend], _ = fine_tune.task.encode_dataset(
+            dataset=dataset,
+            max_seq_len=args.max_seq_len,
+            tokenizer=tokenizer,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers
+        )
+        elapsed = time.perf_counter() - start
+
+        logger.info(
+            '%s backend (%s): %.1f pairs/s, %.2f s',
+            backend,
+            tokenizer.__class__.__name__,
+            len(dataset) / elapsed,
+            elapsed
+        )
+
+    # Both backends must produce the same token ids.
+    if len(encodings) == 2:
+        logger.info(
+            'Backends produce identical encodings: %s',
+            all(
+                np.array_equal(slow, fast)
+                for slow, fast in zip(encodings['slow'], encodings['fast'])
+            )
+        )
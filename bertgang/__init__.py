@@ -6,4 +6,5 @@ from __future__ import unicode_literals
 from . import bertgang_config
 from . import bertgang_data
 from . import bertgang_model
+from . import bertgang_pack
 from . import bertgang_tokenizer
\ No newline at end of file
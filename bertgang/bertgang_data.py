@@ -2,6 +2,9 @@
 
 Use `bertgang.bertgang_data.PreTrainData` to create dataset for pre-train
 experiments.
+Use `bertgang.bertgang_data.PackedPreTrainData` to create dataset for
+pre-train experiments from data packed by
+`bertgang.bertgang_pack.pack_pre_train_data`.
 Use `bertgang.bertgang_data.FineTuneData` to create dataset for fine-tune
 experiments.
 
@@ -17,6 +20,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
+import os
 import pickle
 
 from typing import Dict
@@ -25,11 +30,13 @@ from typing import Optional
 from typing import Tuple
 from typing import Union
 
+import numpy as np
 import torch
 import torch.utils
 import torch.utils.data
 
 from . import bertgang_config
+from . import bertgang_pack
 from . import bertgang_tokenizer
 from . import bertgang_util
 
@@ -49,6 +56,10 @@ class PreTrainData(torch.utils.data.Dataset):
                 - teacher-n-name.pickle (a pickle file)
             - pre-train-data-2 (same structure as above)
             - pre-train-data-m (same structure as above)
+
+            Only directories in `path` are pre-train data. Other files in
+            `path` (e.g., manifest file) are skipped, whether `manifest_path`
+            is given or not.
         config (bertgang.bertgang_config.PreTrainConfig):
             Source of teachers list.
         tokenizer (bertgang.bertgang_tokenizer.Tokenizer):
@@ -63,6 +74,13 @@ class PreTrainData(torch.utils.data.Dataset):
             We suggest that only check pre-train data once and ignore checking
             for the rest processes.
             Default to False.
+        manifest_path (str):
+            Path of manifest file of `path`. When given, pre-train data
+            directories and their files are read from manifest instead of
+            listing every directory, and manifest is created or refreshed
+            incrementally if `path` changed. See
+            `bertgang.bertgang_util.load_manifest`.
+            Default to None.
 
     Attributes:
         path (str):
@@ -101,7 +119,8 @@ class PreTrainData(torch.utils.data.Dataset):
             config: bertgang_config.PreTrainConfig,
             tokenizer: bertgang_tokenizer.Tokenizer,
             ignore_files: Optional[List[str]] = None,
-            is_checking_files: bool = False
+            is_checking_files: bool = False,
+            manifest_path: Optional[str] = None
     ) -> None:
 
         # check parameters
@@ -122,10 +141,27 @@ class PreTrainData(torch.utils.data.Dataset):
         self.tokenizer = tokenizer
         self.path = path
 
-        all_dirs = bertgang_util.list_all_files(
-            path,
-            ignore_files=ignore_files
-        )
+        manifest = None
+        if manifest_path is None:
+            all_dirs = [
+                dir_name
+                for dir_name in bertgang_util.list_all_files(
+                    path,
+                    ignore_files=ignore_files
+                )
+                if os.path.isdir(os.path.join(path, dir_name))
+            ]
+        else:
+            manifest = bertgang_util.load_manifest(
+                path=path,
+                manifest_path=manifest_path
+            )
+            ignore_files = set(ignore_files or [])
+            all_dirs = [
+                dir_name
+                for dir_name in manifest
+                if dir_name not in ignore_files
+            ]
 
         self.idx_dir_mapping = {}
 
@@ -136,7 +172,10 @@ class PreTrainData(torch.utils.data.Dataset):
             dir_path = f'{path}/{dir_name}'
 
             if is_checking_files:
-                dir_files = bertgang_util.list_all_files(dir_path)
+                if manifest is None:
+                    dir_files = bertgang_util.list_all_files(dir_path)
+                else:
+                    dir_files = manifest[dir_name]
 
                 # Check original sequence file.
                 if 'original.pickle' not in dir_files:
@@ -193,9 +232,42 @@ class PreTrainData(torch.utils.data.Dataset):
         with open(f'{target_dir}/original.pickle', 'rb') as input_file:
             input_obj = pickle.load(input_file)
 
+        obj = self.encode_segments(
+            segment_a=input_obj['segment_a'],
+            segment_b=input_obj['segment_b']
+        )
+
+        for teacher in self.config.teachers:
+            with open(f'{target_dir}/{teacher}.pickle', 'rb') as output_file:
+                obj[f'{teacher}_output_embeds'] = torch.FloatTensor(
+                    pickle.load(output_file)
+                )
+
+        return obj
+
+    def encode_segments(
+            self,
+            segment_a: str,
+            segment_b: Optional[str]
+    ) -> Dict[str, torch.Tensor]:
+        """Encode segments into input tensors.
+
+        Args:
+            segment_a (str):
+                First segment of pre-train data.
+            segment_b (str):
+                Second segment of pre-train data. Can be None.
+
+        Returns:
+            dict:
+                Containing keys `attention_mask`, `input_ids` and
+                `token_type_ids`. See
+                `bertgang.bertgang_data.PreTrainData.__getitem__`.
+        """
+
         obj = self.tokenizer.encode_plus(
-            text=input_obj['segment_a'],
-            text_pair=input_obj['segment_b'],
+            text=segment_a,
+            text_pair=segment_b,
             add_special_tokens=True,
             max_length=self.config.max_position_embeddings,
             pad_to_max_length=True,
@@ -210,12 +282,6 @@ class PreTrainData(torch.utils.data.Dataset):
         # `torch.FloatTensor`, `obj['input_ids']` is type `torch.LongTensor`,
         # `obj['input_ids']` is type `torch.LongTensor`.
 
-        for teacher in self.config.teachers:
-            with open(f'{target_dir}/{teacher}.pickle', 'rb') as output_file:
-                obj[f'{teacher}_output_embeds'] = torch.FloatTensor(
-                    pickle.load(output_file)
-                )
-
         return obj
 
     @staticmethod
@@ -242,3 +308,155 @@ class PreTrainData(torch.utils.data.Dataset):
                                            collate_fn=self.__class__.collate_fn,
                                            drop_last=False,
                                            shuffle=True)
+
+
+class PackedPreTrainData(PreTrainData):
+    """Dataset class for pre-train experiments on packed pre-train data.
+
+    Same samples as `bertgang.bertgang_data.PreTrainData`, but read from
+    shard files created by `bertgang.bertgang_pack.pack_pre_train_data`
+    instead of one directory per pre-train data. Shard files are
+    memory-mapped, segments are decoded directly from the mapping and
+    teacher tensors share memory with the mapping (zero-copy).
+
+    Shard files are mapped lazily in each process, thus pickling dataset into
+    `torch.utils.data.DataLoader` workers does not copy any shard.
+
+    Args:
+        path (str):
+            Directory path containing packed pre-train data.
+        config (bertgang.bertgang_config.PreTrainConfig):
+            Source of teachers list.
+            All teachers must be packed in `path`.
+        tokenizer (bertgang.bertgang_tokenizer.Tokenizer):
+            Pre-trained tokenizer.
+
+    Attributes:
+        path (str):
+            Same as parameter `path`.
+        config (bertgang.bertgang_config.PreTrainConfig):
+            Same as parameter `config`.
+        tokenizer (bertgang.bertgang_tokenizer.Tokenizer):
+            Same as parameter `tokenizer`.
+        index (numpy.ndarray):
+            Memory-mapped offset index. See
+            `bertgang.bertgang_pack.index_dtype`.
+        num_shard (int):
+            Number of shard files.
+
+    Raises:
+        TypeError:
+            If `config` is not type
+            `bertgang.bertgang_config.PreTrainConfig`,
+            or `tokenizer` is not type
+            `bertgang.bertgang_tokenizer.Tokenizer`.
+        ValueError:
+            If packed format version does not match, or some teacher in
+            `config.teachers` is not packed.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            config: bertgang_config.PreTrainConfig,
+            tokenizer: bertgang_tokenizer.Tokenizer
+    ) -> None:
+
+        # check parameters
+        if not isinstance(config, bertgang_config.PreTrainConfig):
+            raise TypeError(
+                'parameter `config` must be type '
+                '`bertgang.bertgang_config.PreTrainConfig`.'
+            )
+
+        self.config = config
+
+        if not isinstance(tokenizer, bertgang_tokenizer.Tokenizer):
+            raise TypeError(
+                'parameter `tokenizer` must be type '
+                '`bertgang.bertgang_tokenizer.Tokenizer`.'
+            )
+
+        self.tokenizer = tokenizer
+        self.path = path
+
+        with open(f'{path}/meta.json', 'r', encoding='utf-8') as json_file:
+            meta = json.load(json_file)
+
+        if meta['version'] != bertgang_pack.VERSION:
+            raise ValueError(
+                f'packed data version {meta["version"]} in {path} does not '
+                f'match current version {bertgang_pack.VERSION}.'
+            )
+
+        for teacher in config.teachers:
+            if teacher not in meta['teachers']:
+                raise ValueError(f'{teacher} is not packed in {path}.')
+
+        self.num_shard = meta['num_shard']
+        self.index = np.load(f'{path}/index.npy', mmap_mode='r')
+
+        # Shards are mapped on first access of each process.
+        self.shards = None
+
+    def __getstate__(self) -> Dict:
+        """Drop shard mappings when pickled into other processes."""
+        state = self.__dict__.copy()
+        state['shards'] = None
+        return state
+
+    def __len__(self) -> int:
+        """Return pre-train data size."""
+        return len(self.index)
+
+    def __getitem__(
+            self,
+            idx: int
+    ) -> Dict[str, Union[str, torch.FloatTensor]]:
+        """Return input tensors and knowledge distillation target tensors.
+
+        Args:
+            idx (int):
+                Id of pre-train data.
+
+        Returns:
+            dict:
+                Same as `bertgang.bertgang_data.PreTrainData.__getitem__`.
+        """
+
+        if self.shards is None:
+            # Copy-on-write mapping is writable, thus `torch.from_numpy` can
+            # share memory with it. Writes never reach shard files.
+            self.shards = [
+                np.memmap(
+                    os.path.join(self.path, bertgang_pack.shard_name(shard)),
+                    dtype=np.uint8,
+                    mode='c'
+                )
+                for shard in range(self.num_shard)
+            ]
+
+        row = self.index[idx]
+        shard = self.shards[row['shard']]
+
+        def decode(field: str) -> Optional[str]:
+            start = row[f'{field}_offset']
+            size = row[f'{field}_size']
+            if size < 0:
+                return None
+            return str(memoryview(shard[start:start + size]), 'utf-8')
+
+        obj = self.encode_segments(
+            segment_a=decode('segment_a'),
+            segment_b=decode('segment_b')
+        )
+
+        for teacher in self.config.teachers:
+            shape = tuple(row[f'{teacher}_shape'].tolist())
+            start = row[f'{teacher}_offset']
+            size = int(np.prod(shape, dtype=np.int64)) * 4
+            obj[f'{teacher}_output_embeds'] = torch.from_numpy(
+                shard[start:start + size].view(np.float32).reshape(shape)
+            )
+
+        return obj
@@ -0,0 +1,270 @@
+"""Pack pre-train data into sharded binary files.
+
+`bertgang.bertgang_data.PreTrainData` reads one directory per pre-train data,
+which opens and unpickles 1 + len(teachers) files for every sample.
+`bertgang.bertgang_pack.pack_pre_train_data` converts those directories into
+a few large shard files with an offset index, which are read by
+`bertgang.bertgang_data.PackedPreTrainData` through memory mapping.
+
+Packed directory has the following structure:
+
+- meta.json (format version, teachers and shapes of index)
+- index.npy (`numpy` structured array, one row per pre-train data)
+- shard-00000.bin (raw bytes of segments and teacher tensors)
+- shard-n.bin (same format as above)
+
+Each row of `index.npy` contains the shard id, the byte offset and size of
+`segment_a` and `segment_b`, and the byte offset and shape of each teacher
+tensor in that shard. Segments are stored as UTF-8 bytes and teacher tensors
+as C-contiguous `float32` arrays aligned to `ALIGNMENT` bytes.
+
+Attributes:
+
+    ALIGNMENT (int):
+        Byte alignment of each field in shard files.
+    VERSION (int):
+        Packed format version. Packed data with different version must be
+        packed again.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import pickle
+import shutil
+
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+from tqdm import tqdm
+
+from . import bertgang_util
+
+ALIGNMENT = 8
+
+VERSION = 1
+
+
+def index_dtype(teacher_ndims: Dict[str, int]) -> np.dtype:
+    """Get `numpy` structured type of `index.npy`.
+
+    Args:
+        teacher_ndims (dict):
+            Key and value pairs, where key is the teacher name, and the value
+            is the number of dimensions of the teacher tensor.
+
+    Returns:
+        numpy.dtype:
+            One row per pre-train data. `segment_b_size` is `-1` when
+            `segment_b` is `None`.
+    """
+    fields = [
+        ('shard', '<i4'),
+        ('segment_a_offset', '<i8'),
+        ('segment_a_size', '<i8'),
+        ('segment_b_offset', '<i8'),
+        ('segment_b_size', '<i8'),
+    ]
+    for teacher, ndim in teacher_ndims.items():
+        fields.append((f'{teacher}_offset', '<i8'))
+        fields.append((f'{teacher}_shape', '<i8', (ndim,)))
+    return np.dtype(fields)
+
+
+def shard_name(shard: int) -> str:
+    """Get file name of a shard.
+
+    Args:
+        shard (int):
+            Shard id.
+
+    Returns:
+        str:
+            Shard file name.
+    """
+    return f'shard-{shard:05d}.bin'
+
+
+def _write_aligned(shard_file: BinaryIO, data: bytes) -> int:
+    """Write `data` at the next aligned position.
+
+    Args:
+        shard_file (BinaryIO):
+            Shard file opened in binary write mode.
+        data (bytes):
+            Bytes to be written.
+
+    Returns:
+        int:
+            Byte offset of `data` in shard file.
+    """
+    offset = shard_file.tell()
+    padding = -offset % ALIGNMENT
+    if padding:
+        shard_file.write(b'\0' * padding)
+        offset += padding
+    shard_file.write(data)
+    return offset
+
+
+def pack_pre_train_data(
+        src_path: str,
+        dst_path: str,
+        teachers: List[str],
+        ignore_files: Optional[List[str]] = None,
+        shard_size: int = 1 << 30
+) -> int:
+    """Pack pre-train data directories into sharded binary files.
+
+    Packed data is written into a temporary directory first and then renamed
+    to `dst_path`, thus an interrupted packing never leaves partial packed
+    data behind. Existing `dst_path` is replaced.
+
+    Args:
+        src_path (str):
+            Directory path containing pre-train data. See
+            `bertgang.bertgang_data.PreTrainData` for the structure.
+        dst_path (str):
+            Directory path to save packed data.
+        teachers (list[str]):
+            Teachers whose tensors are packed.
+        ignore_files (list(str)):
+            Directories need to be ignored from `src_path`.
+            Default to None.
+        shard_size (int):
+            A new shard is started once current shard exceeds `shard_size`
+            bytes. A single pre-train data is never split across shards.
+            Default to 1 GiB.
+
+    Raises:
+        FileNotFoundError:
+            If `src_path` does not exist, or some pre-train data is missing
+            `original.pickle` or teacher files.
+        ValueError:
+            If `teachers` is an empty list, `shard_size` is not a positive
+            integer, or teacher tensors have different number of dimensions.
+
+    Returns:
+        int:
+            Number of packed pre-train data.
+    """
+    # check parameters
+    if len(teachers) == 0:
+        raise ValueError(
+            'parameter `teachers` must have at least one teacher.'
+        )
+
+    if shard_size <= 0:
+        raise ValueError(
+            'parameter `shard_size` must be a positive integer.')
+
+    all_dirs = bertgang_util.list_all_files(
+        src_path,
+        ignore_files=ignore_files
+    )
+
+    tmp_path = f'{dst_path}.tmp-{os.getpid()}'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    rows = []
+    teacher_ndims = {}
+    shard = 0
+    shard_file = open(os.path.join(tmp_path, shard_name(shard)), 'wb')
+    try:
+        for dir_name in tqdm(all_dirs, desc='Packing'):
+            dir_path = f'{src_path}/{dir_name}'
+
+            with open(f'{dir_path}/original.pickle', 'rb') as input_file:
+                input_obj = pickle.load(input_file)
+
+            segment_a = input_obj['segment_a'].encode('utf-8')
+            segment_b = input_obj['segment_b']
+            if segment_b is not None:
+                segment_b = segment_b.encode('utf-8')
+
+            embeds = {}
+            for teacher in teachers:
+                with open(f'{dir_path}/{teacher}.pickle', 'rb') as output_file:
+                    embeds[teacher] = np.ascontiguousarray(
+                        pickle.load(output_file),
+                        dtype=np.float32
+                    )
+                ndim = teacher_ndims.setdefault(teacher, embeds[teacher].ndim)
+                if embeds[teacher].ndim != ndim:
+                    raise ValueError(
+                        f'`{teacher}.pickle` in {dir_path} has ' +
+                        f'{embeds[teacher].ndim} dimensions, expect {ndim}.'
+                    )
+
+            # Start a new shard when current shard is full.
+            if shard_file.tell() >= shard_size:
+                shard_file.close()
+                shard += 1
+                shard_file = open(
+                    os.path.join(tmp_path, shard_name(shard)),
+                    'wb'
+                )
+
+            row = {
+                'shard': shard,
+                'segment_a_offset': _write_aligned(shard_file, segment_a),
+                'segment_a_size': len(segment_a),
+                'segment_b_offset': 0,
+                'segment_b_size': -1,
+            }
+            if segment_b is not None:
+                row['segment_b_offset'] = _write_aligned(shard_file, segment_b)
+                row['segment_b_size'] = len(segment_b)
+            for teacher in teachers:
+                row[f'{teacher}_offset'] = _write_aligned(
+                    shard_file,
+                    embeds[teacher].tobytes()
+                )
+                row[f'{teacher}_shape'] = embeds[teacher].shape
+            rows.append(row)
+    finally:
+        shard_file.close()
+
+    # No pre-train data to infer number of dimensions from.
+    for teacher in teachers:
+        teacher_ndims.setdefault(teacher, 0)
+
+    dtype = index_dtype(teacher_ndims)
+    index = np.zeros(len(rows), dtype=dtype)
+    for idx, row in enumerate(rows):
+        for name, value in row.items():
+            index[idx][name] = value
+    np.save(os.path.join(tmp_path, 'index.npy'), index)
+
+    with open(
+            os.path.join(tmp_path, 'meta.json'),
+            'w',
+            encoding='utf-8'
+    ) as json_file:
+        json.dump(
+            {
+                'num_shard': shard + 1,
+                'teacher_ndims': teacher_ndims,
+                'teachers': teachers,
+                'version': VERSION,
+            },
+            json_file,
+            ensure_ascii=False
+        )
+
+    # Replace stale packed data if any.
+    if os.path.exists(dst_path):
+        shutil.rmtree(dst_path)
+    os.rename(tmp_path, dst_path)
+
+    return len(rows)
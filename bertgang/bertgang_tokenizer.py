@@ -11,11 +11,59 @@ from __future__ import unicode_literals
 
 import re
 
+from typing import List
+
 import transformers
 
 from . import bertgang_config
 
 
+def normalize_teacher_vocab(
+        teacher_tokenizer: transformers.PreTrainedTokenizer,
+        teacher_sp_indicator: str,
+        sp_indicator: str,
+        do_lower_case: bool
+) -> List[str]:
+    """Convert teacher vocabulary into tokens with `sp_indicator`.
+
+    All ids are converted in one `convert_ids_to_tokens` call, special ids are
+    skipped through a set lookup and duplicated tokens are removed.
+
+    Args:
+        teacher_tokenizer (transformers.PreTrainedTokenizer):
+            Tokenizer of teacher.
+        teacher_sp_indicator (str):
+            sentencepiece indicator of `teacher_tokenizer`. Treated as regular
+            expression and removed from each token.
+        sp_indicator (str):
+            sentencepiece indicator prepended to each token.
+        do_lower_case (bool):
+            Whether to convert tokens to lower case.
+
+    Returns:
+        list[str]:
+            Normalized tokens in teacher vocabulary order without duplicates.
+    """
+
+    special_ids = set(teacher_tokenizer.all_special_ids)
+    ids = [
+        idx
+        for idx in range(teacher_tokenizer.vocab_size)
+        if idx not in special_ids
+    ]
+    pattern = re.compile(teacher_sp_indicator)
+
+    tokens = []
+    for token in teacher_tokenizer.convert_ids_to_tokens(ids):
+        token = pattern.sub('', token)
+        if do_lower_case:
+            token = token.lower()
+        tokens.append(sp_indicator + token)
+
+    # `dict` keeps insertion order, thus result is deterministic.
+    return list(dict.fromkeys(tokens))
+
+
 class Tokenizer(transformers.AlbertTokenizer):
     """Tokenizer class for both pre-train and fine-tune experiments.
 
@@ -48,9 +96,13 @@ class Tokenizer(transformers.AlbertTokenizer):
             self,
             config: bertgang_config.PreTrainConfig,
             **kwargs
-    ) -> None:
+    ) -> int:
         """Learn sentencepiece from all teachers.
 
+        Vocabularies of all teachers are normalized by
+        `bertgang.bertgang_tokenizer.normalize_teacher_vocab`, merged without
+        duplicates and added by a single `add_tokens` call.
+
         Args:
             config (bertgang_config.PreTrainConfig):
                 Source of teachers list.
@@ -59,6 +111,10 @@ class Tokenizer(transformers.AlbertTokenizer):
             TypeError:
                 If `config` is not type `bertgang_config.PreTrainConfig`.
 
+        Returns:
+            int:
+                Number of tokens added to the vocabulary.
+
         TODO: This method does not work as expected.
         """
 
@@ -72,20 +128,17 @@ class Tokenizer(transformers.AlbertTokenizer):
         albert_sp_indicator = (bertgang_config
                                .VALID_TEACHERS['albert']['sp_indicator'])
 
+        tokens = {}
         for teacher in config.teachers:
-            teacher_tokenizer = config.get_teacher_tokenizer_instance(teacher)
-            teacher_sp_indicator = config.get_teacher_sp_indicator(teacher)
-
-            for idx in range(teacher_tokenizer.vocab_size):
-                if idx in teacher_tokenizer.all_special_ids:
-                    continue
-
-                token = teacher_tokenizer.convert_ids_to_tokens([idx])[0]
-                token = re.sub(teacher_sp_indicator, '', token)
-                if config.do_lower_case:
-                    token = token.lower()
-                token = albert_sp_indicator + token
-
-                # TODO: this does not change the actual sentencepiece
-                # model, so we must train a sentencepiece model.
-                self.add_tokens([token])
+            tokens.update(dict.fromkeys(normalize_teacher_vocab(
+                teacher_tokenizer=config.get_teacher_tokenizer_instance(
+                    teacher
+                ),
+                teacher_sp_indicator=config.get_teacher_sp_indicator(teacher),
+                sp_indicator=albert_sp_indicator,
+                do_lower_case=config.do_lower_case
+            )))
+
+        # TODO: this does not change the actual sentencepiece
+        # model, so we must train a sentencepiece model.
+        return self.add_tokens(list(tokens))
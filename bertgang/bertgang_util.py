@@ -4,11 +4,15 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 
+import json
 import os
 import random
 
+from typing import Dict
+from typing import FrozenSet
 from typing import List
 from typing import Optional
+from typing import Tuple
 
 import torch
 import transformers
@@ -61,11 +65,222 @@ def list_all_files(path: str,
                 raise TypeError(
                     'parameter `ignore_files` must be type `list[str]`.')
 
-    all_files = os.listdir(path)
-    all_files = sorted(all_files)
+    ignore_files = set(ignore_files)
 
-    for ignore_file in ignore_files:
-        if ignore_file in all_files:
-            all_files.remove(ignore_file)
+    return sorted(
+        file_name
+        for file_name in os.listdir(path)
+        if file_name not in ignore_files
+    )
 
-    return all_files
+
+MANIFEST_VERSION = 1
+
+# Manifest entry of each pre-train data directory: modification time in
+# nanoseconds and file names in that directory.
+ManifestEntry = Tuple[int, FrozenSet[str]]
+
+
+def _read_manifest(
+        manifest_path: str
+) -> Tuple[int, Dict[str, ManifestEntry]]:
+    """Read manifest file.
+
+    Manifest file starts with a JSON header line containing format version,
+    modification time of pre-train data directory and distinct file sets.
+    Each following line is `name\tmtime_ns\tfile_set_id` of one pre-train
+    data directory, sorted by name. Identical file sets are stored once,
+    which keeps manifest small since most directories have the same files.
+
+    Args:
+        manifest_path (str):
+            Path of manifest file.
+
+    Raises:
+        FileNotFoundError:
+            If `manifest_path` does not exist.
+        ValueError:
+            If manifest version does not match or manifest is corrupted.
+
+    Returns:
+        tuple(int, dict):
+            Modification time of pre-train data directory in nanoseconds and
+            manifest entry of each pre-train data directory.
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+        header = json.loads(manifest_file.readline())
+        if header.get('version') != MANIFEST_VERSION:
+            raise ValueError(
+                f'manifest version in {manifest_path} does not match '
+                f'current version {MANIFEST_VERSION}.'
+            )
+
+        file_sets = [frozenset(files) for files in header['file_sets']]
+        entries = {}
+        for line in manifest_file:
+            name, mtime_ns, file_set_id = line.rstrip('\n').split('\t')
+            entries[name] = (int(mtime_ns), file_sets[int(file_set_id)])
+
+    if len(entries) != header['num_dirs']:
+        raise ValueError(f'manifest {manifest_path} is incomplete.')
+
+    return header['root_mtime_ns'], entries
+
+
+def _write_manifest(
+        manifest_path: str,
+        root_mtime_ns: int,
+        entries: Dict[str, ManifestEntry]
+) -> None:
+    """Write manifest file.
+
+    Manifest is written into a temporary file first and then renamed, thus
+    an interrupted write never leaves a partial manifest behind.
+
+    Args:
+        manifest_path (str):
+            Path of manifest file.
+        root_mtime_ns (int):
+            Modification time of pre-train data directory in nanoseconds.
+        entries (dict):
+            Manifest entry of each pre-train data directory, sorted by name.
+
+    Raises:
+        ValueError:
+            If some directory name contains tab or newline.
+    """
+    file_set_ids = {}
+    for _, files in entries.values():
+        file_set_ids.setdefault(files, len(file_set_ids))
+
+    tmp_path = f'{manifest_path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+        manifest_file.write(json.dumps(
+            {
+                'file_sets': [sorted(files) for files in file_set_ids],
+                'num_dirs': len(entries),
+                'root_mtime_ns': root_mtime_ns,
+                'version': MANIFEST_VERSION,
+            },
+            ensure_ascii=False
+        ) + '\n')
+
+        for name, (mtime_ns, files) in entries.items():
+            if '\t' in name or '\n' in name:
+                raise ValueError(
+                    f'directory name {name!r} must not contain tab or newline.'
+                )
+            manifest_file.write(f'{name}\t{mtime_ns}\t{file_set_ids[files]}\n')
+
+    os.replace(tmp_path, manifest_path)
+
+
+def refresh_manifest(
+        path: str,
+        manifest_path: str
+) -> Dict[str, FrozenSet[str]]:
+    """Scan pre-train data directory and update manifest incrementally.
+
+    Directories are enumerated with `os.scandir`. Only directories which are
+    new or whose modification time changed since last refresh are listed
+    again, all others reuse their manifest entries.
+
+    Args:
+        path (str):
+            Path of a directory which containing pretrain data.
+        manifest_path (str):
+            Path of manifest file. Created if not exists.
+
+    Raises:
+        FileNotFoundError:
+            If `path` does not exist.
+
+    Returns:
+        dict:
+            File names of each pre-train data directory, sorted by directory
+            name.
+    """
+    try:
+        _, old_entries = _read_manifest(manifest_path)
+    except (FileNotFoundError, IndexError, KeyError, ValueError):
+        old_entries = {}
+
+    # Take modification time before scanning, so that changes during
+    # scanning are picked up by next refresh.
+    root_mtime_ns = os.stat(path).st_mtime_ns
+
+    # Share identical file sets between directories.
+    file_sets = {}
+    entries = {}
+    with os.scandir(path) as dir_entries:
+        for dir_entry in dir_entries:
+            if not dir_entry.is_dir():
+                continue
+
+            mtime_ns = dir_entry.stat().st_mtime_ns
+            old_entry = old_entries.get(dir_entry.name)
+            if old_entry is not None and old_entry[0] == mtime_ns:
+                files = old_entry[1]
+            else:
+                with os.scandir(dir_entry.path) as file_entries:
+                    files = frozenset(
+                        file_entry.name for file_entry in file_entries
+                    )
+            entries[dir_entry.name] = (
+                mtime_ns,
+                file_sets.setdefault(files, files),
+            )
+
+    entries = dict(sorted(entries.items()))
+    _write_manifest(
+        manifest_path=manifest_path,
+        root_mtime_ns=root_mtime_ns,
+        entries=entries
+    )
+
+    return {name: files for name, (_, files) in entries.items()}
+
+
+def load_manifest(
+        path: str,
+        manifest_path: str,
+        refresh: bool = False
+) -> Dict[str, FrozenSet[str]]:
+    """Load manifest of pre-train data directory.
+
+    When modification time of `path` is unchanged, i.e., no directory was
+    added or removed, manifest is returned with a single file read.
+    Otherwise manifest is refreshed by
+    `bertgang.bertgang_util.refresh_manifest`.
+
+    Files added into or removed from an existing pre-train data directory do
+    not change modification time of `path`. Set `refresh` to `True` to pick
+    up such changes.
+
+    Args:
+        path (str):
+            Path of a directory which containing pretrain data.
+        manifest_path (str):
+            Path of manifest file. Created if not exists.
+        refresh (bool):
+            Whether to always refresh manifest.
+            Default to False.
+
+    Raises:
+        FileNotFoundError:
+            If `path` does not exist.
+
+    Returns:
+        dict:
+            File names of each pre-train data directory, sorted by directory
+            name.
+    """
+    if not refresh:
+        try:
+            root_mtime_ns, entries = _read_manifest(manifest_path)
+            if root_mtime_ns == os.stat(path).st_mtime_ns:
+                return {name: files for name, (_, files) in entries.items()}
+        except (FileNotFoundError, IndexError, KeyError, ValueError):
+            pass
+
+    return refresh_manifest(path=path, manifest_path=manifest_path)
@@ -47,8 +47,8 @@ class BaseConfig:
             whole batch. `accum_step` must be bigger than or equal to `1`;
             `accum_step` must be smaller than or equal to `batch_size`.
         amp:
-            A boolean flag to indicate whether using `torch.cuda.amp` package
-            in both train and inference.
+            A boolean flag to indicate whether using automatic mixed
+            precision in both train and inference. See `fine_tune.util.amp`.
         batch_size:
             Training batch size. `batch_size` must be bigger than or equal to
             `1`; `batch_size` must be greater than or equal to `accum_step`.
@@ -58,6 +58,11 @@ class BaseConfig:
         beta2:
             Optimizer `torch.optim.AdamW`'s beta coefficients
             `beta2` must be ranging from `0` to `1` (inclusive).
+        bucket_size:
+            Number of samples in each length bucket. Training samples in the
+            same bucket are sorted by length before cut into mini-batches.
+            Set `bucket_size=0` to disable length bucketing. `bucket_size`
+            must be bigger than or equal to `0`.
         ckpt_step:
             Checkpoint save interval. `ckpt_step` must be bigger than or equal
             to `1`.
@@ -71,9 +76,23 @@ class BaseConfig:
         eps:
             Optimizer `torch.optim.AdamW`'s epsilon. `eps` must be bigger than
             `0`.
+        eval_dataset:
+            Dataset name evaluated at every checkpoint during training. Its
+            accuracy selects the best checkpoints kept by `keep_best`. Set
+            `eval_dataset=''` to disable evaluation during training.
         experiment:
             Name of the current experiment. `experiment` must not be empty
             string.
+        keep_best:
+            Number of checkpoints with the highest `eval_dataset` accuracy
+            kept in addition to the latest `keep_last` checkpoints. Only used
+            when `keep_last > 0`. `keep_best` must be bigger than or equal to
+            `0`; `eval_dataset` must not be empty string when `keep_best > 0`.
+        keep_last:
+            Number of latest checkpoints to keep. Older checkpoints which are
+            not among the best `keep_best` ones are deleted during training.
+            Set `keep_last=0` to keep all checkpoints. `keep_last` must be
+            bigger than or equal to `0`.
         log_step:
             Logging interval. `log_step` must be bigger than or equal to `1`.
         lr:
@@ -85,6 +104,13 @@ class BaseConfig:
         max_seq_len:
             Maximum input sequence length of model input. `max_seq_len` must be
             bigger than or equal to `1`.
+        max_tokens_per_batch:
+            Maximum number of padded tokens in each mini-batch. When set,
+            mini-batches have variable number of samples while each optimizer
+            step still sees `batch_size` samples. Set
+            `max_tokens_per_batch=0` to use fixed `batch_size // accum_step`
+            mini-batches. `max_tokens_per_batch` must be `0` or bigger than or
+            equal to `max_seq_len`.
         model:
             Model name of the current experiment.
         num_class:
@@ -94,6 +120,32 @@ class BaseConfig:
             Number of GPUs to perform training. `num_gpu` must be bigger than
             or equal to `0`. Set `num_gpu=0` if you wish to perform training on
             CPU instead.
+        num_workers:
+            Number of `torch.utils.data.DataLoader` worker processes. Workers
+            tokenize dataset when building token cache and gather mini-batches
+            during training. Same number of processes parse dataset files.
+            Set `num_workers=0` to load data in main process. `num_workers`
+            must be bigger than or equal to `0`.
+        pad_to_multiple_of:
+            Round padded sequence length up to a multiple of
+            `pad_to_multiple_of` (e.g., `8` or `64` for tensor cores). Only
+            used when `padding == 'longest'`. `pad_to_multiple_of` must be
+            bigger than or equal to `1`.
+        padding:
+            Padding strategy of mini-batch. Set to `'longest'` to pad each
+            mini-batch to its longest sequence; set to `'max_length'` to pad
+            every mini-batch to `max_seq_len`. `padding` must be either
+            `'longest'` or `'max_length'`.
+        persistent_workers:
+            Keep `torch.utils.data.DataLoader` workers alive across epochs.
+            Only used when `num_workers > 0`.
+        pin_memory:
+            Gather mini-batches into page-locked memory so that host to GPU
+            copy can be asynchronous. Only used on CUDA device.
+        prefetch_factor:
+            Number of mini-batches loaded in advance by each worker. Only used
+            when `num_workers > 0`. `prefetch_factor` must be bigger than or
+            equal to `1`.
         seed:
             Control random seed. `seed` must be bigger than or equal to `1`.
         task:
@@ -128,18 +180,29 @@ class BaseConfig:
             batch_size: int = 32,
             beta1: float = 0.9,
             beta2: float = 0.999,
+            bucket_size: int = 0,
             ckpt_step: int = 1000,
             dataset: str = '',
             dropout: float = 0.1,
             eps: float = 1e-8,
+            eval_dataset: str = '',
             experiment: str = '',
+            keep_best: int = 0,
+            keep_last: int = 0,
             log_step: int = 500,
             lr: float = 3e-5,
             max_norm: float = 1.0,
             max_seq_len: int = 512,
+            max_tokens_per_batch: int = 0,
             model: str = '',
             num_class: int = 2,
             num_gpu: int = 0,
+            num_workers: int = 0,
+            pad_to_multiple_of: int = 1,
+            padding: str = 'longest',
+            persistent_workers: bool = False,
+            pin_memory: bool = False,
+            prefetch_factor: int = 2,
             seed: int = 42,
             task: str = '',
             total_step: int = 50000,
@@ -153,18 +216,35 @@ class BaseConfig:
         self.__class__.type_check(batch_size, 'batch_size', int)
         self.__class__.type_check(beta1, 'beta1', float)
         self.__class__.type_check(beta2, 'beta2', float)
+        self.__class__.type_check(bucket_size, 'bucket_size', int)
         self.__class__.type_check(ckpt_step, 'ckpt_step', int)
         self.__class__.type_check(dataset, 'dataset', str)
         self.__class__.type_check(dropout, 'dropout', float)
         self.__class__.type_check(eps, 'eps', float)
+        self.__class__.type_check(eval_dataset, 'eval_dataset', str)
         self.__class__.type_check(experiment, 'experiment', str)
+        self.__class__.type_check(keep_best, 'keep_best', int)
+        self.__class__.type_check(keep_last, 'keep_last', int)
         self.__class__.type_check(log_step, 'log_step', int)
         self.__class__.type_check(lr, 'lr', float)
         self.__class__.type_check(max_norm, 'max_norm', float)
         self.__class__.type_check(max_seq_len, 'max_seq_len', int)
+        self.__class__.type_check(
+            max_tokens_per_batch,
+            'max_tokens_per_batch',
+            int
+        )
         self.__class__.type_check(model, 'model', str)
         self.__class__.type_check(num_class, 'num_class', int)
         self.__class__.type_check(num_gpu, 'num_gpu', int)
+        self.__class__.type_check(num_workers, 'num_workers', int)
+        self.__class__.type_check(
+            pad_to_multiple_of, 'pad_to_multiple_of', int)
+        self.__class__.type_check(padding, 'padding', str)
+        self.__class__.type_check(
+            persistent_workers, 'persistent_workers', bool)
+        self.__class__.type_check(pin_memory, 'pin_memory', bool)
+        self.__class__.type_check(prefetch_factor, 'prefetch_factor', int)
         self.__class__.type_check(seed, 'seed', int)
         self.__class__.type_check(task, 'task', str)
         self.__class__.type_check(total_step, 'total_step', int)
@@ -197,6 +277,11 @@ class BaseConfig:
                 '`beta2` must be ranging from `0` to `1` (inclusive).'
             )
 
+        if bucket_size < 0:
+            raise ValueError(
+                '`bucket_size` must be bigger than or equal to `0`.'
+            )
+
         if ckpt_step < 1:
             raise ValueError(
                 '`ckpt_step` must be bigger than or equal to `1`.'
@@ -222,6 +307,22 @@ class BaseConfig:
                 '`experiment` must not be empty string.'
             )
 
+        if keep_best < 0:
+            raise ValueError(
+                '`keep_best` must be bigger than or equal to `0`.'
+            )
+
+        if keep_best > 0 and not eval_dataset:
+            raise ValueError(
+                '`eval_dataset` must not be empty string when ' +
+                '`keep_best > 0`.'
+            )
+
+        if keep_last < 0:
+            raise ValueError(
+                '`keep_last` must be bigger than or equal to `0`.'
+            )
+
         if log_step < 1:
             raise ValueError(
                 '`log_step` must be bigger than or equal to `1`.'
@@ -242,6 +343,12 @@ class BaseConfig:
                 '`max_seq_len` must be bigger than or equal to `1`.'
             )
 
+        if max_tokens_per_batch < 0 or 0 < max_tokens_per_batch < max_seq_len:
+            raise ValueError(
+                '`max_tokens_per_batch` must be `0` or bigger than or equal ' +
+                'to `max_seq_len`.'
+            )
+
         if not model:
             raise ValueError(
                 '`model` must not be empty string.'
@@ -262,6 +369,26 @@ class BaseConfig:
                 'CUDA device not found, set `num_gpu` to `0`.'
             )
 
+        if num_workers < 0:
+            raise ValueError(
+                '`num_workers` must be bigger than or equal to `0`.'
+            )
+
+        if pad_to_multiple_of < 1:
+            raise ValueError(
+                '`pad_to_multiple_of` must be bigger than or equal to `1`.'
+            )
+
+        if padding not in ['longest', 'max_length']:
+            raise ValueError(
+                "`padding` must be either 'longest' or 'max_length'."
+            )
+
+        if prefetch_factor < 1:
+            raise ValueError(
+                '`prefetch_factor` must be bigger than or equal to `1`.'
+            )
+
         if seed < 1:
             raise ValueError(
                 '`seed` must be bigger than or equal to `1`.'
@@ -292,18 +419,29 @@ class BaseConfig:
         self.batch_size = batch_size
         self.beta1 = beta1
         self.beta2 = beta2
+        self.bucket_size = bucket_size
         self.ckpt_step = ckpt_step
         self.dataset = dataset
         self.dropout = dropout
         self.eps = eps
+        self.eval_dataset = eval_dataset
         self.experiment = experiment
+        self.keep_best = keep_best
+        self.keep_last = keep_last
         self.log_step = log_step
         self.lr = lr
         self.max_norm = max_norm
         self.max_seq_len = max_seq_len
+        self.max_tokens_per_batch = max_tokens_per_batch
         self.model = model
         self.num_class = num_class
         self.num_gpu = num_gpu
+        self.num_workers = num_workers
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.padding = padding
+        self.persistent_workers = persistent_workers
+        self.pin_memory = pin_memory
+        self.prefetch_factor = prefetch_factor
         self.seed = seed
         self.task = task
         self.total_step = total_step
@@ -344,18 +482,29 @@ class BaseConfig:
         yield 'batch_size', self.batch_size
         yield 'beta1', self.beta1
         yield 'beta2', self.beta2
+        yield 'bucket_size', self.bucket_size
         yield 'ckpt_step', self.ckpt_step
         yield 'dataset', self.dataset
         yield 'dropout', self.dropout
         yield 'eps', self.eps
+        yield 'eval_dataset', self.eval_dataset
         yield 'experiment', self.experiment
+        yield 'keep_best', self.keep_best
+        yield 'keep_last', self.keep_last
         yield 'log_step', self.log_step
         yield 'lr', self.lr
         yield 'max_norm', self.max_norm
         yield 'max_seq_len', self.max_seq_len
+        yield 'max_tokens_per_batch', self.max_tokens_per_batch
         yield 'model', self.model
         yield 'num_class', self.num_class
         yield 'num_gpu', self.num_gpu
+        yield 'num_workers', self.num_workers
+        yield 'pad_to_multiple_of', self.pad_to_multiple_of
+        yield 'padding', self.padding
+        yield 'persistent_workers', self.persistent_workers
+        yield 'pin_memory', self.pin_memory
+        yield 'prefetch_factor', self.prefetch_factor
         yield 'seed', self.seed
         yield 'task', self.task
         yield 'total_step', self.total_step
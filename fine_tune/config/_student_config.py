@@ -35,8 +35,8 @@ class StudentConfig(BaseConfig):
             whole batch. `accum_step` must be bigger than or equal to `1`;
             `accum_step` must be smaller than or equal to `batch_size`.
         amp:
-            A boolean flag to indicate whether using `torch.cuda.amp` package
-            in both train and inference.
+            A boolean flag to indicate whether using automatic mixed
+            precision in both train and inference. See `fine_tune.util.amp`.
         batch_size:
             Distillation batch size. `batch_size` must be bigger than or equal
             to `1`; `batch_size` must be greater than or equal to `accum_step`.
@@ -46,6 +46,11 @@ class StudentConfig(BaseConfig):
         beta2:
             Optimizer `torch.optim.AdamW`'s beta coefficients
             `beta2` must be ranging from `0` to `1` (inclusive).
+        bucket_size:
+            Number of samples in each length bucket. Training samples in the
+            same bucket are sorted by length before cut into mini-batches.
+            Set `bucket_size=0` to disable length bucketing. `bucket_size`
+            must be bigger than or equal to `0`.
         ckpt_step:
             Checkpoint save interval. `ckpt_step` must be bigger than or equal
             to `1`.
@@ -68,9 +73,23 @@ class StudentConfig(BaseConfig):
         eps:
             Optimizer `torch.optim.AdamW`'s epsilon. `eps` must be bigger than
             `0`.
+        eval_dataset:
+            Dataset name evaluated at every checkpoint during training. Its
+            accuracy selects the best checkpoints kept by `keep_best`. Set
+            `eval_dataset=''` to disable evaluation during training.
         experiment:
             Name of the current experiment. `experiment` must not be empty
             string.
+        keep_best:
+            Number of checkpoints with the highest `eval_dataset` accuracy
+            kept in addition to the latest `keep_last` checkpoints. Only used
+            when `keep_last > 0`. `keep_best` must be bigger than or equal to
+            `0`; `eval_dataset` must not be empty string when `keep_best > 0`.
+        keep_last:
+            Number of latest checkpoints to keep. Older checkpoints which are
+            not among the best `keep_best` ones are deleted during training.
+            Set `keep_last=0` to keep all checkpoints. `keep_last` must be
+            bigger than or equal to `0`.
         log_step:
             Logging interval. `log_step` must be bigger than or equal to `1`.
         lr:
@@ -82,6 +101,13 @@ class StudentConfig(BaseConfig):
         max_seq_len:
             Maximum input sequence length of model input. `max_seq_len` must be
             bigger than or equal to `1`.
+        max_tokens_per_batch:
+            Maximum number of padded tokens in each mini-batch. When set,
+            mini-batches have variable number of samples while each optimizer
+            step still sees `batch_size` samples. Set
+            `max_tokens_per_batch=0` to use fixed `batch_size // accum_step`
+            mini-batches. `max_tokens_per_batch` must be `0` or bigger than or
+            equal to `max_seq_len`.
         model:
             Model name of the current experiment.
         num_attention_heads:
@@ -97,6 +123,32 @@ class StudentConfig(BaseConfig):
         num_hidden_layers:
             Number of Transformer layers.
             Must be bigger than or equal to `1`.
+        num_workers:
+            Number of `torch.utils.data.DataLoader` worker processes. Workers
+            tokenize dataset when building token cache and gather mini-batches
+            during training. Same number of processes parse dataset files.
+            Set `num_workers=0` to load data in main process. `num_workers`
+            must be bigger than or equal to `0`.
+        pad_to_multiple_of:
+            Round padded sequence length up to a multiple of
+            `pad_to_multiple_of` (e.g., `8` or `64` for tensor cores). Only
+            used when `padding == 'longest'`. `pad_to_multiple_of` must be
+            bigger than or equal to `1`.
+        padding:
+            Padding strategy of mini-batch. Set to `'longest'` to pad each
+            mini-batch to its longest sequence; set to `'max_length'` to pad
+            every mini-batch to `max_seq_len`. `padding` must be either
+            `'longest'` or `'max_length'`.
+        persistent_workers:
+            Keep `torch.utils.data.DataLoader` workers alive across epochs.
+            Only used when `num_workers > 0`.
+        pin_memory:
+            Gather mini-batches into page-locked memory so that host to GPU
+            copy can be asynchronous. Only used on CUDA device.
+        prefetch_factor:
+            Number of mini-batches loaded in advance by each worker. Only used
+            when `num_workers > 0`. `prefetch_factor` must be bigger than or
+            equal to `1`.
         seed:
             Control random seed. `seed` must be bigger than or equal to `1`.
         task:
@@ -134,6 +186,7 @@ class StudentConfig(BaseConfig):
             batch_size: int = 32,
             beta1: float = 0.9,
             beta2: float = 0.999,
+            bucket_size: int = 0,
             ckpt_step: int = 1000,
             d_emb: int = 128,
             d_ff: int = 3072,
@@ -141,16 +194,26 @@ class StudentConfig(BaseConfig):
             dataset: str = '',
             dropout: float = 0.1,
             eps: float = 1e-8,
+            eval_dataset: str = '',
             experiment: str = '',
+            keep_best: int = 0,
+            keep_last: int = 0,
             log_step: int = 500,
             lr: float = 3e-5,
             max_norm: float = 1.0,
             max_seq_len: int = 512,
+            max_tokens_per_batch: int = 0,
             model: str = '',
             num_attention_heads: int = 16,
             num_class: int = 2,
             num_gpu: int = 0,
             num_hidden_layers: int = 6,
+            num_workers: int = 0,
+            pad_to_multiple_of: int = 1,
+            padding: str = 'longest',
+            persistent_workers: bool = False,
+            pin_memory: bool = False,
+            prefetch_factor: int = 2,
             seed: int = 42,
             task: str = '',
             total_step: int = 50000,
@@ -165,18 +228,29 @@ class StudentConfig(BaseConfig):
             batch_size=batch_size,
             beta1=beta1,
             beta2=beta2,
+            bucket_size=bucket_size,
             ckpt_step=ckpt_step,
             dataset=dataset,
             dropout=dropout,
             eps=eps,
+            eval_dataset=eval_dataset,
             experiment=experiment,
+            keep_best=keep_best,
+            keep_last=keep_last,
             log_step=log_step,
             lr=lr,
             max_norm=max_norm,
             max_seq_len=max_seq_len,
+            max_tokens_per_batch=max_tokens_per_batch,
             model=model,
             num_class=num_class,
             num_gpu=num_gpu,
+            num_workers=num_workers,
+            pad_to_multiple_of=pad_to_multiple_of,
+            padding=padding,
+            persistent_workers=persistent_workers,
+            pin_memory=pin_memory,
+            prefetch_factor=prefetch_factor,
             seed=seed,
             task=task,
             total_step=total_step,
@@ -8,6 +8,8 @@ Usage:
 
     student_model = fine_tune.model.StudentAlbert(...)
     student_model = fine_tune.model.StudentBert(...)
+
+    pooled_output, hiddens, attns = fine_tune.model.capture_layers(...)
 """
 
 # built-in modules
@@ -20,6 +22,7 @@ from typing import Union
 
 # my own modules
 
+from fine_tune.model._layer_capture import capture_layers
 from fine_tune.model._student_albert import StudentAlbert
 from fine_tune.model._student_bert import StudentBert
 from fine_tune.model._teacher_albert import TeacherAlbert
@@ -0,0 +1,249 @@
+r"""Capture selected BERT layers' outputs with forward hooks.
+
+`transformers.BertModel` can only return hidden states and attentions of all
+layers at once, while distillation only pairs a few teacher layers with
+student layers. `fine_tune.model.capture_layers` registers forward hooks on
+the requested layers only, thus unused layers' outputs are freed as soon as
+possible.
+
+Attentions are recomputed from each self-attention module's query and key
+projections, thus no attention map is kept for layers not requested.
+
+Usage:
+    import fine_tune
+
+    pooled_output, hiddens, attns = fine_tune.model.capture_layers(
+        encoder=model.encoder,
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        token_type_ids=token_type_ids,
+        attn_layers=[1, 3],
+        hidden_layers=[2, 4],
+        attn_dtype=torch.float16,
+        attn_log_prob=True
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import math
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+# 3rd party modules
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from transformers import BertModel
+
+
+def check_layers(
+        layers: Sequence[int],
+        num_layers: int,
+        name: str
+) -> None:
+    r"""Check requested layer indices are in range.
+
+    Args:
+        layers:
+            Requested layer indices.
+        num_layers:
+            Number of available layers.
+        name:
+            Name of layer kind. Only used in error message.
+
+    Raises:
+        ValueError:
+            When some layer indices are out of range.
+    """
+    invalid = sorted(set(
+        layer for layer in layers
+        if not 0 <= layer < num_layers
+    ))
+    if invalid:
+        raise ValueError(
+            f'{name} layers {invalid} are out of range: `{name}_layers` ' +
+            f'must be bigger than or equal to `0` and smaller than ' +
+            f'`{num_layers}`.'
+        )
+
+
+def split_heads(
+        module: nn.Module,
+        projection: torch.Tensor
+) -> torch.Tensor:
+    r"""Split query or key projection into attention heads.
+
+    Args:
+        module:
+            BERT self-attention module.
+        projection:
+            Query or key projection with size (B, S, H).
+
+    Returns:
+        Projection with size (B, A, S, H / A).
+    """
+    return projection.view(
+        projection.size(0),
+        projection.size(1),
+        module.num_attention_heads,
+        module.attention_head_size
+    ).transpose(1, 2)
+
+
+def capture_layers(
+        encoder: BertModel,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        token_type_ids: torch.Tensor,
+        attn_layers: Sequence[int] = (),
+        hidden_layers: Sequence[int] = (),
+        attn_dtype: Optional[torch.dtype] = None,
+        attn_log_prob: bool = False
+) -> Tuple[torch.Tensor, List[torch.Tensor], List[torch.Tensor]]:
+    r"""Run BERT encoder and return only requested layers' outputs.
+
+    We use the following notation for the rest of the context.
+        - A: num of attention heads.
+        - B: batch size.
+        - S: sequence length.
+        - H: hidden state size.
+
+    Args:
+        encoder:
+            BERT encoder with absolute position embedding.
+        input_ids:
+            Batch of input token ids with size (B, S).
+        attention_mask:
+            Batch of input attention masks with size (B, S).
+        token_type_ids:
+            Batch of input token type ids with size (B, S).
+        attn_layers:
+            Attention layer indices to return. Index `i` refers to the `i`-th
+            Transformer layer, starting from `0`.
+        hidden_layers:
+            Hidden state layer indices to return. Index `0` refers to
+            embedding output and index `i` refers to the output of the `i`-th
+            Transformer layer, starting from `1`.
+        attn_dtype:
+            Cast attentions into this numeric type. Log-probabilities are
+            clamped to the minimum of `attn_dtype` so that masked positions
+            remain finite. Leave `None` to keep `torch.float32`.
+        attn_log_prob:
+            Return attentions as log-probabilities instead of probabilities.
+
+    Raises:
+        ValueError:
+            When layer indices are out of range or encoder does not use
+            absolute position embedding.
+
+    Returns:
+        Pooled output with size (B, H), list of hidden states with size
+        (B, S, H) for each layer in `hidden_layers` and list of attentions
+        with size (B, A, S, S) for each layer in `attn_layers`.
+    """
+    num_hidden_layers = encoder.config.num_hidden_layers
+    check_layers(attn_layers, num_hidden_layers, 'attn')
+    check_layers(hidden_layers, num_hidden_layers + 1, 'hidden')
+
+    if getattr(
+            encoder.config,
+            'position_embedding_type',
+            'absolute'
+    ) != 'absolute':
+        raise ValueError(
+            'Only absolute position embedding is supported.'
+        )
+
+    hiddens: Dict[int, torch.Tensor] = {}
+    attns: Dict[int, torch.Tensor] = {}
+    queries: Dict[int, torch.Tensor] = {}
+    keys: Dict[int, torch.Tensor] = {}
+
+    def save_hidden(layer: int):
+        def hook(module, args, output):
+            # `BertLayer` returns tuple while embedding returns tensor.
+            if isinstance(output, tuple):
+                output = output[0]
+            hiddens[layer] = output
+        return hook
+
+    def save_projection(layer: int, projections: Dict[int, torch.Tensor]):
+        def hook(module, args, output):
+            projections[layer] = output
+        return hook
+
+    def save_attn(layer: int):
+        def hook(module, args, kwargs, output):
+            # Additive attention mask broadcastable to (B, A, S, S).
+            if len(args) > 1:
+                mask = args[1]
+            else:
+                mask = kwargs.get('attention_mask')
+
+            query = split_heads(module, queries.pop(layer))
+            key = split_heads(module, keys.pop(layer))
+
+            # `scores.size == (B, A, S, S)`.
+            scores = query @ key.transpose(-1, -2)
+            scores = scores / math.sqrt(module.attention_head_size)
+            if mask is not None:
+                scores = scores + mask
+
+            attn = F.log_softmax(scores, dim=-1, dtype=torch.float32)
+            if not attn_log_prob:
+                attn = attn.exp()
+            if attn_dtype is not None:
+                attn = attn.clamp(min=torch.finfo(attn_dtype).min)
+                attn = attn.to(attn_dtype)
+            attns[layer] = attn
+        return hook
+
+    # Register hooks on requested layers only.
+    handles = []
+    for layer in set(hidden_layers):
+        if layer == 0:
+            module = encoder.embeddings
+        else:
+            module = encoder.encoder.layer[layer - 1]
+        handles.append(module.register_forward_hook(save_hidden(layer)))
+
+    for layer in set(attn_layers):
+        module = encoder.encoder.layer[layer].attention.self
+        handles.append(module.query.register_forward_hook(
+            save_projection(layer, queries)
+        ))
+        handles.append(module.key.register_forward_hook(
+            save_projection(layer, keys)
+        ))
+        handles.append(module.register_forward_hook(
+            save_attn(layer),
+            with_kwargs=True
+        ))
+
+    try:
+        output = encoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids
+        )
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return (
+        output.pooler_output,
+        [hiddens[layer] for layer in hidden_layers],
+        [attns[layer] for layer in attn_layers],
+    )
@@ -13,6 +13,9 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from typing import Optional
+from typing import Sequence
+
 # 3rd party modules
 
 import torch
@@ -21,6 +24,10 @@ import torch.nn.functional as F
 
 from transformers import BertModel
 
+# my own modules
+
+from fine_tune.model._layer_capture import capture_layers
+
 
 class TeacherBert(nn.Module):
     r"""Fine-tune BERT model as teacher model.
@@ -104,7 +111,11 @@ class TeacherBert(nn.Module):
             input_ids: torch.Tensor,
             attention_mask: torch.Tensor,
             token_type_ids: torch.Tensor,
-            return_hidden_and_attn: bool = False
+            return_hidden_and_attn: bool = False,
+            attn_layers: Optional[Sequence[int]] = None,
+            hidden_layers: Optional[Sequence[int]] = None,
+            attn_dtype: Optional[torch.dtype] = None,
+            attn_log_prob: bool = False
     ):
         r"""Forward pass
 
@@ -130,9 +141,28 @@ class TeacherBert(nn.Module):
                 A boolean flag to indicate whether return hidden states and attention heads
                 of model. It should be true if you want to get hidden states of a fine-tuned model.
                 Default: `False`
+            attn_layers:
+                Only return attentions of these layers. Index `i` refers to
+                the `i`-th Transformer layer, starting from `0`. Layers are
+                captured by forward hooks instead of returning all layers.
+                See `fine_tune.model.capture_layers`.
+                Default: `None`
+            hidden_layers:
+                Only return hidden states of these layers. Index `0` refers to
+                embedding output. See `fine_tune.model.capture_layers`.
+                Default: `None`
+            attn_dtype:
+                Numeric type of attentions returned by `attn_layers`.
+                Default: `None`
+            attn_log_prob:
+                Return attentions of `attn_layers` as log-probabilities.
+                Default: `False`
 
         Returns:
-            If `return_hidden_and_attn` is `False`:
+            If `attn_layers` or `hidden_layers` is not `None`:
+                Return logits, list of hidden states of `hidden_layers` and
+                list of attentions of `attn_layers`.
+            Else if `return_hidden_and_attn` is `False`:
                 Unnormalized logits with numeric type `torch.float32` and size
                 (B, C).
             Else:
@@ -144,6 +174,22 @@ class TeacherBert(nn.Module):
                 3. Attentions: Tuple of torch.FloatTensor with shape: (B, A, S, S).
                 (One for each layer).
         """
+        # Return logits and only requested hidden states and attention heads.
+        if attn_layers is not None or hidden_layers is not None:
+            pooled_output, hidden_states, attentions = capture_layers(
+                encoder=self.encoder,
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+                attn_layers=attn_layers or [],
+                hidden_layers=hidden_layers or [],
+                attn_dtype=attn_dtype,
+                attn_log_prob=attn_log_prob
+            )
+
+            pooled_output = self.dropout(pooled_output)
+            return self.linear_layer(pooled_output), hidden_states, attentions
+
         # Return logits, hidden states and attention heads.
         if return_hidden_and_attn:
             output = self.encoder(
@@ -3,6 +3,7 @@ r"""Fine-tune distillation objective.
 Usage:
     loss = soft_target_loss(...)
     loss = distill(...)
+    loss, breakdown = distill_objective(...)
 """
 
 # built-in modules
@@ -12,12 +13,26 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from typing import Dict
+from typing import Sequence
+from typing import Tuple
+
 # 3rd party modules
 
 import torch
 import torch.nn
 import torch.nn.functional as F
 
+# Define types for type annotation.
+
+# Model outputs: `tuple(logits, hiddens, attns)`.
+
+ModelOutput = Tuple[
+    torch.Tensor,
+    Sequence[torch.Tensor],
+    Sequence[torch.Tensor],
+]
+
 
 def soft_target_cross_entropy_loss(
         student_logits: torch.Tensor,
@@ -142,11 +157,11 @@ def attention_KL_loss(
         - A: num of attention heads
     Args:
         teacher_attn:
-            attention matrix from one of teacher layer with numeric type
-            `torch.float32` and size (B, A, S, S)
+            attention log-probabilities from one of teacher layer with
+            numeric type `torch.float32` and size (B, A, S, S)
         student_attn:
-            attention matrix from one of student layer with numeric type
-            `torch.float32` and size (B, A, S, S)
+            attention log-probabilities from one of student layer with
+            numeric type `torch.float32` and size (B, A, S, S)
     Returns:
         KL divergence loss between teacher and student attention heads.
     """
@@ -172,3 +187,115 @@ def hidden_MSE_loss(
         MSE loss between teacher and student hidden states.
     """
     return F.mse_loss(student_hidden, teacher_hidden)
+
+
+def distill_objective(
+        hard_target: torch.Tensor,
+        student_outputs: ModelOutput,
+        teacher_outputs: ModelOutput,
+        adaptive_layers: Sequence[torch.nn.Module] = (),
+        attn_weight: float = 1.0,
+        hidden_weight: float = 1.0,
+        logits_weight: float = 1.0
+) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+    r"""Combine all distillation loss terms into one loss.
+
+    We use the following notation for the rest of the context.
+        - A: num of attention heads.
+        - B: batch size.
+        - C: number of class.
+        - H: hidden size.
+        - S: sequence length.
+
+    Total loss is
+        $$
+        w_l * L_{logits} + w_h * \sum_i L_{hidden}^i + w_a * \sum_i L_{attn}^i
+        $$
+    where each term is computed by `distill_loss`, `hidden_MSE_loss` and
+    `attention_KL_loss` respectively. Calling `backward` once on the total
+    loss gives the same gradient as calling `backward` on every term, while
+    the computational graph is traversed only once.
+
+    Args:
+        hard_target:
+            Actual label for cross-entropy loss with numeric type `torch.int64`
+            and size (B).
+        student_outputs:
+            Student logits with size (B, C), hidden states with size (B, S, H)
+            and attention log-probabilities with size (B, A, S, S). Hidden
+            states and attentions must be paired with `teacher_outputs` one
+            by one.
+        teacher_outputs:
+            Teacher logits, hidden states and attentions with the same layout
+            as `student_outputs`. Teacher tensors are moved to student device.
+            Hidden states and attentions of both models are compared in
+            `torch.float32`, thus they may be returned in lower precision
+            (e.g., `torch.float16` or `torch.bfloat16`) to save memory.
+        adaptive_layers:
+            Layers which transform student hidden states into teacher hidden
+            size. Paired with student hidden states one by one. Leave empty
+            when hidden sizes are the same.
+        attn_weight:
+            Weight of attention loss. Attention loss is skipped when
+            `attn_weight == 0`.
+        hidden_weight:
+            Weight of hidden states loss. Hidden states loss is skipped when
+            `hidden_weight == 0`.
+        logits_weight:
+            Weight of logits loss. Logits loss is skipped when
+            `logits_weight == 0`.
+
+    Returns:
+        Total loss and a `dict` of weighted loss terms with keys `'logits'`,
+        `'hidden'` and `'attn'`. Loss terms are detached from computational
+        graph and only used as log.
+    """
+    student_logits, student_hiddens, student_attns = student_outputs
+    teacher_logits, teacher_hiddens, teacher_attns = teacher_outputs
+    device = student_logits.device
+
+    breakdown = {}
+    loss = torch.zeros((), device=device)
+
+    # Logits loss.
+    logits_loss = torch.zeros((), device=device)
+    if logits_weight:
+        logits_loss = logits_weight * distill_loss(
+            hard_target=hard_target.to(device),
+            student_logits=student_logits.float(),
+            teacher_logits=teacher_logits.to(device, torch.float32)
+        )
+    loss = loss + logits_loss
+    breakdown['logits'] = logits_loss.detach()
+
+    # Hidden states loss.
+    hidden_loss = torch.zeros((), device=device)
+    if hidden_weight:
+        if not adaptive_layers:
+            adaptive_layers = [torch.nn.Identity()] * len(student_hiddens)
+        for t_hidden, s_hidden, adaptive_layer in zip(
+                teacher_hiddens,
+                student_hiddens,
+                adaptive_layers
+        ):
+            hidden_loss = hidden_loss + hidden_MSE_loss(
+                teacher_hidden=t_hidden.to(device, torch.float32),
+                student_hidden=adaptive_layer(s_hidden).float()
+            )
+        hidden_loss = hidden_weight * hidden_loss
+    loss = loss + hidden_loss
+    breakdown['hidden'] = hidden_loss.detach()
+
+    # Attentions loss.
+    attn_loss = torch.zeros((), device=device)
+    if attn_weight:
+        for t_attn, s_attn in zip(teacher_attns, student_attns):
+            attn_loss = attn_loss + attention_KL_loss(
+                teacher_attn=t_attn.to(device, torch.float32),
+                student_attn=s_attn.float()
+            )
+        attn_loss = attn_weight * attn_loss
+    loss = loss + attn_loss
+    breakdown['attn'] = attn_loss.detach()
+
+    return loss, breakdown
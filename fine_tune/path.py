@@ -5,6 +5,7 @@ Usage:
 
     fine_tune.path.DATA
     fine_tune.path.DOC
+    fine_tune.path.FINE_TUNE_CACHE
     fine_tune.path.FINE_TUNE_DATA
     fine_tune.path.FINE_TUNE_EXPERIMENT
     fine_tune.path.LOG
@@ -59,6 +60,18 @@ FINE_TUNE_DATA = os.path.join(
 if not os.path.exists(FINE_TUNE_DATA):
     os.makedirs(FINE_TUNE_DATA)
 
+# Fine tune tokenized dataset cache folder absolute path.
+
+FINE_TUNE_CACHE = os.path.join(
+    DATA,
+    'fine_tune_cache'
+)
+
+# Create fine tune tokenized dataset cache folder if not exists.
+
+if not os.path.exists(FINE_TUNE_CACHE):
+    os.makedirs(FINE_TUNE_CACHE)
+
 # Fine tune experiment folder absolute path.
 
 FINE_TUNE_EXPERIMENT = os.path.join(
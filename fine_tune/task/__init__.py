@@ -12,6 +12,13 @@ Usage:
 
     mnli_num_class = fine_tune.task.get_num_class(fine_tune.task.MNLI)
     boolq_num_class = fine_tune.task.get_num_class(fine_tune.task.Boolq)
+
+    mnli_cache = fine_tune.task.TokenCache.load_or_build(...)
+    encoding, label = fine_tune.task.encode_dataset(...)
+    sampler = fine_tune.task.BucketBatchSampler(...)
+    teacher_store = fine_tune.task.TeacherStore(...)
+    logits_file = fine_tune.task.LogitsFile(...)
+    samples, skipped = fine_tune.task.DatasetSnapshot.load_or_build(...)
 """
 
 # built-in modules
@@ -25,7 +32,17 @@ from __future__ import unicode_literals
 
 from fine_tune.task._boolq import BoolQ
 from fine_tune.task._dataset import Dataset
+from fine_tune.task._dataset import SampleColumns
+from fine_tune.task._dataset import StringColumn
 from fine_tune.task._dataset import get_num_class
 from fine_tune.task._dataset import label_decoder
 from fine_tune.task._dataset import label_encoder
+from fine_tune.task._logits_file import LogitsFile
 from fine_tune.task._mnli import MNLI
+from fine_tune.task._sampler import BucketBatchSampler
+from fine_tune.task._snapshot import DatasetSnapshot
+from fine_tune.task._teacher_store import TeacherStore
+from fine_tune.task._token_cache import TokenCache
+from fine_tune.task._token_cache import encode_dataset
+from fine_tune.task._token_cache import encode_dataset_many
+from fine_tune.task._token_cache import tokenizer_fingerprint
@@ -9,8 +9,7 @@ Usage:
     dataset = fine_tune.task.BoolQ('test')
     dataset = fine_tune.task.BoolQ(...)
 
-    dataset.update_logits(...)
-    dataset.save_for_distill()
+    dataset.load_logits(...)
 
     assert fine_tune.task.get_num_label(fine_tune.task.BoolQ) == 2
 
@@ -37,15 +36,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import json
 import logging
 import os
 
+from typing import Any
+from typing import Dict
 from typing import List
-
-# 3rd party modules
-
-from tqdm import tqdm
+from typing import Optional
+from typing import Tuple
 
 # my own modules
 
@@ -54,10 +52,10 @@ import fine_tune.path
 from fine_tune.task._dataset import (
     Dataset,
     Label,
-    Sample,
-    get_num_class,
+    SampleColumns,
     label_encoder,
 )
+from fine_tune.task._snapshot import DatasetSnapshot
 
 # Get logger.
 
@@ -81,7 +79,7 @@ class BoolQ(Dataset):
         allow_labels:
             Allowed BoolQ labels. See BoolQ paper for labeling details.
         dataset:
-            A list of BoolQ samples.
+            BoolQ samples stored in columns.
         task_path:
             Path of BoolQ dataset.
     """
@@ -102,32 +100,63 @@ class BoolQ(Dataset):
     )
 
     @staticmethod
-    def load(dataset: str) -> List[Sample]:
-        r""" Load BoolQ dataset into memory.
+    def parse(
+            record: Dict[str, Any]
+    ) -> Optional[Tuple[str, Optional[str], int]]:
+        r"""Parse one BoolQ JSON record.
+
+        Args:
+            record:
+                Decoded JSON line of BoolQ dataset file.
 
-        This is a heavy IO method and might required lots of memory since
-        dataset might be huge. BoolQ dataset must be download previously. See
-        BoolQ document in 'project_root/doc/fine_tune_boolq.md' for downloading
-        details.
+        Returns:
+            `tuple(text, text_pair, label)`. BoolQ labels are encoded with
+            `label_encoder(BoolQ, label)`. Test set does not have label field,
+            so we use meaningless label `False`.
+        """
+        return (
+            record['passage'],
+            record['question'],
+            label_encoder(BoolQ, record.get('label', False)),
+        )
+
+    @staticmethod
+    def load(dataset: str, num_workers: int = 0) -> SampleColumns:
+        r"""Load BoolQ dataset into memory.
+
+        Dataset file is parsed once and saved as binary snapshot, later
+        loads memory-map the snapshot, see `fine_tune.task.DatasetSnapshot`.
+        BoolQ dataset must be download previously. See BoolQ document in
+        'project_root/doc/fine_tune_boolq.md' for downloading details.
 
         Args:
             dataset:
                 Name of the BoolQ dataset to be loaded.
+            num_workers:
+                Number of processes parsing dataset file in parallel.
 
         Raises:
             FileNotFoundError:
                 When BoolQ files does not exist.
 
         Returns:
-            A list of BoolQ samples.
+            BoolQ samples stored in columns.
         """
+        dataset_path = os.path.join(
+            BoolQ.task_path,
+            f'{dataset}.jsonl'
+        )
         try:
-            dataset_path = os.path.join(
-                BoolQ.task_path,
-                f'{dataset}.jsonl'
+            samples, skipped_sample_count = DatasetSnapshot.load_or_build(
+                path=DatasetSnapshot.snapshot_path(
+                    dataset=dataset,
+                    task='boolq'
+                ),
+                source_path=dataset_path,
+                parse=BoolQ.parse,
+                desc=f'Loading BoolQ {dataset}',
+                num_workers=num_workers
             )
-            with open(dataset_path, 'r') as jsonl_file:
-                jsonlines = jsonl_file.readlines()
         except FileNotFoundError:
             raise FileNotFoundError(
                 f'BoolQ dataset file {dataset} does not exist.\n' +
@@ -138,33 +167,11 @@ class BoolQ(Dataset):
                 "' for downloading details."
             )
 
-        samples = []
-        for line in tqdm(jsonlines, desc=f'Loading BoolQ {dataset}'):
-            # Skip empty line.
-            if line == '':
-                continue
-
-            sample = json.loads(line)
-
-            # Test set does not have label field. So we initialize it with
-            # meaningless value.
-            if 'label' not in sample:
-                sample['label'] = False
-
-            # Format into `transformer.PreTrainedTokenizer` format. BoolQ
-            # labels will be encoded with `label_encoder(BoolQ, label)`.
-            # `logits` will be initialized with 2 zeros.
-            samples.append(
-                Sample({
-                    'text': sample['passage'],
-                    'text_pair': sample['question'],
-                    'label': label_encoder(BoolQ, sample['label']),
-                    'logits': [0.0] * get_num_class(BoolQ)
-                })
-            )
-
-        logger.info('Number of origin samples: %d', len(jsonlines))
-        logger.info('Number of skiped samples: %d', 0)
+        logger.info(
+            'Number of origin samples: %d',
+            len(samples) + skipped_sample_count
+        )
+        logger.info('Number of skiped samples: %d', skipped_sample_count)
         logger.info('Number of result samples: %d', len(samples))
 
         return samples
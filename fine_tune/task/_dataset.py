@@ -20,6 +20,10 @@ Usage:
         CustomizedDataset,
         0
     ) == CustomizedDataset.allow_labels[0]
+
+    dataset = CustomizedDataset(...)
+    dataset.load_logits(...)
+    dataset.logits[0]
 """
 
 # built-in modules
@@ -33,8 +37,10 @@ import abc
 import logging
 
 from typing import Callable
+from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Sequence
 from typing import Tuple
 from typing import Type
 from typing import TypedDict
@@ -42,11 +48,16 @@ from typing import Union
 
 # 3rd party modules
 
+import numpy as np
 import torch
 import torch.utils
 import torch.utils.data
 import transformers
 
+# my own modules
+
+from fine_tune.task._logits_file import LogitsFile
+
 # Define types for type annotation.
 
 Label = Union[bool, int, str]
@@ -68,6 +79,271 @@ class Sample(TypedDict):
     label: int
 
 
+# `get_batch` return `tuple(text, text_pair, label)` of a mini-batch.
+
+BatchReturn = Tuple[
+    List[str],
+    Optional[List[str]],
+    np.ndarray,
+]
+
+
+class StringColumn:
+    r"""UTF-8 strings stored in one contiguous buffer.
+
+    The `i`-th string is `data[offsets[i]:offsets[i + 1]]` decoded with
+    UTF-8. Two numpy arrays replace one Python `str` object per string, thus
+    memory usage is close to raw text size, and pickling or forking into
+    `torch.utils.data.DataLoader` workers copies two buffers instead of
+    millions of objects.
+
+    Args:
+        data:
+            Concatenated UTF-8 encoded strings with numeric type
+            `numpy.uint8`.
+        offsets:
+            Start position of each string in `data` with numeric type
+            `numpy.int64`. `offsets` has one more element than number of
+            strings, and `offsets[-1] == len(data)`.
+
+    Raises:
+        ValueError:
+            When `offsets` does not match `data`.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        if len(offsets) < 1 or offsets[0] != 0 or offsets[-1] != len(data):
+            raise ValueError(
+                '`offsets` must start with `0` and end with `len(data)`.'
+            )
+
+        self.data = data
+        self.offsets = offsets
+
+    @staticmethod
+    def from_strings(strings: Iterable[str]) -> 'StringColumn':
+        r"""Encode strings into one buffer.
+
+        Args:
+            strings:
+                Strings to be stored.
+
+        Returns:
+            Column contains `strings` in order.
+        """
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return StringColumn(
+            data=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            offsets=offsets
+        )
+
+    def __getitem__(self, index: int) -> str:
+        r"""Decode string by index.
+
+        Args:
+            index:
+                String index.
+
+        Raises:
+            IndexError:
+                `index` out of range.
+
+        Returns:
+            String of that index.
+        """
+        if not -len(self) <= index < len(self):
+            raise IndexError(
+                f'String index {index} out of range.'
+            )
+        index = index % len(self)
+        return str(
+            memoryview(self.data[self.offsets[index]:self.offsets[index + 1]]),
+            'utf-8'
+        )
+
+    def __len__(self) -> int:
+        r"""Return number of strings.
+
+        Returns:
+            Number of strings in column.
+        """
+        return len(self.offsets) - 1
+
+    def take(self, indices: Sequence[int]) -> List[str]:
+        r"""Decode strings of `indices` at once.
+
+        Offsets of all strings are looked up in one vectorized operation and
+        each string is decoded from a zero-copy view of `data`.
+
+        Args:
+            indices:
+                String indices.
+
+        Returns:
+            Strings of `indices` in order.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        view = memoryview(self.data)
+        return [
+            str(view[start:end], 'utf-8')
+            for start, end in zip(
+                self.offsets[indices].tolist(),
+                self.offsets[indices + 1].tolist()
+            )
+        ]
+
+    @staticmethod
+    def concat(columns: List['StringColumn']) -> 'StringColumn':
+        r"""Concatenate columns in order.
+
+        Args:
+            columns:
+                Columns to be concatenated.
+
+        Returns:
+            Concatenated column.
+        """
+        if not columns:
+            return StringColumn.from_strings([])
+
+        offsets = [columns[0].offsets]
+        shift = columns[0].offsets[-1]
+        for column in columns[1:]:
+            offsets.append(column.offsets[1:] + shift)
+            shift += column.offsets[-1]
+
+        return StringColumn(
+            data=np.concatenate([column.data for column in columns]),
+            offsets=np.concatenate(offsets)
+        )
+
+
+class SampleColumns:
+    r"""Samples stored column by column.
+
+    Each field of `fine_tune.task.Sample` is stored as one column: `text` and
+    `text_pair` as `fine_tune.task.StringColumn` and `label` as `numpy.int8`
+    array. Thus loading dataset does not create any Python object per sample.
+    Samples are assembled on demand by `__getitem__`, and mini-batches by
+    `get_batch`.
+
+    Args:
+        text:
+            First sequence of each sample.
+        text_pair:
+            Second sequence of each sample. Must be `None` if input text
+            consist of only 1 sequence.
+        label:
+            Encoded label of each sample with numeric type `numpy.int8`.
+        checksum:
+            Hex SHA-1 checksum of source file which samples are parsed
+            from. Empty string if unknown.
+
+    Raises:
+        ValueError:
+            When columns have different length.
+    """
+
+    def __init__(
+            self,
+            text: StringColumn,
+            text_pair: Optional[StringColumn],
+            label: np.ndarray,
+            checksum: str = ''
+    ):
+        if len(text) != len(label) or (
+                text_pair is not None and len(text_pair) != len(label)
+        ):
+            raise ValueError(
+                'All columns must have the same length.'
+            )
+
+        self.checksum = checksum
+        self.text = text
+        self.text_pair = text_pair
+        self.label = label
+
+    def __getitem__(self, index: int) -> Sample:
+        r"""Assemble sample by index.
+
+        Args:
+            index:
+                Sample index.
+
+        Raises:
+            IndexError:
+                `index` out of range.
+
+        Returns:
+            Sample of that index.
+        """
+        return Sample({
+            'text': self.text[index],
+            'text_pair': (
+                None if self.text_pair is None
+                else self.text_pair[index]
+            ),
+            'label': int(self.label[index]),
+        })
+
+    def __len__(self) -> int:
+        r"""Return number of samples.
+
+        Returns:
+            Length of each column.
+        """
+        return len(self.label)
+
+    def get_batch(self, indices: Sequence[int]) -> BatchReturn:
+        r"""Gather samples of `indices` column by column.
+
+        Args:
+            indices:
+                Sample indices.
+
+        Returns:
+            `tuple(text, text_pair, label)`. `text_pair` is `None` if input
+            text consist of only 1 sequence. `label` is `numpy.int64` array.
+        """
+        return (
+            self.text.take(indices),
+            None if self.text_pair is None
+            else self.text_pair.take(indices),
+            self.label[np.asarray(indices, dtype=np.int64)].astype(np.int64),
+        )
+
+    @staticmethod
+    def concat(columns: List['SampleColumns']) -> 'SampleColumns':
+        r"""Concatenate columns in order.
+
+        Args:
+            columns:
+                Columns to be concatenated. All columns must agree on whether
+                `text_pair` is `None`.
+
+        Returns:
+            Concatenated columns.
+        """
+        # Empty columns carry no information about `text_pair`.
+        columns = [column for column in columns if len(column)] or columns[:1]
+        text_pair = None
+        if columns and columns[0].text_pair is not None:
+            text_pair = StringColumn.concat(
+                [column.text_pair for column in columns]
+            )
+
+        return SampleColumns(
+            text=StringColumn.concat([column.text for column in columns]),
+            text_pair=text_pair,
+            label=(
+                np.concatenate([column.label for column in columns])
+                if columns else np.zeros(0, dtype=np.int8)
+            )
+        )
+
+
 # `collate_fn` input list(Sample) and return
 # `tuple(input_id, attention_mask, token_type_ids, label, logits)`.
 # Each field in the returned tuple must have following numeric type:
@@ -106,6 +382,8 @@ class Dataset(torch.utils.data.Dataset):
             Name of the datset file to be loaded. When `dataset` is the name of
             some previous experiment, it means the logits dataset generated by
             the model of that experiment.
+        num_workers:
+            Number of processes parsing dataset file in parallel.
 
     Attributes:
         allow_dataset:
@@ -114,7 +392,13 @@ class Dataset(torch.utils.data.Dataset):
         allow_labels:
             Allowed labels in the task.
         dataset:
-            A list of samples of the dataset.
+            Samples of the dataset stored in columns. Strings are kept in
+            flat UTF-8 buffers, thus forking into DataLoader workers shares
+            them copy-on-write without touching per sample objects.
+        logits:
+            Memory-mapped logits of each sample with numeric type
+            `numpy.float16` and size (N, C). Used as distillation target.
+            `None` until `load_logits` is called.
         task_path:
             Path of the task contains all dataset.
     """
@@ -124,7 +408,10 @@ class Dataset(torch.utils.data.Dataset):
 
     task_path: str = ''
 
-    def __init__(self, dataset: str):
+    def __init__(self, dataset: str, num_workers: int = 0):
+        # Distillation target is loaded separately.
+        self.logits: Optional[np.ndarray] = None
+
         # Load task specific dataset.
         if dataset in self.__class__.allow_dataset:
             logger.info(
@@ -132,19 +419,34 @@ class Dataset(torch.utils.data.Dataset):
                 self.__class__.__name__,
                 dataset
             )
-            self.dataset = self.__class__.load(dataset)
+            self.dataset = self.__class__.load(
+                dataset,
+                num_workers=num_workers
+            )
             logger.info(
                 'Finish loading task %s dataset %s.',
                 self.__class__.__name__,
                 dataset
             )
 
+    @property
+    def checksum(self) -> str:
+        r"""Hex SHA-1 checksum of dataset source file.
+
+        Caches derived from dataset (e.g., token caches) record checksum so
+        that they are rebuilt once source file changes.
+
+        Returns:
+            Checksum of source file, or empty string if unknown.
+        """
+        return self.dataset.checksum
+
     def __getitem__(self, index: int) -> Sample:
         r"""Sample dataset by index.
 
         This method is required by `torch.utils.data.Dataset` and
-        `torch.utils.data.DataLoader`. Since `self.dataset` is a list, we will
-        return `self.dataset[index]` directly.
+        `torch.utils.data.DataLoader`. Sample is assembled from columns in
+        `self.dataset`.
 
         Args:
             index:
@@ -163,33 +465,88 @@ class Dataset(torch.utils.data.Dataset):
         r"""Return dataset size.
 
         This method is required by `torch.utils.data.Dataset` and
-        `torch.utils.data.DataLoader`. Since `self.dataset` is a list, we will
-        return `len(self.dataset)` directly.
+        `torch.utils.data.DataLoader`.
 
         Returns:
-            The length of the list `self.dataset`.
+            Number of samples in `self.dataset`.
         """
         return len(self.dataset)
 
+    def get_batch(self, indices: Sequence[int]) -> BatchReturn:
+        r"""Gather mini-batch by indices.
+
+        Vectorized version of `__getitem__`, columns are sliced directly
+        without assembling `fine_tune.task.Sample` of each index.
+
+        Args:
+            indices:
+                Sample indices of dataset.
+
+        Returns:
+            `tuple(text, text_pair, label)` of samples in `indices` order.
+        """
+        return self.dataset.get_batch(indices)
+
+    def load_logits(self, path: str) -> None:
+        r"""Load logits file as distillation target column.
+
+        Logits file is memory-mapped, thus loading is cheap even for huge
+        dataset.
+
+        Args:
+            path:
+                Path of logits file generated by
+                `fine_tune.util.amp_gen_logits`.
+
+        Raises:
+            ValueError:
+                When number of samples or classes in logits file does not
+                match the dataset, or logits file was generated from a
+                different dataset source file.
+        """
+        logits_file = LogitsFile(path)
+
+        if logits_file.checksum != self.checksum:
+            raise ValueError(
+                f'Logits file {path} was generated from a different ' +
+                'dataset file.'
+            )
+
+        if len(logits_file) != len(self):
+            raise ValueError(
+                f'Logits file {path} has {len(logits_file)} samples but ' +
+                f'dataset has {len(self)} samples.'
+            )
+
+        if logits_file.num_class != len(self.__class__.allow_labels):
+            raise ValueError(
+                f'Logits file {path} has {logits_file.num_class} classes ' +
+                f'but dataset has {len(self.__class__.allow_labels)} classes.'
+            )
+
+        self.logits = logits_file.logits
+
     @staticmethod
     @abc.abstractmethod
-    def load(dataset: str) -> List[Sample]:
+    def load(dataset: str, num_workers: int = 0) -> SampleColumns:
         r"""Load dataset into memory.
 
-        This is a heavy IO method and might required lots of memory since
-        dataset might be huge. All task dataset must be download previously.
-        See task document in 'project_root/doc/' for downloading details.
+        This is a heavy IO method since dataset might be huge. All task
+        dataset must be download previously. See task document in
+        'project_root/doc/' for downloading details.
 
         Args:
             dataset:
                 Name of the dataset to be loaded.
+            num_workers:
+                Number of processes parsing dataset file in parallel.
 
         Raises:
             FileNotFoundError:
                 When dataset file does not exist.
 
         Returns:
-            A list of samples of the dataset.
+            Samples of the dataset stored in columns.
         """
         raise NotImplementedError(
             'Missing static method `load`.'
@@ -0,0 +1,303 @@
+r"""Streaming JSONL loader for fine-tune task's dataset.
+
+JSONL file is read in newline aligned blocks, never as a whole. Each block
+is decoded with one `json.loads` call and parsed records are appended as
+UTF-8 bytes directly into `fine_tune.task.SampleColumns` buffers, thus peak
+memory is one block plus the resulting columns. With `num_workers > 0` the
+file is split into byte ranges which are parsed in parallel processes.
+
+Usage:
+    from fine_tune.task._jsonl import load_jsonl
+
+    columns, skipped = load_jsonl(
+        path='train.jsonl',
+        parse=MNLI.parse,
+        desc='Loading MNLI train',
+        num_workers=4
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import array
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import time
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# 3rd party modules
+
+import numpy as np
+
+from tqdm import tqdm
+
+# my own modules
+
+from fine_tune.task._dataset import SampleColumns
+from fine_tune.task._dataset import StringColumn
+
+# Define types for type annotation.
+
+# `parse` input one JSON record and return `tuple(text, text_pair, label)`,
+# or `None` if record should be skipped.
+
+ParseFn = Callable[
+    [Dict[str, Any]],
+    Optional[Tuple[str, Optional[str], int]]
+]
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.task')
+
+
+def peak_rss() -> Tuple[float, float]:
+    r"""Get peak resident set size.
+
+    Returns:
+        Peak resident set size in MiB of current process and of its largest
+        terminated child process.
+    """
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    )
+
+
+class _StringColumnBuilder:
+    r"""Append strings into growing UTF-8 buffer and offset array."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array.array('q', [0])
+
+    def append(self, string: str) -> None:
+        r"""Append one string.
+
+        Args:
+            string:
+                String to be appended.
+        """
+        self.data += string.encode('utf-8')
+        self.offsets.append(len(self.data))
+
+    def build(self) -> StringColumn:
+        r"""Convert buffers into numpy arrays without copy.
+
+        Returns:
+            Column contains all appended strings.
+        """
+        return StringColumn(
+            data=np.frombuffer(self.data, dtype=np.uint8),
+            offsets=np.frombuffer(self.offsets, dtype=np.int64)
+        )
+
+
+def _read_blocks(
+        path: str,
+        start: int,
+        end: int,
+        block_size: int
+) -> Iterator[bytes]:
+    r"""Read byte range `[start, end)` of file in newline aligned blocks.
+
+    Args:
+        path:
+            Path of JSONL file.
+        start:
+            Start offset. Must be the beginning of a line.
+        end:
+            End offset. Must be the beginning of a line or file size.
+        block_size:
+            Number of bytes to read at once.
+
+    Yields:
+        Blocks consist of complete lines.
+    """
+    with open(path, 'rb') as jsonl_file:
+        jsonl_file.seek(start)
+        remain = end - start
+        carry = b''
+        while remain > 0:
+            block = jsonl_file.read(min(block_size, remain))
+            if not block:
+                break
+            remain -= len(block)
+
+            block = carry + block
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                carry = block
+                continue
+            carry = block[cut:]
+            yield block[:cut]
+
+        if carry:
+            yield carry
+
+
+def _parse_range(
+        args: Tuple[str, int, int, int, ParseFn]
+) -> Tuple[SampleColumns, int]:
+    r"""Parse byte range of JSONL file into columns.
+
+    Args:
+        args:
+            `tuple(path, start, end, block_size, parse)`. Packed into one
+            argument so that it can be used by `multiprocessing.Pool.imap`.
+
+    Returns:
+        Parsed samples and number of skipped records.
+    """
+    path, start, end, block_size, parse = args
+
+    text = _StringColumnBuilder()
+    text_pair = _StringColumnBuilder()
+    label = array.array('b')
+    has_text_pair = None
+    skipped = 0
+    for block in _read_blocks(
+            path=path,
+            start=start,
+            end=end,
+            block_size=block_size
+    ):
+        # Decode all lines of a block at once. Skip empty lines.
+        lines = [line for line in block.split(b'\n') if line.strip()]
+        if not lines:
+            continue
+
+        for record in json.loads(b'[' + b','.join(lines) + b']'):
+            sample = parse(record)
+            if sample is None:
+                skipped += 1
+                continue
+            if has_text_pair is None:
+                has_text_pair = sample[1] is not None
+            text.append(sample[0])
+            if has_text_pair:
+                text_pair.append(sample[1])
+            label.append(sample[2])
+
+    return (
+        SampleColumns(
+            text=text.build(),
+            # Input text consist of only 1 sequence.
+            text_pair=text_pair.build() if has_text_pair else None,
+            label=np.frombuffer(label, dtype=np.int8)
+        ),
+        skipped,
+    )
+
+
+def _split_ranges(path: str, num_ranges: int) -> List[Tuple[int, int]]:
+    r"""Split file into newline aligned byte ranges of similar size.
+
+    Args:
+        path:
+            Path of JSONL file.
+        num_ranges:
+            Maximum number of ranges.
+
+    Returns:
+        Non-empty byte ranges `[start, end)` in file order.
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as jsonl_file:
+        for index in range(1, num_ranges):
+            jsonl_file.seek(max(index * size // num_ranges, bounds[-1]))
+            # Move to the beginning of next line.
+            jsonl_file.readline()
+            bounds.append(min(jsonl_file.tell(), size))
+    bounds.append(size)
+
+    return [
+        (start, end)
+        for start, end in zip(bounds[:-1], bounds[1:])
+        if start < end
+    ]
+
+
+def load_jsonl(
+        path: str,
+        parse: ParseFn,
+        desc: str,
+        block_size: int = 1 << 22,
+        num_workers: int = 0
+) -> Tuple[SampleColumns, int]:
+    r"""Stream JSONL file into columns.
+
+    Load time and peak resident set size are logged.
+
+    Args:
+        path:
+            Path of JSONL file.
+        parse:
+            Function convert one JSON record into sample fields, or return
+            `None` to skip record. Must be picklable (e.g., module level
+            function or static method) when `num_workers > 0`.
+        desc:
+            Progress bar description.
+        block_size:
+            Number of bytes to read at once.
+        num_workers:
+            Number of processes parsing file in parallel. Set to `0` to parse
+            in current process.
+
+    Raises:
+        FileNotFoundError:
+            When `path` does not exist.
+
+    Returns:
+        Parsed samples in file order and number of skipped records.
+    """
+    start_time = time.perf_counter()
+
+    ranges = _split_ranges(path=path, num_ranges=max(1, num_workers) * 4)
+    tasks = [
+        (path, start, end, block_size, parse)
+        for start, end in ranges
+    ]
+
+    if num_workers > 0 and len(tasks) > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            results = list(tqdm(
+                pool.imap(_parse_range, tasks),
+                desc=desc,
+                total=len(tasks)
+            ))
+    else:
+        results = [
+            _parse_range(task)
+            for task in tqdm(tasks, desc=desc)
+        ]
+
+    columns = SampleColumns.concat([result[0] for result in results])
+    skipped = sum(result[1] for result in results)
+
+    self_rss, child_rss = peak_rss()
+    logger.info(
+        'Load %s in %.3f s, peak RSS %.1f MiB (worker %.1f MiB).',
+        path,
+        time.perf_counter() - start_time,
+        self_rss,
+        child_rss
+    )
+
+    return columns, skipped
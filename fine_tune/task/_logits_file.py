@@ -0,0 +1,306 @@
+r"""Compact binary file of fine-tuned model's logits.
+
+Logits file starts with a fixed size header followed by one `float16` row of
+`num_class` logits for each sample, where the `i`-th row belongs to the
+`i`-th sample of the dataset. Rows are appended in sample order, thus an
+interrupted export can be resumed from the number of complete rows already
+written. Header records checksum of dataset source file and checksum of model
+weights, so that logits of a changed dataset or a retrained model are never
+appended to stale rows.
+
+Usage:
+    import fine_tune
+
+    start = fine_tune.task.LogitsFile.resume(
+        path=path,
+        num_class=3,
+        num_sample=len(dataset),
+        checksum=dataset.checksum,
+        model_checksum=model_checksum
+    )
+    fine_tune.task.LogitsFile.append(path, batch_logits)
+
+    logits_file = fine_tune.task.LogitsFile(path)
+    logits_file.logits[index]
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import os
+import struct
+
+from typing import Tuple
+
+# 3rd party modules
+
+import numpy as np
+
+# my own modules
+
+import fine_tune.path
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.task')
+
+
+class LogitsFile:
+    r"""Memory-mapped logits file.
+
+    Args:
+        path:
+            Path of logits file. Logits file must be complete, i.e., it must
+            contain logits of all `num_sample` samples.
+
+    Attributes:
+        checksum:
+            Hex SHA-1 checksum of dataset source file. Empty string if
+            unknown.
+        header:
+            `struct` format of file header: magic bytes, format version,
+            number of classes, number of samples, SHA-1 checksum of dataset
+            source file and SHA-1 checksum of model weights.
+        logits:
+            Memory-mapped logits with numeric type `numpy.float16` and size
+            (num_sample, num_class).
+        magic:
+            Magic bytes at the beginning of logits file.
+        model_checksum:
+            Hex SHA-1 checksum of weights of model which generates logits.
+            Empty string if unknown.
+        num_class:
+            Number of classes.
+        num_sample:
+            Number of samples.
+        version:
+            File format version.
+
+    Raises:
+        FileNotFoundError:
+            When logits file does not exist.
+        ValueError:
+            When file is not a logits file, version does not match or file is
+            incomplete.
+    """
+    header: str = '<8sIIQ20s20s'
+
+    magic: bytes = b'BGLOGITS'
+
+    version: int = 2
+
+    def __init__(self, path: str):
+        (
+            self.num_class,
+            self.num_sample,
+            self.checksum,
+            self.model_checksum,
+        ) = LogitsFile.read_header(path)
+
+        num_written = LogitsFile.num_written(
+            path=path,
+            num_class=self.num_class
+        )
+        if num_written != self.num_sample:
+            raise ValueError(
+                f'Logits file {path} is incomplete: {num_written} of ' +
+                f'{self.num_sample} samples written.'
+            )
+
+        self.logits = np.memmap(
+            path,
+            dtype='<f2',
+            mode='r',
+            offset=struct.calcsize(LogitsFile.header),
+            shape=(self.num_sample, self.num_class)
+        )
+
+    def __len__(self) -> int:
+        r"""Return number of samples.
+
+        Returns:
+            Number of samples.
+        """
+        return self.num_sample
+
+    @staticmethod
+    def read_header(path: str) -> Tuple[int, int, str, str]:
+        r"""Read file header.
+
+        Args:
+            path:
+                Path of logits file.
+
+        Raises:
+            ValueError:
+                When file is not a logits file or version does not match.
+
+        Returns:
+            Number of classes, number of samples, hex checksum of dataset
+            source file and hex checksum of model weights. Unknown checksum
+            is an empty string.
+        """
+        header_size = struct.calcsize(LogitsFile.header)
+        with open(path, 'rb') as logits_file:
+            header = logits_file.read(header_size)
+
+        if len(header) != header_size:
+            raise ValueError(f'{path} is not a logits file.')
+
+        (
+            magic,
+            version,
+            num_class,
+            num_sample,
+            checksum,
+            model_checksum,
+        ) = struct.unpack(LogitsFile.header, header)
+        if magic != LogitsFile.magic:
+            raise ValueError(f'{path} is not a logits file.')
+        if version != LogitsFile.version:
+            raise ValueError(
+                f'Logits file version {version} in {path} does not match ' +
+                f'current version {LogitsFile.version}.'
+            )
+
+        return (
+            num_class,
+            num_sample,
+            checksum.hex() if any(checksum) else '',
+            model_checksum.hex() if any(model_checksum) else '',
+        )
+
+    @staticmethod
+    def num_written(path: str, num_class: int) -> int:
+        r"""Count number of complete rows in logits file.
+
+        Args:
+            path:
+                Path of logits file.
+            num_class:
+                Number of classes.
+
+        Returns:
+            Number of samples whose logits are completely written.
+        """
+        row_size = num_class * np.dtype('<f2').itemsize
+        data_size = os.path.getsize(path) - struct.calcsize(LogitsFile.header)
+        return max(data_size, 0) // row_size
+
+    @staticmethod
+    def resume(
+            path: str,
+            num_class: int,
+            num_sample: int,
+            checksum: str = '',
+            model_checksum: str = ''
+    ) -> int:
+        r"""Prepare logits file for appending rows.
+
+        Create logits file with header if it does not exist, or if existing
+        header does not match (e.g., dataset source file changed or model was
+        retrained), in which case all written rows are dropped. Otherwise
+        drop the trailing incomplete row left by an interrupted export.
+
+        Args:
+            path:
+                Path of logits file.
+            num_class:
+                Number of classes.
+            num_sample:
+                Number of samples.
+            checksum:
+                Hex SHA-1 checksum of dataset source file.
+            model_checksum:
+                Hex SHA-1 checksum of weights of model which generates logits.
+
+        Returns:
+            Index of the first sample whose logits are not written yet.
+        """
+        header = (num_class, num_sample, checksum, model_checksum)
+        if os.path.exists(path):
+            try:
+                if LogitsFile.read_header(path) == header:
+                    num_written = min(
+                        LogitsFile.num_written(
+                            path=path,
+                            num_class=num_class
+                        ),
+                        num_sample
+                    )
+
+                    # Drop trailing incomplete row.
+                    os.truncate(
+                        path,
+                        struct.calcsize(LogitsFile.header) +
+                        num_written * num_class * np.dtype('<f2').itemsize
+                    )
+
+                    return num_written
+                logger.info('Logits file %s is stale.', path)
+            except ValueError as error:
+                logger.info('Logits file %s is invalid: %s', path, error)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as logits_file:
+            logits_file.write(struct.pack(
+                LogitsFile.header,
+                LogitsFile.magic,
+                LogitsFile.version,
+                num_class,
+                num_sample,
+                bytes.fromhex(checksum),
+                bytes.fromhex(model_checksum)
+            ))
+        return 0
+
+    @staticmethod
+    def append(path: str, logits: np.ndarray) -> None:
+        r"""Append rows of logits to the end of logits file.
+
+        Args:
+            path:
+                Path of logits file prepared by
+                `fine_tune.task.LogitsFile.resume`.
+            logits:
+                Logits with size (B, num_class).
+        """
+        with open(path, 'ab') as logits_file:
+            logits_file.write(
+                np.ascontiguousarray(logits, dtype='<f2').tobytes()
+            )
+
+    @staticmethod
+    def file_path(
+            ckpt: int,
+            dataset: str,
+            experiment_name: str
+    ) -> str:
+        r"""Get logits file path.
+
+        Logits file layout is
+        'FINE_TUNE_EXPERIMENT/experiment_name/logits/dataset-ckpt.bin'.
+
+        Args:
+            ckpt:
+                Checkpoint of model which generates logits.
+            dataset:
+                Name of the dataset.
+            experiment_name:
+                Experiment name of model which generates logits. See
+                `fine_tune.config.BaseConfig.experiment_name`.
+
+        Returns:
+            Logits file path.
+        """
+        return os.path.join(
+            fine_tune.path.FINE_TUNE_EXPERIMENT,
+            experiment_name,
+            'logits',
+            f'{dataset}-{ckpt}.bin'
+        )
@@ -9,8 +9,7 @@ Usage:
     dataset = fine_tune.task.MNLI('dev_mismatched')
     dataset = fine_tune.task.MNLI(...)
 
-    dataset.update_logits(...)
-    dataset.save_for_distill()
+    dataset.load_logits(...)
 
     assert fine_tune.task.get_num_label(fine_tune.task.MNLI) == 3
 
@@ -37,15 +36,14 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import json
 import logging
 import os
 
+from typing import Any
+from typing import Dict
 from typing import List
-
-# 3rd party modules
-
-from tqdm import tqdm
+from typing import Optional
+from typing import Tuple
 
 # my own modules
 
@@ -54,9 +52,10 @@ import fine_tune.path
 from fine_tune.task._dataset import (
     Dataset,
     Label,
-    Sample,
+    SampleColumns,
     label_encoder
 )
+from fine_tune.task._snapshot import DatasetSnapshot
 
 # Get logger.
 
@@ -81,7 +80,7 @@ class MNLI(Dataset):
             Allowed MNLI labels. We do not consider '-' label. See MNLI paper
             for labeling details.
         dataset:
-            A list of MNLI samples.
+            MNLI samples stored in columns.
         task_path:
             Path of MNLI dataset.
     """
@@ -103,32 +102,66 @@ class MNLI(Dataset):
     )
 
     @staticmethod
-    def load(dataset: str) -> List[Sample]:
+    def parse(
+            record: Dict[str, Any]
+    ) -> Optional[Tuple[str, Optional[str], int]]:
+        r"""Parse one MNLI JSON record.
+
+        Args:
+            record:
+                Decoded JSON line of MNLI dataset file.
+
+        Returns:
+            `tuple(text, text_pair, label)`, or `None` if sample's label is
+            '-'. See MNLI paper for labeling details. MNLI labels are encoded
+            with `label_encoder(MNLI, label)`.
+        """
+        if record['gold_label'] == '-':
+            return None
+
+        return (
+            record['sentence1'],
+            record['sentence2'],
+            label_encoder(MNLI, record['gold_label']),
+        )
+
+    @staticmethod
+    def load(dataset: str, num_workers: int = 0) -> SampleColumns:
         r"""Load MNLI dataset into memory.
 
-        This is a heavy IO method and might required lots of memory since
-        dataset might be huge. MNLI dataset must be download previously. See
-        MNLI document in 'project_root/doc/fine_tune_mnli.md' for downloading
-        details.
+        Dataset file is parsed once and saved as binary snapshot, later
+        loads memory-map the snapshot, see `fine_tune.task.DatasetSnapshot`.
+        MNLI dataset must be download previously. See MNLI document in
+        'project_root/doc/fine_tune_mnli.md' for downloading details.
 
         Args:
             dataset:
                 Name of the MNLI dataset to be loaded.
+            num_workers:
+                Number of processes parsing dataset file in parallel.
 
         Raises:
             FileNotFoundError:
                 When MNLI files does not exist.
 
         Returns:
-            A list of MNLI samples.
+            MNLI samples stored in columns.
         """
+        dataset_path = os.path.join(
+            MNLI.task_path,
+            f'{dataset}.jsonl'
+        )
         try:
-            dataset_path = os.path.join(
-                MNLI.task_path,
-                f'{dataset}.jsonl'
+            samples, skipped_sample_count = DatasetSnapshot.load_or_build(
+                path=DatasetSnapshot.snapshot_path(
+                    dataset=dataset,
+                    task='mnli'
+                ),
+                source_path=dataset_path,
+                parse=MNLI.parse,
+                desc=f'Loading MNLI {dataset}',
+                num_workers=num_workers
             )
-            with open(dataset_path, 'r') as jsonl_file:
-                jsonlines = jsonl_file.readlines()
         except FileNotFoundError:
             raise FileNotFoundError(
                 f'MNLI dataset file {dataset} does not exist.\n' +
@@ -139,32 +172,6 @@ class MNLI(Dataset):
                 "' for downloading details."
             )
 
-        samples = []
-        skipped_sample_count = 0
-        for line in tqdm(jsonlines, desc=f'Loading MNLI {dataset}'):
-            # Skip empty line.
-            if line == '':
-                continue
-
-            sample = json.loads(line)
-
-            # Skip sample which label is '-'. See MNLI paper for labeling
-            # details.
-            if sample['gold_label'] == '-':
-                skipped_sample_count += 1
-                continue
-
-            # Format into `transformer.PreTrainedTokenizer` format. MNLI labels
-            # will be encoded with `label_encoder(MNLI, label)`. `logits`
-            # will be initialized with 3 zeros.
-            samples.append(
-                Sample({
-                    'text': sample['sentence1'],
-                    'text_pair': sample['sentence2'],
-                    'label': label_encoder(MNLI, sample['gold_label'])
-                })
-            )
-
         logger.info(
             'Number of origin samples: %d',
             len(samples) + skipped_sample_count
@@ -0,0 +1,459 @@
+r"""Batch samplers of fine-tune task's dataset.
+
+Padding each mini-batch to its longest sample only helps when samples in the
+same mini-batch have similar length. `fine_tune.task.BucketBatchSampler`
+groups samples with similar tokenized length into the same mini-batch while
+still shuffling samples in every epoch. It can also form variable size
+mini-batches under a padded token budget, so that the memory headroom is not
+sized for the worst case where every sample is `max_seq_len` tokens long.
+
+Usage:
+    import torch.utils.data
+    import fine_tune
+
+    cache = fine_tune.task.TokenCache.load_or_build(...)
+    sampler = fine_tune.task.BucketBatchSampler(
+        accum_step=1,
+        batch_size=32,
+        bucket_size=3200,
+        lengths=cache.lengths,
+        max_seq_len=128,
+        max_tokens_per_batch=4096
+    )
+
+    data_loader = torch.utils.data.DataLoader(
+        cache,
+        batch_sampler=sampler,
+        collate_fn=cache.create_collate_fn()
+    )
+
+    efficiency = sampler.padding_efficiency()
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+# 3rd party modules
+
+import numpy as np
+import torch
+import torch.utils
+import torch.utils.data
+
+# my own modules
+
+from fine_tune.task._token_cache import round_seq_len
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    r"""Shuffle samples and group samples with similar length into batches.
+
+    In each epoch samples are randomly permuted and then split into buckets
+    of `bucket_size` samples. Samples in each bucket are sorted by their
+    length and cut into groups of `batch_size * accum_step` samples, each
+    group is then cut into `accum_step` mini-batches. Finally the order of
+    groups is shuffled. Thus samples are shuffled both inside and across
+    buckets, while all mini-batches accumulated into the same optimizer step
+    come from the same bucket.
+
+    When `max_tokens_per_batch > 0`, each group is instead cut into variable
+    size mini-batches whose padded token count does not exceed
+    `max_tokens_per_batch`. Each group still contains exactly
+    `batch_size * accum_step` samples (except the last one), so an optimizer
+    step sees the same effective batch size no matter how many mini-batches
+    it is accumulated from.
+
+    Random permutation is drawn from a generator seeded by `torch` global
+    random state, so batches are reproducible under
+    `fine_tune.util.set_seed`. When `seed` is given, the generator is seeded
+    by `seed + epoch` instead.
+
+    When `num_replicas > 1`, groups of each epoch are dealt to replicas in
+    turn, so every replica of distributed data parallel training sees
+    disjoint groups. With `drop_last=True` every replica gets the same number
+    of groups, thus the same number of optimizer steps.
+
+    Args:
+        accum_step:
+            Number of mini-batches accumulated into one optimizer step.
+        batch_size:
+            Number of samples in each mini-batch.
+        bucket_size:
+            Number of samples in each bucket. `bucket_size` is rounded up to
+            a multiple of `batch_size * accum_step`. Set `bucket_size` to `0`
+            to disable length grouping, which yields plain shuffled batches.
+        lengths:
+            Tokenized length of each sample.
+        drop_last:
+            Whether to drop the last incomplete group of mini-batches.
+        max_seq_len:
+            Maximum input sequence length.
+        max_tokens_per_batch:
+            Maximum number of padded tokens in each mini-batch. A sample
+            longer than the budget still forms a mini-batch by itself. Set
+            `max_tokens_per_batch` to `0` to use fixed `batch_size`
+            mini-batches.
+        num_replicas:
+            Number of distributed data parallel replicas.
+        pad_to_multiple_of:
+            See `fine_tune.task.TokenCache.padded_len`.
+        padding:
+            Padding strategy. See `fine_tune.task.TokenCache.padded_len`.
+        rank:
+            Rank of current replica. `rank` must be in range
+            `[0, num_replicas)`.
+        seed:
+            Random seed shared by all replicas. Must be set when
+            `num_replicas > 1` so that all replicas draw the same
+            permutation.
+        shuffle:
+            Whether to shuffle samples and groups. When `shuffle=False`,
+            samples are visited in order and only sorted inside each bucket.
+
+    The position inside an epoch can be saved by `state_dict` and restored
+    by `load_state_dict`, so that resumed training continues with the rest
+    of the same epoch.
+
+    Attributes:
+        epoch:
+            Number of epochs iterated. Only used when `seed` is given.
+        generator_seed:
+            Seed of the generator which draws current epoch. `None` before
+            the first epoch.
+        group_size:
+            Number of samples in each optimizer step of each replica, which
+            is `batch_size * accum_step`.
+
+    Raises:
+        ValueError:
+            If `accum_step < 1`, `batch_size < 1`, `bucket_size < 0`,
+            `max_tokens_per_batch < 0` or `rank` is out of range. Or if
+            `drop_last=True` and there are fewer than
+            `batch_size * accum_step * num_replicas` samples. Or if
+            `num_replicas > 1` and `seed` is `None`.
+    """
+
+    def __init__(
+            self,
+            accum_step: int,
+            batch_size: int,
+            bucket_size: int,
+            lengths: np.ndarray,
+            drop_last: bool = False,
+            max_seq_len: int = 512,
+            max_tokens_per_batch: int = 0,
+            num_replicas: int = 1,
+            pad_to_multiple_of: int = 1,
+            padding: str = 'longest',
+            rank: int = 0,
+            seed: Optional[int] = None,
+            shuffle: bool = True
+    ):
+        if accum_step < 1:
+            raise ValueError(
+                '`accum_step` must be bigger than or equal to `1`.'
+            )
+
+        if batch_size < 1:
+            raise ValueError(
+                '`batch_size` must be bigger than or equal to `1`.'
+            )
+
+        if bucket_size < 0:
+            raise ValueError(
+                '`bucket_size` must be bigger than or equal to `0`.'
+            )
+
+        if max_tokens_per_batch < 0:
+            raise ValueError(
+                '`max_tokens_per_batch` must be bigger than or equal to `0`.'
+            )
+
+        if num_replicas < 1:
+            raise ValueError(
+                '`num_replicas` must be bigger than or equal to `1`.'
+            )
+
+        if not 0 <= rank < num_replicas:
+            raise ValueError(
+                '`rank` must be bigger than or equal to `0` and smaller ' +
+                'than `num_replicas`.'
+            )
+
+        if num_replicas > 1 and seed is None:
+            raise ValueError(
+                '`seed` must be set when `num_replicas > 1`.'
+            )
+
+        if drop_last and (
+                len(lengths) < batch_size * accum_step * num_replicas
+        ):
+            raise ValueError(
+                'Number of samples must be bigger than or equal to ' +
+                '`batch_size * accum_step * num_replicas` when ' +
+                '`drop_last=True`.'
+            )
+
+        self.accum_step = accum_step
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.epoch = 0
+        self.generator_seed: Optional[int] = None
+        self.group_size = batch_size * accum_step
+        self.lengths = np.asarray(lengths)
+        self.max_seq_len = max_seq_len
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.num_replicas = num_replicas
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.padding = padding
+        self.rank = rank
+        self.seed = seed
+        self.shuffle = shuffle
+
+        # Round up to a multiple of `group_size` so that only the last group
+        # of an epoch might be incomplete.
+        self.bucket_size = (
+            -(-bucket_size // self.group_size) * self.group_size
+        )
+
+        # Number of mini-batches skipped by the next epoch, which is set by
+        # `load_state_dict`.
+        self.resume_batches = 0
+        self.resume_seed: Optional[int] = None
+
+    def __iter__(self) -> Iterator[List[int]]:
+        # Epoch is drawn when the first mini-batch is requested instead of
+        # when iterator is created. `torch.utils.data.DataLoader` with
+        # workers creates two iterators in its first epoch and discards the
+        # first one, which must not draw seed or consume resumed position.
+        start = 0
+        if self.resume_seed is not None:
+            # Continue the epoch saved by `state_dict`. No seed is drawn, thus
+            # `torch` global random state is not affected.
+            self.generator_seed = self.resume_seed
+            start = self.resume_batches
+            self.resume_batches = 0
+            self.resume_seed = None
+        elif self.seed is None:
+            # Draw seed from `torch` global random state for reproducibility.
+            self.generator_seed = int(
+                torch.empty((), dtype=torch.int64).random_().item()
+            )
+        else:
+            # All replicas share the same seed in the same epoch.
+            self.generator_seed = self.seed + self.epoch
+            self.epoch += 1
+
+        generator = torch.Generator()
+        generator.manual_seed(self.generator_seed)
+        yield from self.batches(generator)[start:]
+
+    def __len__(self) -> int:
+        # Number of mini-batches depends on the permutation under token
+        # budget. This is exact when `shuffle=False` and an estimate
+        # otherwise.
+        if self.max_tokens_per_batch or self.num_replicas > 1:
+            generator = torch.Generator()
+            generator.manual_seed(0)
+            return len(self.batches(generator))
+
+        num_group, remain = divmod(len(self.lengths), self.group_size)
+        if self.drop_last or remain == 0:
+            return num_group * self.accum_step
+        return num_group * self.accum_step + -(-remain // self.batch_size)
+
+    def state_dict(self, num_batches: int) -> Dict[str, int]:
+        r"""Save position inside current epoch.
+
+        Sampler does not know how many mini-batches were consumed, since
+        `torch.utils.data.DataLoader` draws mini-batches ahead. Thus caller
+        must count consumed mini-batches of current epoch.
+
+        Args:
+            num_batches:
+                Number of mini-batches of current epoch consumed by caller.
+
+        Raises:
+            ValueError:
+                If no epoch was started.
+
+        Returns:
+            Sampler state, which is restored by `load_state_dict`.
+        """
+        if self.generator_seed is None:
+            raise ValueError(
+                'No epoch was started, iterate sampler first.'
+            )
+
+        return {
+            'epoch': self.epoch,
+            'generator_seed': self.generator_seed,
+            'num_batches': num_batches,
+        }
+
+    def load_state_dict(self, state: Dict[str, int]) -> None:
+        r"""Restore position saved by `state_dict`.
+
+        The next iteration continues the saved epoch, starting from the first
+        mini-batch not consumed yet. Later epochs are drawn as usual.
+
+        Args:
+            state:
+                Sampler state returned by `state_dict`.
+        """
+        self.epoch = state['epoch']
+        self.generator_seed = state['generator_seed']
+        self.resume_batches = state['num_batches']
+        self.resume_seed = state['generator_seed']
+
+    def batches(self, generator: torch.Generator) -> List[List[int]]:
+        r"""Generate mini-batches of one epoch.
+
+        Args:
+            generator:
+                Random number generator used to shuffle samples.
+
+        Returns:
+            A list of mini-batches, each mini-batch is a list of sample
+            indices.
+        """
+        if self.shuffle:
+            perm = torch.randperm(
+                len(self.lengths),
+                generator=generator
+            ).numpy()
+        else:
+            perm = np.arange(len(self.lengths))
+
+        # Sort samples inside each bucket by length.
+        if self.bucket_size:
+            buckets = []
+            for start in range(0, len(perm), self.bucket_size):
+                bucket = perm[start:start + self.bucket_size]
+                buckets.append(
+                    bucket[np.argsort(self.lengths[bucket], kind='stable')]
+                )
+            perm = np.concatenate(buckets) if buckets else perm
+
+        # Cut into groups of `group_size` samples.
+        groups = [
+            perm[start:start + self.group_size]
+            for start in range(0, len(perm), self.group_size)
+        ]
+
+        # Keep the incomplete group at the end of an epoch.
+        last_group = None
+        if groups and len(groups[-1]) < self.group_size:
+            last_group = groups.pop()
+
+        # Shuffle groups across buckets.
+        if self.shuffle:
+            order = torch.randperm(len(groups), generator=generator).tolist()
+            groups = [groups[index] for index in order]
+        if last_group is not None and not self.drop_last:
+            groups.append(last_group)
+
+        # Deal groups to replicas. Drop remaining groups so that all replicas
+        # perform the same number of optimizer steps.
+        if self.num_replicas > 1:
+            if self.drop_last:
+                groups = groups[
+                    :len(groups) // self.num_replicas * self.num_replicas
+                ]
+            groups = groups[self.rank::self.num_replicas]
+
+        # Cut each group into mini-batches.
+        batches = []
+        for group in groups:
+            batches.extend(self.split_group(group))
+        return batches
+
+    def seq_len(self, length: int) -> int:
+        r"""Padded sequence length of a mini-batch.
+
+        Args:
+            length:
+                Length of the longest sample in the mini-batch.
+
+        Returns:
+            Sequence length after padding.
+        """
+        if self.padding == 'max_length':
+            return self.max_seq_len
+        return round_seq_len(
+            seq_len=length,
+            max_seq_len=self.max_seq_len,
+            pad_to_multiple_of=self.pad_to_multiple_of
+        )
+
+    def split_group(self, group: np.ndarray) -> List[List[int]]:
+        r"""Cut a group of samples into mini-batches.
+
+        Args:
+            group:
+                Sample indices of one optimizer step.
+
+        Returns:
+            A list of mini-batches, each mini-batch is a list of sample
+            indices.
+        """
+        if not self.max_tokens_per_batch:
+            return [
+                group[start:start + self.batch_size].tolist()
+                for start in range(0, len(group), self.batch_size)
+            ]
+
+        # Visit samples from the longest one, so that the first sample of
+        # each mini-batch decides its padded length.
+        group = group[np.argsort(-self.lengths[group], kind='stable')]
+
+        batches = []
+        start = 0
+        while start < len(group):
+            size = max(
+                1,
+                self.max_tokens_per_batch // self.seq_len(
+                    int(self.lengths[group[start]])
+                )
+            )
+            batches.append(group[start:start + size].tolist())
+            start += size
+        return batches
+
+    def padding_efficiency(self, seed: int = 0) -> float:
+        r"""Fraction of real tokens over padded tokens in one epoch.
+
+        Efficiency is estimated on a epoch drawn from a separate generator, so
+        `torch` global random state is not affected.
+
+        Args:
+            seed:
+                Random seed of the estimated epoch.
+
+        Returns:
+            Number of real tokens divided by number of padded tokens.
+        """
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+
+        real_token = 0
+        padded_token = 0
+        for batch in self.batches(generator):
+            batch_lengths = self.lengths[batch]
+            real_token += int(batch_lengths.sum())
+            padded_token += len(batch) * self.seq_len(
+                int(batch_lengths.max())
+            )
+
+        if padded_token == 0:
+            return 1.0
+        return real_token / padded_token
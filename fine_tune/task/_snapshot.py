@@ -0,0 +1,402 @@
+r"""Binary snapshot of fine-tune task's dataset.
+
+Parsing JSONL dataset file takes seconds. Snapshot file stores parsed
+`fine_tune.task.SampleColumns` as flat arrays so that later loads only
+memory-map them. Snapshot file starts with a fixed size header followed by
+offsets of `text`, offsets of `text_pair` (if any), `label`, UTF-8 buffer of
+`text` and UTF-8 buffer of `text_pair` (if any).
+
+Header records size, modification time and SHA-1 checksum of the source
+JSONL file. Snapshot is reused when source size and modification time are
+unchanged, or when modification time changed (e.g., file was copied) but
+checksum still matches. Otherwise source file is parsed again and snapshot
+is rewritten.
+
+Usage:
+    import fine_tune
+
+    samples, skipped = fine_tune.task.DatasetSnapshot.load_or_build(
+        path=fine_tune.task.DatasetSnapshot.snapshot_path(
+            dataset='train',
+            task='mnli'
+        ),
+        source_path=source_path,
+        parse=fine_tune.task.MNLI.parse,
+        desc='Loading MNLI train',
+        num_workers=4
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import os
+import struct
+import time
+
+from typing import Optional
+from typing import Tuple
+
+# 3rd party modules
+
+import numpy as np
+
+# my own modules
+
+import fine_tune.path
+
+from fine_tune.task._dataset import SampleColumns
+from fine_tune.task._dataset import StringColumn
+from fine_tune.task._jsonl import ParseFn
+from fine_tune.task._jsonl import load_jsonl
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.task')
+
+
+class DatasetSnapshot:
+    r"""Memory-mapped snapshot of parsed dataset.
+
+    Args:
+        path:
+            Path of snapshot file.
+
+    Attributes:
+        header:
+            `struct` format of file header: magic bytes, format version,
+            whether `text_pair` exists, number of samples, number of skipped
+            records, source file size, source file modification time in
+            nanoseconds, source file SHA-1 checksum, number of bytes of `text`
+            buffer and number of bytes of `text_pair` buffer.
+        magic:
+            Magic bytes at the beginning of snapshot file.
+        samples:
+            Memory-mapped samples stored in columns.
+        skipped:
+            Number of records skipped when parsing source file.
+        source_checksum:
+            SHA-1 checksum of source file.
+        source_mtime_ns:
+            Modification time of source file in nanoseconds.
+        source_size:
+            Size of source file in bytes.
+        version:
+            File format version. Must be increased whenever parsing rules of
+            any task change, so that old snapshots are rebuilt.
+
+    Raises:
+        FileNotFoundError:
+            When snapshot file does not exist.
+        ValueError:
+            When file is not a snapshot file, version does not match or file
+            is incomplete.
+    """
+    header: str = '<8sIIQQQq20s4xQQ'
+
+    magic: bytes = b'BGSNAPSH'
+
+    version: int = 1
+
+    def __init__(self, path: str):
+        header_size = struct.calcsize(DatasetSnapshot.header)
+        with open(path, 'rb') as snapshot_file:
+            header = snapshot_file.read(header_size)
+
+        if len(header) != header_size:
+            raise ValueError(f'{path} is not a snapshot file.')
+
+        (
+            magic,
+            version,
+            has_text_pair,
+            num_sample,
+            self.skipped,
+            self.source_size,
+            self.source_mtime_ns,
+            self.source_checksum,
+            text_size,
+            text_pair_size,
+        ) = struct.unpack(DatasetSnapshot.header, header)
+
+        if magic != DatasetSnapshot.magic:
+            raise ValueError(f'{path} is not a snapshot file.')
+        if version != DatasetSnapshot.version:
+            raise ValueError(
+                f'Snapshot version {version} in {path} does not match ' +
+                f'current version {DatasetSnapshot.version}.'
+            )
+
+        # Layout of each section: (name, numeric type, number of elements).
+        sections = [('text_offsets', np.int64, num_sample + 1)]
+        if has_text_pair:
+            sections.append(('text_pair_offsets', np.int64, num_sample + 1))
+        sections.append(('label', np.int8, num_sample))
+        sections.append(('text', np.uint8, text_size))
+        if has_text_pair:
+            sections.append(('text_pair', np.uint8, text_pair_size))
+
+        expected_size = header_size + sum(
+            np.dtype(dtype).itemsize * count
+            for _, dtype, count in sections
+        )
+        if os.path.getsize(path) != expected_size:
+            raise ValueError(
+                f'Snapshot file {path} is incomplete: expect ' +
+                f'{expected_size} bytes but got {os.path.getsize(path)}.'
+            )
+
+        # Memory-map all sections.
+        arrays = {}
+        offset = header_size
+        for name, dtype, count in sections:
+            if count:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode='r',
+                    offset=offset,
+                    shape=(count,)
+                )
+            else:
+                # Zero length memory-map is not allowed.
+                arrays[name] = np.zeros(0, dtype=dtype)
+            offset += np.dtype(dtype).itemsize * count
+
+        text_pair = None
+        if has_text_pair:
+            text_pair = StringColumn(
+                data=arrays['text_pair'],
+                offsets=arrays['text_pair_offsets']
+            )
+
+        self.samples = SampleColumns(
+            text=StringColumn(
+                data=arrays['text'],
+                offsets=arrays['text_offsets']
+            ),
+            text_pair=text_pair,
+            label=arrays['label'],
+            checksum=self.source_checksum.hex()
+        )
+
+    def is_fresh(self, path: str, source_path: str) -> bool:
+        r"""Check whether snapshot is parsed from current source file.
+
+        Checksum is only computed when source modification time changed. If
+        checksum still matches, new modification time is written back into
+        snapshot header so that checksum is not computed again.
+
+        Args:
+            path:
+                Path of snapshot file.
+            source_path:
+                Path of source JSONL file.
+
+        Returns:
+            `True` if snapshot matches source file.
+        """
+        stat = os.stat(source_path)
+        if stat.st_size != self.source_size:
+            return False
+        if stat.st_mtime_ns == self.source_mtime_ns:
+            return True
+        if DatasetSnapshot.checksum(source_path) != self.source_checksum:
+            return False
+
+        # Modification time is the only `q` field of header. Only header is
+        # rewritten, memory-mapped sections stay intact.
+        try:
+            with open(path, 'r+b') as snapshot_file:
+                snapshot_file.seek(struct.calcsize(
+                    DatasetSnapshot.header[:DatasetSnapshot.header.index('q')]
+                ))
+                snapshot_file.write(struct.pack('<q', stat.st_mtime_ns))
+            self.source_mtime_ns = stat.st_mtime_ns
+        except OSError as error:
+            logger.warning('Failed to update snapshot %s: %s', path, error)
+        return True
+
+    @staticmethod
+    def checksum(path: str, block_size: int = 1 << 22) -> bytes:
+        r"""Compute SHA-1 checksum of file.
+
+        Args:
+            path:
+                Path of file.
+            block_size:
+                Number of bytes to read at once.
+
+        Returns:
+            SHA-1 digest of file content.
+        """
+        digest = hashlib.sha1()
+        with open(path, 'rb') as source_file:
+            for block in iter(lambda: source_file.read(block_size), b''):
+                digest.update(block)
+        return digest.digest()
+
+    @staticmethod
+    def snapshot_path(dataset: str, task: str) -> str:
+        r"""Get snapshot file path.
+
+        Snapshot file is stored in the same folder as token caches, i.e.,
+        'FINE_TUNE_CACHE/task/dataset/snapshot.bin'.
+
+        Args:
+            dataset:
+                Name of the dataset.
+            task:
+                Name of the fine-tune task.
+
+        Returns:
+            Snapshot file path.
+        """
+        return os.path.join(
+            fine_tune.path.FINE_TUNE_CACHE,
+            task,
+            dataset,
+            'snapshot.bin'
+        )
+
+    @staticmethod
+    def save(
+            path: str,
+            samples: SampleColumns,
+            skipped: int,
+            source_path: str,
+            checksum: Optional[bytes] = None
+    ) -> None:
+        r"""Save parsed samples into snapshot file.
+
+        File is written into a temporary file first and then renamed, thus
+        an interrupted save never leaves a partial snapshot behind.
+
+        Args:
+            path:
+                Path of snapshot file.
+            samples:
+                Samples parsed from `source_path`.
+            skipped:
+                Number of records skipped when parsing `source_path`.
+            source_path:
+                Path of source JSONL file.
+            checksum:
+                SHA-1 checksum of `source_path`. Computed when `None`.
+        """
+        stat = os.stat(source_path)
+        if checksum is None:
+            checksum = DatasetSnapshot.checksum(source_path)
+
+        # Same section order as `__init__`.
+        sections = [(samples.text.offsets, np.int64)]
+        if samples.text_pair is not None:
+            sections.append((samples.text_pair.offsets, np.int64))
+        sections.append((samples.label, np.int8))
+        sections.append((samples.text.data, np.uint8))
+        if samples.text_pair is not None:
+            sections.append((samples.text_pair.data, np.uint8))
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'wb') as snapshot_file:
+            snapshot_file.write(struct.pack(
+                DatasetSnapshot.header,
+                DatasetSnapshot.magic,
+                DatasetSnapshot.version,
+                samples.text_pair is not None,
+                len(samples),
+                skipped,
+                stat.st_size,
+                stat.st_mtime_ns,
+                checksum,
+                len(samples.text.data),
+                0 if samples.text_pair is None else len(samples.text_pair.data)
+            ))
+            for section, dtype in sections:
+                snapshot_file.write(
+                    np.ascontiguousarray(section, dtype=dtype).data
+                )
+
+        # Replace stale snapshot if any.
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load_or_build(
+            cls,
+            path: str,
+            source_path: str,
+            parse: ParseFn,
+            desc: str,
+            num_workers: int = 0
+    ) -> Tuple[SampleColumns, int]:
+        r"""Load snapshot, parse source file and write snapshot if stale.
+
+        Failing to write snapshot (e.g., read-only file system) is not an
+        error, parsed samples are returned anyway.
+
+        Args:
+            path:
+                Path of snapshot file.
+            source_path:
+                Path of source JSONL file.
+            parse:
+                Function convert one JSON record into sample fields, see
+                `fine_tune.task._jsonl.load_jsonl`.
+            desc:
+                Progress bar description.
+            num_workers:
+                Number of processes parsing source file in parallel.
+
+        Raises:
+            FileNotFoundError:
+                When `source_path` does not exist.
+
+        Returns:
+            Samples in source file order and number of skipped records.
+        """
+        start_time = time.perf_counter()
+        try:
+            snapshot = cls(path)
+            if snapshot.is_fresh(path=path, source_path=source_path):
+                logger.info(
+                    'Load snapshot %s in %.3f s.',
+                    path,
+                    time.perf_counter() - start_time
+                )
+                return snapshot.samples, snapshot.skipped
+            logger.info('Snapshot %s is stale.', path)
+        except FileNotFoundError:
+            # Missing source file is reported by `load_jsonl`.
+            logger.info('Snapshot %s not found.', path)
+        except ValueError as error:
+            logger.info('Snapshot %s is invalid: %s', path, error)
+
+        samples, skipped = load_jsonl(
+            path=source_path,
+            parse=parse,
+            desc=desc,
+            num_workers=num_workers
+        )
+        checksum = cls.checksum(source_path)
+        samples.checksum = checksum.hex()
+
+        try:
+            cls.save(
+                path=path,
+                samples=samples,
+                skipped=skipped,
+                source_path=source_path,
+                checksum=checksum
+            )
+            logger.info('Save snapshot %s.', path)
+        except OSError as error:
+            logger.warning('Failed to save snapshot %s: %s', path, error)
+
+        return samples, skipped
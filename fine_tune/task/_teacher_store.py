@@ -0,0 +1,766 @@
+r"""Sharded, memory-mapped store of fine-tuned teacher model's outputs.
+
+Teacher model is frozen during distillation, so its logits, hidden states and
+attentions never change between epochs. `fine_tune.task.TeacherStore` saves
+those outputs once as `numpy.float16` arrays on disk, and distillation reads
+them back by sample index instead of running teacher forward pass.
+
+Only outputs on real (non-padding) tokens are saved. Attentions are saved as
+log-probabilities. Hidden states on padding positions are filled with zeros
+and attentions on padding positions are filled with the minimum of
+`numpy.float16` (i.e., probability zero) when gathering a mini-batch.
+
+Usage:
+    import torch.utils.data
+    import fine_tune
+
+    fine_tune.task.TeacherStore.build(
+        store_dir=store_dir,
+        attn_layers=[1, 3],
+        batch_size=32,
+        cache=teacher_cache,
+        device=torch.device('cuda:0'),
+        hidden_layers=[1, 3],
+        model=teacher_model
+    )
+    store = fine_tune.task.TeacherStore(store_dir)
+
+    data_loader = torch.utils.data.DataLoader(
+        student_cache,
+        collate_fn=fine_tune.task.TeacherStore.create_pair_collate_fn(
+            teacher_store=store,
+            student_cache=student_cache
+        )
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+
+from typing import Callable
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+# 3rd party modules
+
+import numpy as np
+import torch
+import torch.nn
+
+from tqdm import tqdm
+
+# my own modules
+
+import fine_tune.path
+
+from fine_tune.task._token_cache import TokenCache
+from fine_tune.task._token_cache import round_seq_len
+
+# Define types for type annotation.
+
+# Teacher outputs of a mini-batch: `tuple(logits, hiddens, attns)`.
+# - `logits.size == (B, C)`.
+# - `hiddens` is a list of `torch.Tensor` with size (B, S, H).
+# - `attns` is a list of `torch.Tensor` with size (B, A, S, S).
+# All tensors have numeric type `torch.float32`.
+
+TeacherOutput = Tuple[
+    torch.FloatTensor,
+    List[torch.FloatTensor],
+    List[torch.FloatTensor],
+]
+
+# `collate_fn` used by offline distillation. Input list of sample indices and
+# return teacher outputs, student encoding and label.
+
+StorePairCollateFnReturn = Tuple[
+    TeacherOutput,
+    Tuple[torch.LongTensor, torch.LongTensor, torch.LongTensor],
+    torch.LongTensor,
+]
+
+StorePairCollateFn = Callable[
+    [List[int]],
+    StorePairCollateFnReturn
+]
+
+
+class TeacherStore:
+    r"""Sharded, memory-mapped store of teacher model's outputs.
+
+    Samples are split into shards of `shard_size` samples, the `i`-th sample
+    is saved in shard `i // shard_size`. Each shard folder contains:
+        - `lengths.npy`: Number of tokens of each sample.
+        - `logits.npy`: Logits with size (N, C).
+        - `hidden.npy`: Hidden states of real tokens with size
+          (num_token, len(hidden_layers), H). Only exists when
+          `hidden_layers` is not empty.
+        - `attn.npy`: Flat attention log-probabilities of real tokens.
+          Attentions of a sample with length `L` has size
+          (len(attn_layers), A, L, L). Only exists when `attn_layers` is not
+          empty.
+
+    Args:
+        store_dir:
+            Folder which contains store files built by
+            `fine_tune.task.TeacherStore.build`.
+
+    Attributes:
+        attn_layers:
+            Saved attention layer indices. Index `i` refers to the `i`-th
+            teacher Transformer layer, starting from `0`.
+        checksum:
+            Hex SHA-1 checksum of dataset source file of teacher cache. See
+            `fine_tune.task.TokenCache`.
+        fingerprint:
+            Fingerprint of teacher tokenizer. See
+            `fine_tune.task.tokenizer_fingerprint`.
+        hidden_layers:
+            Saved hidden state layer indices. Index `i` refers to the `i`-th
+            element of teacher's output hidden states, where index `0` is
+            embedding output.
+        hidden_size:
+            Teacher hidden state dimension.
+        lengths:
+            Number of tokens of each sample with numeric type `numpy.int32`.
+        max_seq_len:
+            Maximum input sequence length of teacher model.
+        num_attention_heads:
+            Number of teacher attention heads.
+        num_class:
+            Number of classes.
+        num_hidden_layers:
+            Number of teacher Transformer layers.
+        shard_size:
+            Number of samples in each shard.
+        store_dir:
+            Folder which contains store files.
+        version:
+            Store format version.
+
+    Raises:
+        FileNotFoundError:
+            When store files does not exist.
+        ValueError:
+            When store version does not match.
+    """
+    version: int = 3
+
+    def __init__(self, store_dir: str):
+        with open(
+                os.path.join(store_dir, 'meta.json'),
+                'r',
+                encoding='utf-8'
+        ) as json_file:
+            meta = json.load(json_file)
+
+        if meta['version'] != TeacherStore.version:
+            raise ValueError(
+                f'Store version {meta["version"]} in {store_dir} does not ' +
+                f'match current version {TeacherStore.version}.'
+            )
+
+        self.attn_layers = meta['attn_layers']
+        self.checksum = meta['checksum']
+        self.fingerprint = meta['fingerprint']
+        self.hidden_layers = meta['hidden_layers']
+        self.hidden_size = meta['hidden_size']
+        self.max_seq_len = meta['max_seq_len']
+        self.num_attention_heads = meta['num_attention_heads']
+        self.num_class = meta['num_class']
+        self.num_hidden_layers = meta['num_hidden_layers']
+        self.shard_size = meta['shard_size']
+        self.store_dir = store_dir
+
+        # Memory-map all shards.
+        self.shards = []
+        for shard_id in range(meta['num_shard']):
+            shard_dir = os.path.join(store_dir, f'shard-{shard_id}')
+            shard = {
+                name: np.load(
+                    os.path.join(shard_dir, f'{name}.npy'),
+                    mmap_mode='r'
+                )
+                for name in ('lengths', 'logits')
+            }
+            if self.hidden_layers:
+                shard['hidden'] = np.load(
+                    os.path.join(shard_dir, 'hidden.npy'),
+                    mmap_mode='r'
+                )
+                shard['hidden_offsets'] = TeacherStore.offsets(
+                    shard['lengths']
+                )
+            if self.attn_layers:
+                shard['attn'] = np.load(
+                    os.path.join(shard_dir, 'attn.npy'),
+                    mmap_mode='r'
+                )
+                shard['attn_offsets'] = TeacherStore.offsets(
+                    len(self.attn_layers) *
+                    self.num_attention_heads *
+                    shard['lengths'].astype(np.int64) ** 2
+                )
+            self.shards.append(shard)
+
+        if self.shards:
+            self.lengths = np.concatenate(
+                [shard['lengths'] for shard in self.shards]
+            )
+        else:
+            self.lengths = np.zeros(0, dtype=np.int32)
+
+    def __reduce__(self) -> Tuple[type, Tuple[str]]:
+        r"""Pickle store by its folder instead of array contents.
+
+        Memory-mapped shards would be copied into pickle otherwise. Unpickled
+        store maps the same files again, see
+        `fine_tune.task.TokenCache.__reduce__`.
+
+        Returns:
+            Class and arguments to reconstruct store.
+        """
+        return (self.__class__, (self.store_dir,))
+
+    def __len__(self) -> int:
+        r"""Return number of stored samples.
+
+        Returns:
+            Number of stored samples.
+        """
+        return len(self.lengths)
+
+    @staticmethod
+    def offsets(sizes: np.ndarray) -> np.ndarray:
+        r"""Start position of each sample in a flat array.
+
+        Args:
+            sizes:
+                Number of elements of each sample.
+
+        Returns:
+            Start positions with numeric type `numpy.int64`. Returned array has
+            one more element than `sizes`.
+        """
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        return offsets
+
+    def layer_position(
+            self,
+            layers: Sequence[int],
+            stored_layers: Sequence[int],
+            name: str
+    ) -> List[int]:
+        r"""Map teacher layer indices to their positions in store.
+
+        Args:
+            layers:
+                Requested teacher layer indices.
+            stored_layers:
+                Teacher layer indices saved in store.
+            name:
+                Name of layer kind. Only used in error message.
+
+        Raises:
+            ValueError:
+                When some requested layers are not saved in store.
+
+        Returns:
+            Positions of `layers` in `stored_layers`.
+        """
+        missing = sorted(set(layers) - set(stored_layers))
+        if missing:
+            raise ValueError(
+                f'Teacher {name} layers {missing} are not saved in store.'
+            )
+        return [stored_layers.index(layer) for layer in layers]
+
+    def get_batch(
+            self,
+            indices: List[int],
+            seq_len: int,
+            attn_layers: Sequence[int] = (),
+            hidden_layers: Sequence[int] = ()
+    ) -> TeacherOutput:
+        r"""Gather teacher outputs into right padded tensors.
+
+        We use the following notation for the rest of the context.
+            - A: num of attention heads.
+            - B: batch size.
+            - C: number of class.
+            - H: hidden state size.
+            - S: sequence length.
+
+        Args:
+            indices:
+                Sample indices of the mini-batch.
+            seq_len:
+                Padded sequence length. `seq_len` must be bigger than or equal
+                to the longest sample in `indices`.
+            attn_layers:
+                Teacher attention layer indices to gather.
+            hidden_layers:
+                Teacher hidden state layer indices to gather.
+
+        Returns:
+            Logits with size (B, C), list of hidden states with size (B, S, H)
+            for each layer in `hidden_layers` and list of attention
+            log-probabilities with size (B, A, S, S) for each layer in
+            `attn_layers`. All tensors have numeric type `torch.float32`.
+        """
+        hidden_pos = self.layer_position(
+            layers=hidden_layers,
+            stored_layers=self.hidden_layers,
+            name='hidden state'
+        )
+        attn_pos = self.layer_position(
+            layers=attn_layers,
+            stored_layers=self.attn_layers,
+            name='attention'
+        )
+
+        logits = np.zeros((len(indices), self.num_class), dtype=np.float32)
+        hiddens = np.zeros(
+            (len(hidden_pos), len(indices), seq_len, self.hidden_size),
+            dtype=np.float32
+        )
+        attns = np.full(
+            (
+                len(attn_pos),
+                len(indices),
+                self.num_attention_heads,
+                seq_len,
+                seq_len
+            ),
+            np.finfo(np.float16).min,
+            dtype=np.float32
+        )
+
+        for row, index in enumerate(indices):
+            shard = self.shards[index // self.shard_size]
+            local = index % self.shard_size
+            length = int(shard['lengths'][local])
+
+            logits[row] = shard['logits'][local]
+
+            if hidden_pos:
+                start = shard['hidden_offsets'][local]
+                # `hidden.size == (L, len(self.hidden_layers), H)`.
+                hidden = shard['hidden'][start:start + length]
+                hiddens[:, row, :length] = (
+                    hidden[:, hidden_pos].transpose(1, 0, 2)
+                )
+
+            if attn_pos:
+                start = shard['attn_offsets'][local]
+                end = shard['attn_offsets'][local + 1]
+                # `attn.size == (len(self.attn_layers), A, L, L)`.
+                attn = shard['attn'][start:end].reshape(
+                    len(self.attn_layers),
+                    self.num_attention_heads,
+                    length,
+                    length
+                )
+                attns[:, row, :, :length, :length] = attn[attn_pos]
+
+        return (
+            torch.from_numpy(logits),
+            [torch.from_numpy(hidden) for hidden in hiddens],
+            [torch.from_numpy(attn) for attn in attns],
+        )
+
+    @staticmethod
+    def create_pair_collate_fn(
+            teacher_store: 'TeacherStore',
+            student_cache: TokenCache,
+            attn_layers: Sequence[int] = (),
+            hidden_layers: Sequence[int] = (),
+            padding: str = 'longest',
+            pad_to_multiple_of: int = 1
+    ) -> StorePairCollateFn:
+        r"""Create `collate_fn` which gather teacher outputs and student inputs.
+
+        Padded length follows `fine_tune.task.TokenCache.create_pair_collate_fn`
+        so that offline teacher outputs are aligned with student inputs the
+        same way as online teacher outputs.
+
+        Args:
+            teacher_store:
+                Store built from the same dataset as `student_cache`.
+            student_cache:
+                Cache built with student tokenizer.
+            attn_layers:
+                Teacher attention layer indices to gather.
+            hidden_layers:
+                Teacher hidden state layer indices to gather.
+            padding:
+                Padding strategy. See `fine_tune.task.TokenCache.padded_len`.
+            pad_to_multiple_of:
+                See `fine_tune.task.TokenCache.padded_len`.
+
+        Raises:
+            ValueError:
+                When store and cache have different size or are built from
+                different dataset source files.
+
+        Returns:
+            `collate_fn` function used by `torch.utils.data.Dataloader`.
+        """
+        if len(teacher_store) != len(student_cache):
+            raise ValueError(
+                'Teacher store and student cache must have the same size.'
+            )
+        if teacher_store.checksum != student_cache.checksum:
+            raise ValueError(
+                'Teacher store and student cache must be built from the ' +
+                'same dataset file. Dump teacher store again.'
+            )
+
+        return _StorePairCollate(
+            teacher_store=teacher_store,
+            student_cache=student_cache,
+            attn_layers=attn_layers,
+            hidden_layers=hidden_layers,
+            padding=padding,
+            pad_to_multiple_of=pad_to_multiple_of
+        )
+
+    @staticmethod
+    def store_dir(
+            ckpt: int,
+            dataset: str,
+            experiment_name: str
+    ) -> str:
+        r"""Get store folder path.
+
+        Store folder layout is
+        'FINE_TUNE_EXPERIMENT/experiment_name/teacher_store/dataset-ckpt'.
+
+        Args:
+            ckpt:
+                Checkpoint of teacher model.
+            dataset:
+                Name of the dataset.
+            experiment_name:
+                Teacher experiment name. See
+                `fine_tune.config.BaseConfig.experiment_name`.
+
+        Returns:
+            Store folder path.
+        """
+        return os.path.join(
+            fine_tune.path.FINE_TUNE_EXPERIMENT,
+            experiment_name,
+            'teacher_store',
+            f'{dataset}-{ckpt}'
+        )
+
+    @staticmethod
+    @torch.no_grad()
+    def build(
+            store_dir: str,
+            attn_layers: Sequence[int],
+            batch_size: int,
+            cache: TokenCache,
+            device: torch.device,
+            hidden_layers: Sequence[int],
+            model: torch.nn.Module,
+            amp: bool = False,
+            shard_size: int = 10000
+    ) -> None:
+        r"""Run teacher model over all samples in `cache` and save outputs.
+
+        Store files are first written into a temporary folder and then
+        renamed to `store_dir`, thus a interrupted build will never leave a
+        broken store. Within each shard samples are sorted by length before
+        forming mini-batches to reduce padding.
+
+        Args:
+            store_dir:
+                Folder to save store files.
+            attn_layers:
+                Teacher attention layer indices to save.
+            batch_size:
+                Number of samples in each teacher forward pass.
+            cache:
+                Cache built with teacher tokenizer.
+            device:
+                Teacher model running device.
+            hidden_layers:
+                Teacher hidden state layer indices to save. Index `0` refers
+                to embedding output.
+            model:
+                Fine-tuned teacher model. Must support `attn_layers` and
+                `hidden_layers` arguments of `forward` when `attn_layers` or
+                `hidden_layers` is not empty. See
+                `fine_tune.model.capture_layers`.
+            amp:
+                Run teacher forward pass with automatic mixed precision.
+            shard_size:
+                Number of samples in each shard.
+        """
+        # `fine_tune.util` imports `fine_tune.task`, import it lazily to
+        # avoid circular import.
+        import fine_tune.util.amp
+
+        model.eval()
+
+        attn_layers = list(attn_layers)
+        hidden_layers = list(hidden_layers)
+        encoder_config = model.encoder.config
+
+        # Write into temporary folder first.
+        tmp_dir = f'{store_dir}.tmp-{os.getpid()}'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        num_shard = -(-len(cache) // shard_size)
+        num_class = None
+        cli_logger = tqdm(
+            desc=f'Dumping teacher outputs {os.path.basename(store_dir)}',
+            total=len(cache)
+        )
+
+        for shard_id in range(num_shard):
+            shard_dir = os.path.join(tmp_dir, f'shard-{shard_id}')
+            os.makedirs(shard_dir)
+
+            shard_start = shard_id * shard_size
+            shard_end = min(shard_start + shard_size, len(cache))
+            lengths = np.array(
+                cache.lengths[shard_start:shard_end],
+                dtype=np.int32
+            )
+            np.save(os.path.join(shard_dir, 'lengths.npy'), lengths)
+
+            # Pre-allocate memory-mapped output files.
+            logits_file = None
+            hidden_file = None
+            hidden_offsets = TeacherStore.offsets(lengths)
+            if hidden_layers:
+                hidden_file = np.lib.format.open_memmap(
+                    os.path.join(shard_dir, 'hidden.npy'),
+                    mode='w+',
+                    dtype=np.float16,
+                    shape=(
+                        int(hidden_offsets[-1]),
+                        len(hidden_layers),
+                        encoder_config.hidden_size
+                    )
+                )
+            attn_file = None
+            attn_offsets = TeacherStore.offsets(
+                len(attn_layers) *
+                encoder_config.num_attention_heads *
+                lengths.astype(np.int64) ** 2
+            )
+            if attn_layers:
+                attn_file = np.lib.format.open_memmap(
+                    os.path.join(shard_dir, 'attn.npy'),
+                    mode='w+',
+                    dtype=np.float16,
+                    shape=(int(attn_offsets[-1]),)
+                )
+
+            # Visit samples from short to long to reduce padding.
+            order = np.argsort(lengths, kind='stable')
+            for batch_start in range(0, len(order), batch_size):
+                local_indices = order[batch_start:batch_start + batch_size]
+                input_ids, attention_mask, token_type_ids = cache.get_batch(
+                    indices=(local_indices + shard_start).tolist(),
+                    seq_len=int(lengths[local_indices].max())
+                )
+
+                with fine_tune.util.amp.autocast(device=device, enabled=amp):
+                    if hidden_layers or attn_layers:
+                        logits, hiddens, attns = model(
+                            input_ids=input_ids.to(device),
+                            token_type_ids=token_type_ids.to(device),
+                            attention_mask=attention_mask.to(device),
+                            attn_layers=attn_layers,
+                            hidden_layers=hidden_layers,
+                            attn_dtype=torch.float16,
+                            attn_log_prob=True
+                        )
+                    else:
+                        logits = model(
+                            input_ids=input_ids.to(device),
+                            token_type_ids=token_type_ids.to(device),
+                            attention_mask=attention_mask.to(device)
+                        )
+
+                if logits_file is None:
+                    num_class = logits.size(-1)
+                    logits_file = np.lib.format.open_memmap(
+                        os.path.join(shard_dir, 'logits.npy'),
+                        mode='w+',
+                        dtype=np.float16,
+                        shape=(len(lengths), num_class)
+                    )
+
+                logits_file[local_indices] = (
+                    logits.to('cpu', torch.float16).numpy()
+                )
+
+                if hidden_layers:
+                    # `hidden.size == (B, S, len(hidden_layers), H)`.
+                    hidden = torch.stack(
+                        hiddens,
+                        dim=2
+                    ).to('cpu', torch.float16).numpy()
+                if attn_layers:
+                    # `attn.size == (B, len(attn_layers), A, S, S)`.
+                    attn = torch.stack(
+                        attns,
+                        dim=1
+                    ).to('cpu', torch.float16).numpy()
+
+                for row, local in enumerate(local_indices):
+                    length = lengths[local]
+                    if hidden_layers:
+                        start = hidden_offsets[local]
+                        hidden_file[start:start + length] = (
+                            hidden[row, :length]
+                        )
+                    if attn_layers:
+                        start = attn_offsets[local]
+                        end = attn_offsets[local + 1]
+                        attn_file[start:end] = (
+                            attn[row, :, :, :length, :length].reshape(-1)
+                        )
+
+                cli_logger.update(len(local_indices))
+
+            # Flush shard to disk.
+            for memmap in (logits_file, hidden_file, attn_file):
+                if memmap is not None:
+                    memmap.flush()
+            del logits_file, hidden_file, attn_file
+
+        cli_logger.close()
+
+        with open(
+                os.path.join(tmp_dir, 'meta.json'),
+                'w',
+                encoding='utf-8'
+        ) as json_file:
+            json.dump(
+                {
+                    'attn_layers': attn_layers,
+                    'checksum': cache.checksum,
+                    'fingerprint': cache.fingerprint,
+                    'hidden_layers': hidden_layers,
+                    'hidden_size': encoder_config.hidden_size,
+                    'max_seq_len': cache.max_seq_len,
+                    'num_attention_heads': encoder_config.num_attention_heads,
+                    'num_class': num_class,
+                    'num_hidden_layers': encoder_config.num_hidden_layers,
+                    'num_sample': len(cache),
+                    'num_shard': num_shard,
+                    'shard_size': shard_size,
+                    'version': TeacherStore.version,
+                },
+                json_file,
+                ensure_ascii=False
+            )
+
+        # Replace stale store if any.
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.rename(tmp_dir, store_dir)
+
+
+class _StorePairCollate:
+    r"""Gather teacher outputs and student inputs of the same samples.
+
+    Returned by `fine_tune.task.TeacherStore.create_pair_collate_fn`. Defined
+    at module level so that it can be pickled into DataLoader workers.
+
+    Args:
+        teacher_store:
+            Store built from the same dataset as `student_cache`.
+        student_cache:
+            Cache built with student tokenizer.
+        attn_layers:
+            Teacher attention layer indices to gather.
+        hidden_layers:
+            Teacher hidden state layer indices to gather.
+        padding:
+            Padding strategy. See `fine_tune.task.TokenCache.padded_len`.
+        pad_to_multiple_of:
+            See `fine_tune.task.TokenCache.padded_len`.
+    """
+
+    def __init__(
+            self,
+            teacher_store: TeacherStore,
+            student_cache: TokenCache,
+            attn_layers: Sequence[int],
+            hidden_layers: Sequence[int],
+            padding: str,
+            pad_to_multiple_of: int
+    ):
+        self.teacher_store = teacher_store
+        self.student_cache = student_cache
+        self.attn_layers = list(attn_layers)
+        self.hidden_layers = list(hidden_layers)
+        self.padding = padding
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, indices: List[int]) -> StorePairCollateFnReturn:
+        r"""Gather teacher outputs and student inputs.
+
+        Args:
+            indices:
+                Sample indices of the mini-batch.
+
+        Returns:
+            Teacher outputs, student inputs and label.
+        """
+        teacher_store = self.teacher_store
+        student_cache = self.student_cache
+
+        # Teacher and student share the same padded length.
+        if self.padding == 'max_length':
+            teacher_seq_len = teacher_store.max_seq_len
+        else:
+            teacher_seq_len = round_seq_len(
+                seq_len=int(teacher_store.lengths[indices].max()),
+                max_seq_len=teacher_store.max_seq_len,
+                pad_to_multiple_of=self.pad_to_multiple_of
+            )
+        seq_len = max(
+            teacher_seq_len,
+            student_cache.padded_len(
+                indices=indices,
+                padding=self.padding,
+                pad_to_multiple_of=self.pad_to_multiple_of
+            )
+        )
+
+        return (
+            teacher_store.get_batch(
+                indices=indices,
+                seq_len=min(seq_len, teacher_store.max_seq_len),
+                attn_layers=self.attn_layers,
+                hidden_layers=self.hidden_layers
+            ),
+            student_cache.get_batch(
+                indices=indices,
+                seq_len=min(seq_len, student_cache.max_seq_len)
+            ),
+            torch.from_numpy(
+                student_cache.label[indices].astype(np.int64)
+            ),
+        )
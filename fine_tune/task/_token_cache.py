@@ -0,0 +1,1201 @@
+r"""Pre-tokenized, memory-mapped cache of fine-tune task's dataset.
+
+Running tokenizer on raw text in every training step is wasteful since each
+sample will be tokenized again in every epoch. `fine_tune.task.TokenCache`
+encode each sample of a dataset only once and save all encoded samples as
+flat integer arrays on disk. Later runs memory-map those arrays and slice
+samples from them instead of calling tokenizer. Tokenization runs in
+`torch.utils.data.DataLoader` workers, and caches of several tokenizers (e.g.,
+teacher and student of distillation) are built in one pass over dataset.
+
+Each cache is keyed by task name, dataset name, tokenizer pretrained version
+and maximum sequence length. See `fine_tune.task.TokenCache.cache_dir` for
+cache folder layout. Each cache also records checksum of dataset source file
+and fingerprint of tokenizer (see `fine_tune.task.tokenizer_fingerprint`), and
+is rebuilt once either of them changes.
+
+Usage:
+    import torch.utils.data
+    import fine_tune
+
+    dataset = fine_tune.task.MNLI('train')
+    cache = fine_tune.task.TokenCache.load_or_build(
+        dataset=dataset,
+        dataset_name='train',
+        max_seq_len=128,
+        task='mnli',
+        tokenizer=tokenizer
+    )
+
+    data_loader = torch.utils.data.DataLoader(
+        cache,
+        collate_fn=cache.create_collate_fn(
+            padding='longest',
+            pad_to_multiple_of=8
+        )
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+# 3rd party modules
+
+import numpy as np
+import torch
+import torch.utils
+import torch.utils.data
+import transformers
+
+from tqdm import tqdm
+
+# my own modules
+
+import fine_tune.path
+
+from fine_tune.task._dataset import Dataset
+
+# Define types for type annotation.
+
+# `collate_fn` input list of sample indices and return
+# `tuple(input_ids, attention_mask, token_type_ids, label)`.
+# Each field in the returned tuple must have following numeric type:
+# - `input_ids.dtype == torch.int64`
+# - `attention_mask.dtype == torch.int64`
+# - `token_type_ids.dtype == torch.int64`
+# - `label.dtype == torch.int64`
+
+CacheCollateFnReturn = Tuple[
+    torch.LongTensor,
+    torch.LongTensor,
+    torch.LongTensor,
+    torch.LongTensor,
+]
+
+CacheCollateFn = Callable[
+    [List[int]],
+    CacheCollateFnReturn
+]
+
+# `collate_fn` used by distillation. Input list of sample indices and return
+# teacher encoding, student encoding and label.
+
+PairCollateFnReturn = Tuple[
+    Tuple[torch.LongTensor, torch.LongTensor, torch.LongTensor],
+    Tuple[torch.LongTensor, torch.LongTensor, torch.LongTensor],
+    torch.LongTensor,
+]
+
+PairCollateFn = Callable[
+    [List[int]],
+    PairCollateFnReturn
+]
+
+# Each tokenizer encode a chunk of samples into
+# `tuple(input_ids, token_type_ids, lengths)` flat arrays.
+
+EncodedChunk = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.task')
+
+# Define padding utility.
+
+
+def round_seq_len(
+        seq_len: int,
+        max_seq_len: int,
+        pad_to_multiple_of: int = 1
+) -> int:
+    r"""Round sequence length up to a multiple of `pad_to_multiple_of`.
+
+    Args:
+        seq_len:
+            Sequence length to be rounded.
+        max_seq_len:
+            Upper bound of rounded sequence length.
+        pad_to_multiple_of:
+            Rounding unit.
+
+    Returns:
+        Rounded sequence length which is no longer than `max_seq_len`.
+    """
+    seq_len = -(-seq_len // pad_to_multiple_of) * pad_to_multiple_of
+    return min(seq_len, max_seq_len)
+
+# Define tokenizer identity check.
+
+# Text used to probe tokenizer normalization, e.g., lower casing, accent
+# stripping and Chinese characters splitting.
+
+_PROBE_TEXT = 'Héllo, WORLD! Tokenizers\'re  fun: 3.14 我們 naïve-café'
+_PROBE_TEXT_PAIR = 'A second   sentence, with UPPER case and ümlauts.'
+
+
+def tokenizer_fingerprint(
+        tokenizer: transformers.PreTrainedTokenizerBase
+) -> str:
+    r"""Fingerprint of what tokenizer encodes, regardless of its backend.
+
+    Two tokenizers with the same fingerprint share vocabulary and special
+    tokens, and encode probe text into the same token ids. Thus slow and fast
+    tokenizers of the same pretrained version have the same fingerprint.
+
+    Args:
+        tokenizer:
+            Tokenizer to fingerprint.
+
+    Returns:
+        Hex digest of tokenizer's fingerprint.
+    """
+    probe = tokenizer(
+        text=_PROBE_TEXT,
+        text_pair=_PROBE_TEXT_PAIR,
+        return_attention_mask=False,
+        return_token_type_ids=True
+    )
+    digest = hashlib.sha1()
+    digest.update(json.dumps(
+        [
+            sorted(tokenizer.get_vocab().items()),
+            tokenizer.pad_token_id,
+            tokenizer.pad_token_type_id,
+            sorted(tokenizer.all_special_ids),
+            probe['input_ids'],
+            probe['token_type_ids'],
+        ],
+        ensure_ascii=False
+    ).encode('utf-8'))
+    return digest.hexdigest()
+
+# Define tokenization stage running in `torch.utils.data.DataLoader` workers.
+
+
+def _gather(
+        dataset: torch.utils.data.Dataset,
+        indices: List[int]
+) -> Tuple[List[str], Optional[List[str]], np.ndarray]:
+    r"""Gather text, text pair and label of samples.
+
+    Use vectorized `get_batch` when dataset provides it (e.g.,
+    `fine_tune.task.Dataset`), otherwise fall back to sample by sample
+    indexing (e.g., `torch.utils.data.Subset`).
+
+    Args:
+        dataset:
+            Dataset to gather from.
+        indices:
+            Sample indices.
+
+    Returns:
+        `tuple(text, text_pair, label)` of samples in `indices` order.
+    """
+    if hasattr(dataset, 'get_batch'):
+        return dataset.get_batch(indices)
+
+    samples = [dataset[index] for index in indices]
+    text_pair = None
+    if samples[0]['text_pair'] is not None:
+        text_pair = [sample['text_pair'] for sample in samples]
+    return (
+        [sample['text'] for sample in samples],
+        text_pair,
+        np.array([sample['label'] for sample in samples], dtype=np.int64),
+    )
+
+
+class _Tokenize:
+    r"""Encode a chunk of samples with one or more tokenizers.
+
+    Used as `collate_fn` of `torch.utils.data.DataLoader` iterating over sample
+    indices, so that gathering and tokenization run in DataLoader workers and
+    only flat arrays are sent back to main process. Defined at module level so
+    that it can be pickled into workers.
+
+    Args:
+        dataset:
+            Dataset to be encoded.
+        max_seq_lens:
+            Maximum input sequence length of each tokenizer.
+        tokenizers:
+            Tokenizers used to encode samples.
+    """
+
+    def __init__(
+            self,
+            dataset: torch.utils.data.Dataset,
+            max_seq_lens: Sequence[int],
+            tokenizers: Sequence[transformers.PreTrainedTokenizerBase]
+    ):
+        self.dataset = dataset
+        self.max_seq_lens = list(max_seq_lens)
+        self.tokenizers = list(tokenizers)
+
+    def __call__(
+            self,
+            indices: List[int]
+    ) -> Tuple[List[EncodedChunk], np.ndarray]:
+        r"""Encode samples with every tokenizer.
+
+        Args:
+            indices:
+                Sample indices of a chunk.
+
+        Returns:
+            Encoded chunk of each tokenizer and label of each sample.
+        """
+        text, text_pair, label = _gather(
+            dataset=self.dataset,
+            indices=indices
+        )
+
+        encodings = []
+        for max_seq_len, tokenizer in zip(self.max_seq_lens, self.tokenizers):
+            batch_encode = tokenizer(
+                text=text,
+                text_pair=text_pair,
+                max_length=max_seq_len,
+                return_attention_mask=False,
+                return_token_type_ids=True,
+                truncation=True
+            )
+            lengths = np.fromiter(
+                map(len, batch_encode['input_ids']),
+                dtype=np.int32,
+                count=len(indices)
+            )
+            num_token = int(lengths.sum())
+            encodings.append((
+                np.fromiter(
+                    itertools.chain.from_iterable(batch_encode['input_ids']),
+                    dtype=np.int32,
+                    count=num_token
+                ),
+                np.fromiter(
+                    itertools.chain.from_iterable(
+                        batch_encode['token_type_ids']
+                    ),
+                    dtype=np.int8,
+                    count=num_token
+                ),
+                lengths,
+            ))
+
+        return encodings, label.astype(np.int64)
+
+# Define bulk encoding.
+
+
+def encode_dataset(
+        dataset: Dataset,
+        max_seq_len: int,
+        tokenizer: transformers.PreTrainedTokenizerBase,
+        batch_size: int = 1000,
+        num_workers: int = 0
+) -> Tuple[EncodedChunk, np.ndarray]:
+    r"""Tokenize all samples in `dataset` in batches.
+
+    Args:
+        dataset:
+            Task specific dataset.
+        max_seq_len:
+            Maximum input sequence length. Longer samples are truncated.
+        tokenizer:
+            Tokenizer used to encode `dataset`. Fast tokenizer encodes each
+            batch with multiple threads.
+        batch_size:
+            Number of samples to tokenize at once.
+        num_workers:
+            Number of `torch.utils.data.DataLoader` worker processes running
+            tokenizer. Set to `0` to tokenize in main process.
+
+    Returns:
+        Flat arrays `tuple(input_ids, token_type_ids, lengths)` of all
+        samples in dataset order, and label of each sample.
+    """
+    encodings, label = encode_dataset_many(
+        dataset=dataset,
+        max_seq_lens=[max_seq_len],
+        tokenizers=[tokenizer],
+        batch_size=batch_size,
+        num_workers=num_workers
+    )
+    return encodings[0], label
+
+
+def encode_dataset_many(
+        dataset: Dataset,
+        max_seq_lens: Sequence[int],
+        tokenizers: Sequence[transformers.PreTrainedTokenizerBase],
+        batch_size: int = 1000,
+        num_workers: int = 0
+) -> Tuple[List[EncodedChunk], np.ndarray]:
+    r"""Tokenize all samples in `dataset` with each tokenizer in one pass.
+
+    Each batch of samples is read once and encoded by every tokenizer in the
+    same `torch.utils.data.DataLoader` worker. Batches are spread over
+    workers, thus tokenization runs on multiple cores.
+
+    Args:
+        dataset:
+            Task specific dataset.
+        max_seq_lens:
+            Maximum input sequence length of each tokenizer. Longer samples
+            are truncated.
+        tokenizers:
+            Tokenizers used to encode `dataset`.
+        batch_size:
+            Number of samples to tokenize at once.
+        num_workers:
+            Number of `torch.utils.data.DataLoader` worker processes running
+            tokenizers. Set to `0` to tokenize in main process.
+
+    Raises:
+        ValueError:
+            When `max_seq_lens` and `tokenizers` have different length.
+
+    Returns:
+        Flat arrays `tuple(input_ids, token_type_ids, lengths)` of each
+        tokenizer in dataset order, and label of each sample.
+    """
+    if len(max_seq_lens) != len(tokenizers):
+        raise ValueError(
+            '`max_seq_lens` and `tokenizers` must have the same length.'
+        )
+
+    data_loader = torch.utils.data.DataLoader(
+        range(len(dataset)),
+        batch_size=batch_size,
+        collate_fn=_Tokenize(
+            dataset=dataset,
+            max_seq_lens=max_seq_lens,
+            tokenizers=tokenizers
+        ),
+        num_workers=num_workers,
+        shuffle=False
+    )
+
+    all_chunks = [[] for _ in tokenizers]
+    all_label = []
+    for encodings, label in tqdm(
+            data_loader,
+            desc='Tokenizing',
+            total=len(data_loader)
+    ):
+        for chunks, encoding in zip(all_chunks, encodings):
+            chunks.append(encoding)
+        all_label.append(label)
+
+    encodings = []
+    for chunks in all_chunks:
+        if not chunks:
+            encodings.append((
+                np.zeros(0, dtype=np.int32),
+                np.zeros(0, dtype=np.int8),
+                np.zeros(0, dtype=np.int32),
+            ))
+            continue
+        encodings.append((
+            np.concatenate([chunk[0] for chunk in chunks]),
+            np.concatenate([chunk[1] for chunk in chunks]),
+            np.concatenate([chunk[2] for chunk in chunks]),
+        ))
+
+    return (
+        encodings,
+        np.concatenate(all_label) if all_label
+        else np.zeros(0, dtype=np.int64),
+    )
+
+# Define tokenized dataset cache.
+
+
+class TokenCache(torch.utils.data.Dataset):
+    r"""Pre-tokenized, memory-mapped cache of fine-tune task's dataset.
+
+    All samples are stored as flat arrays. Tokens of the `i`-th sample are
+    `input_ids[offsets[i]:offsets[i + 1]]` and so as `token_type_ids`. Since
+    arrays are memory-mapped, a cache is cheap to construct and cheap to
+    share with `torch.utils.data.DataLoader` workers.
+
+    `fine_tune.task.TokenCache` is itself a `torch.utils.data.Dataset` which
+    return sample index. Samples are gathered into tensors by `collate_fn`
+    created with `fine_tune.task.TokenCache.create_collate_fn`.
+
+    Args:
+        cache_dir:
+            Folder which contains cache files built by
+            `fine_tune.task.TokenCache.build`.
+
+    Attributes:
+        cache_dir:
+            Folder which contains cache files.
+        checksum:
+            Hex SHA-1 checksum of dataset source file when building cache.
+            Empty string if unknown.
+        fingerprint:
+            Fingerprint of tokenizer used to build cache.
+        input_ids:
+            Flat token ids of all samples with numeric type `numpy.int32`.
+        label:
+            Label of each sample with numeric type `numpy.int64`.
+        lengths:
+            Number of tokens of each sample with numeric type `numpy.int32`.
+        max_seq_len:
+            Maximum sequence length used when building cache. Samples longer
+            than `max_seq_len` were truncated.
+        offsets:
+            Start position of each sample in flat arrays with numeric type
+            `numpy.int64`. `offsets` has one more element than `lengths`.
+        pad_token_id:
+            Token id used to pad `input_ids`.
+        pad_token_type_id:
+            Token type id used to pad `token_type_ids`.
+        token_type_ids:
+            Flat token type ids of all samples with numeric type `numpy.int8`.
+        version:
+            Cache format version. Cache built with different version will be
+            rebuilt.
+
+    Raises:
+        FileNotFoundError:
+            When cache files does not exist.
+        ValueError:
+            When cache version does not match.
+    """
+    version: int = 2
+
+    def __init__(self, cache_dir: str):
+        with open(
+                os.path.join(cache_dir, 'meta.json'),
+                'r',
+                encoding='utf-8'
+        ) as json_file:
+            meta = json.load(json_file)
+
+        if meta['version'] != TokenCache.version:
+            raise ValueError(
+                f'Cache version {meta["version"]} in {cache_dir} does not ' +
+                f'match current version {TokenCache.version}.'
+            )
+
+        self.cache_dir = cache_dir
+        self.checksum = meta['checksum']
+        self.fingerprint = meta['fingerprint']
+        self.max_seq_len = meta['max_seq_len']
+        self.pad_token_id = meta['pad_token_id']
+        self.pad_token_type_id = meta['pad_token_type_id']
+
+        # Memory-map all flat arrays.
+        self.input_ids = np.load(
+            os.path.join(cache_dir, 'input_ids.npy'),
+            mmap_mode='r'
+        )
+        self.token_type_ids = np.load(
+            os.path.join(cache_dir, 'token_type_ids.npy'),
+            mmap_mode='r'
+        )
+        self.lengths = np.load(
+            os.path.join(cache_dir, 'lengths.npy'),
+            mmap_mode='r'
+        )
+        self.label = np.load(
+            os.path.join(cache_dir, 'label.npy'),
+            mmap_mode='r'
+        )
+
+        # Start position of each sample.
+        self.offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=self.offsets[1:])
+
+    def __reduce__(self) -> Tuple[type, Tuple[str]]:
+        r"""Pickle cache by its folder instead of array contents.
+
+        Memory-mapped arrays would be copied into pickle otherwise. Unpickled
+        cache maps the same files again, so processes share cached tokens
+        through OS page cache.
+
+        Returns:
+            Class and arguments to reconstruct cache.
+        """
+        return (self.__class__, (self.cache_dir,))
+
+    def __getitem__(self, index: int) -> int:
+        r"""Return sample index.
+
+        Actual token ids are gathered in `collate_fn` so that a mini-batch is
+        sliced from memory-mapped arrays in one go.
+
+        Args:
+            index:
+                Sample index of dataset.
+
+        Raises:
+            IndexError:
+                `index` out of range.
+
+        Returns:
+            Same as `index`.
+        """
+        if not -len(self) <= index < len(self):
+            raise IndexError(
+                f'Sample index {index} out of range.'
+            )
+        return index % len(self)
+
+    def __len__(self) -> int:
+        r"""Return dataset size.
+
+        Returns:
+            Number of cached samples.
+        """
+        return len(self.lengths)
+
+    def get_batch(
+            self,
+            indices: List[int],
+            seq_len: int
+    ) -> Tuple[torch.LongTensor, torch.LongTensor, torch.LongTensor]:
+        r"""Gather samples into right padded tensors.
+
+        We use the following notation for the rest of the context.
+            - B: batch size.
+            - S: sequence length.
+
+        Args:
+            indices:
+                Sample indices of the mini-batch.
+            seq_len:
+                Padded sequence length. `seq_len` must be bigger than or equal
+                to the longest sample in `indices`.
+
+        Returns:
+            Three `torch.Tensor` with numeric type `torch.int64` and size
+            (B, S): `input_ids`, `attention_mask` and `token_type_ids`.
+        """
+        input_ids = np.full(
+            (len(indices), seq_len),
+            self.pad_token_id,
+            dtype=np.int64
+        )
+        attention_mask = np.zeros((len(indices), seq_len), dtype=np.int64)
+        token_type_ids = np.full(
+            (len(indices), seq_len),
+            self.pad_token_type_id,
+            dtype=np.int64
+        )
+
+        for row, index in enumerate(indices):
+            start = self.offsets[index]
+            length = self.lengths[index]
+            input_ids[row, :length] = self.input_ids[start:start + length]
+            token_type_ids[row, :length] = (
+                self.token_type_ids[start:start + length]
+            )
+            attention_mask[row, :length] = 1
+
+        return (
+            torch.from_numpy(input_ids),
+            torch.from_numpy(attention_mask),
+            torch.from_numpy(token_type_ids),
+        )
+
+    def padded_len(
+            self,
+            indices: List[int],
+            padding: str = 'longest',
+            pad_to_multiple_of: int = 1
+    ) -> int:
+        r"""Get padded sequence length of a mini-batch.
+
+        Args:
+            indices:
+                Sample indices of the mini-batch.
+            padding:
+                Padding strategy. `'longest'` pad to the longest sample in
+                `indices`, `'max_length'` pad to `self.max_seq_len`.
+            pad_to_multiple_of:
+                Round `'longest'` padded length up to a multiple of
+                `pad_to_multiple_of`. Rounded length never exceed
+                `self.max_seq_len`.
+
+        Returns:
+            Padded sequence length.
+        """
+        if padding == 'max_length':
+            return self.max_seq_len
+
+        return round_seq_len(
+            seq_len=int(self.lengths[indices].max()),
+            max_seq_len=self.max_seq_len,
+            pad_to_multiple_of=pad_to_multiple_of
+        )
+
+    def create_collate_fn(
+            self,
+            padding: str = 'longest',
+            pad_to_multiple_of: int = 1
+    ) -> CacheCollateFn:
+        r"""Create `collate_fn` used by `torch.utils.data.Dataloader`.
+
+        Args:
+            padding:
+                Padding strategy. See `fine_tune.task.TokenCache.padded_len`.
+            pad_to_multiple_of:
+                See `fine_tune.task.TokenCache.padded_len`.
+
+        Returns:
+            `collate_fn` function used by `torch.utils.data.Dataloader`.
+        """
+        return _CacheCollate(
+            cache=self,
+            padding=padding,
+            pad_to_multiple_of=pad_to_multiple_of
+        )
+
+    @staticmethod
+    def create_pair_collate_fn(
+            teacher_cache: 'TokenCache',
+            student_cache: 'TokenCache',
+            padding: str = 'longest',
+            pad_to_multiple_of: int = 1
+    ) -> PairCollateFn:
+        r"""Create `collate_fn` which gather both teacher and student inputs.
+
+        Both caches must be built from the same dataset so that sample
+        indices refer to the same samples. When teacher and student share the
+        same cache object, each mini-batch is gathered once and used as both
+        teacher and student inputs. When `padding == 'longest'`,
+        teacher and student inputs are padded to the same length (the longest
+        one among both encodings) so that per-token hidden states and
+        attentions of teacher and student are aligned. The padded length is
+        still bounded by `max_seq_len` of each cache.
+
+        Args:
+            teacher_cache:
+                Cache built with teacher tokenizer.
+            student_cache:
+                Cache built with student tokenizer.
+            padding:
+                Padding strategy. See `fine_tune.task.TokenCache.padded_len`.
+            pad_to_multiple_of:
+                See `fine_tune.task.TokenCache.padded_len`.
+
+        Raises:
+            ValueError:
+                When two caches have different size.
+
+        Returns:
+            `collate_fn` function used by `torch.utils.data.Dataloader`.
+        """
+        if len(teacher_cache) != len(student_cache):
+            raise ValueError(
+                'Teacher and student caches must have the same size.'
+            )
+
+        return _PairCollate(
+            teacher_cache=teacher_cache,
+            student_cache=student_cache,
+            padding=padding,
+            pad_to_multiple_of=pad_to_multiple_of
+        )
+
+    @staticmethod
+    def cache_dir(
+            dataset: str,
+            max_seq_len: int,
+            task: str,
+            tokenizer_name: str
+    ) -> str:
+        r"""Get cache folder path.
+
+        Cache folder layout is
+        'FINE_TUNE_CACHE/task/dataset/tokenizer_name-max_seq_len'.
+
+        Args:
+            dataset:
+                Name of the dataset.
+            max_seq_len:
+                Maximum input sequence length.
+            task:
+                Name of the fine-tune task.
+            tokenizer_name:
+                Pretrained version of tokenizer.
+
+        Returns:
+            Cache folder path.
+        """
+        # Pretrained version might be a local path.
+        tokenizer_name = tokenizer_name.strip(os.sep).replace(os.sep, '_')
+        return os.path.join(
+            fine_tune.path.FINE_TUNE_CACHE,
+            task,
+            dataset,
+            f'{tokenizer_name}-{max_seq_len}'
+        )
+
+    @staticmethod
+    def build(
+            cache_dir: str,
+            dataset: Dataset,
+            max_seq_len: int,
+            tokenizer: transformers.PreTrainedTokenizerBase,
+            batch_size: int = 1000,
+            num_workers: int = 0
+    ) -> None:
+        r"""Tokenize all samples in `dataset` and save into `cache_dir`.
+
+        Cache files are first written into a temporary folder and then
+        renamed to `cache_dir`, thus a interrupted build will never leave a
+        broken cache.
+
+        Args:
+            cache_dir:
+                Folder to save cache files.
+            dataset:
+                Task specific dataset.
+            max_seq_len:
+                Maximum input sequence length. Longer samples are truncated.
+            tokenizer:
+                Tokenizer used to encode `dataset`.
+            batch_size:
+                Number of samples to tokenize at once.
+            num_workers:
+                Number of `torch.utils.data.DataLoader` worker processes
+                running tokenizer. Set to `0` to tokenize in main process.
+        """
+        TokenCache.build_many(
+            cache_dirs=[cache_dir],
+            dataset=dataset,
+            max_seq_lens=[max_seq_len],
+            tokenizers=[tokenizer],
+            batch_size=batch_size,
+            num_workers=num_workers
+        )
+
+    @staticmethod
+    def build_many(
+            cache_dirs: Sequence[str],
+            dataset: Dataset,
+            max_seq_lens: Sequence[int],
+            tokenizers: Sequence[transformers.PreTrainedTokenizerBase],
+            batch_size: int = 1000,
+            num_workers: int = 0
+    ) -> None:
+        r"""Tokenize all samples in `dataset` with each tokenizer in one pass.
+
+        Each chunk of `batch_size` samples is read once and encoded by every
+        tokenizer in the same `torch.utils.data.DataLoader` worker, thus
+        teacher and student caches used by distillation are built together.
+        The `i`-th cache is saved into `cache_dirs[i]`.
+
+        Args:
+            cache_dirs:
+                Folder to save cache files of each tokenizer.
+            dataset:
+                Task specific dataset.
+            max_seq_lens:
+                Maximum input sequence length of each tokenizer. Longer
+                samples are truncated.
+            tokenizers:
+                Tokenizers used to encode `dataset`.
+            batch_size:
+                Number of samples to tokenize at once.
+            num_workers:
+                Number of `torch.utils.data.DataLoader` worker processes
+                running tokenizers. Set to `0` to tokenize in main process.
+
+        Raises:
+            ValueError:
+                When `cache_dirs`, `max_seq_lens` and `tokenizers` have
+                different length.
+        """
+        if len(cache_dirs) != len(tokenizers):
+            raise ValueError(
+                '`cache_dirs`, `max_seq_lens` and `tokenizers` must have ' +
+                'the same length.'
+            )
+
+        encodings, label = encode_dataset_many(
+            dataset=dataset,
+            max_seq_lens=max_seq_lens,
+            tokenizers=tokenizers,
+            batch_size=batch_size,
+            num_workers=num_workers
+        )
+
+        for cache_dir, max_seq_len, tokenizer, encoding in zip(
+                cache_dirs,
+                max_seq_lens,
+                tokenizers,
+                encodings
+        ):
+            TokenCache.save(
+                cache_dir=cache_dir,
+                encoding=encoding,
+                label=label,
+                max_seq_len=max_seq_len,
+                tokenizer=tokenizer,
+                checksum=dataset.checksum
+            )
+
+    @staticmethod
+    def save(
+            cache_dir: str,
+            encoding: EncodedChunk,
+            label: np.ndarray,
+            max_seq_len: int,
+            tokenizer: transformers.PreTrainedTokenizerBase,
+            checksum: str = ''
+    ) -> None:
+        r"""Save encoded dataset into `cache_dir`.
+
+        Args:
+            cache_dir:
+                Folder to save cache files.
+            encoding:
+                Flat arrays `tuple(input_ids, token_type_ids, lengths)` of
+                all samples, in dataset order. See
+                `fine_tune.task.encode_dataset`.
+            label:
+                Label of each sample.
+            max_seq_len:
+                Maximum input sequence length used when encoding.
+            tokenizer:
+                Tokenizer used when encoding.
+            checksum:
+                Hex SHA-1 checksum of dataset source file.
+        """
+        # Write into temporary folder first.
+        tmp_dir = f'{cache_dir}.tmp-{os.getpid()}'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        input_ids, token_type_ids, lengths = encoding
+        np.save(os.path.join(tmp_dir, 'input_ids.npy'), input_ids)
+        np.save(os.path.join(tmp_dir, 'token_type_ids.npy'), token_type_ids)
+        np.save(os.path.join(tmp_dir, 'lengths.npy'), lengths)
+        np.save(os.path.join(tmp_dir, 'label.npy'), label)
+
+        with open(
+                os.path.join(tmp_dir, 'meta.json'),
+                'w',
+                encoding='utf-8'
+        ) as json_file:
+            json.dump(
+                {
+                    'checksum': checksum,
+                    'fingerprint': tokenizer_fingerprint(tokenizer),
+                    'max_seq_len': max_seq_len,
+                    'num_sample': len(label),
+                    'pad_token_id': tokenizer.pad_token_id,
+                    'pad_token_type_id': tokenizer.pad_token_type_id,
+                    'tokenizer': tokenizer.name_or_path,
+                    'version': TokenCache.version,
+                },
+                json_file,
+                ensure_ascii=False
+            )
+
+        # Replace stale cache if any.
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.rename(tmp_dir, cache_dir)
+
+    @classmethod
+    def load_or_build(
+            cls,
+            dataset: Dataset,
+            dataset_name: str,
+            max_seq_len: int,
+            task: str,
+            tokenizer: transformers.PreTrainedTokenizerBase,
+            num_workers: int = 0
+    ) -> 'TokenCache':
+        r"""Load cache from disk, build it first if not exists.
+
+        Args:
+            dataset:
+                Task specific dataset.
+            dataset_name:
+                Name of `dataset`.
+            max_seq_len:
+                Maximum input sequence length.
+            task:
+                Name of the fine-tune task.
+            tokenizer:
+                Tokenizer used to encode `dataset`.
+            num_workers:
+                Number of `torch.utils.data.DataLoader` worker processes
+                running tokenizer when building cache.
+
+        Returns:
+            Memory-mapped tokenized dataset cache.
+        """
+        return cls.load_or_build_many(
+            dataset=dataset,
+            dataset_name=dataset_name,
+            max_seq_lens=[max_seq_len],
+            task=task,
+            tokenizers=[tokenizer],
+            num_workers=num_workers
+        )[0]
+
+    @classmethod
+    def load_or_build_many(
+            cls,
+            dataset: Dataset,
+            dataset_name: str,
+            max_seq_lens: Sequence[int],
+            task: str,
+            tokenizers: Sequence[transformers.PreTrainedTokenizerBase],
+            num_workers: int = 0
+    ) -> List['TokenCache']:
+        r"""Load caches of each tokenizer, build missing ones in one pass.
+
+        Identical tokenizers (see `fine_tune.task.tokenizer_fingerprint`) with
+        the same `max_seq_len` encode `dataset` only once and share the same
+        cache object, which is the cache of the first such tokenizer. Cache is
+        rebuilt when number of samples, checksum of dataset source file or
+        tokenizer fingerprint does not match.
+
+        Args:
+            dataset:
+                Task specific dataset.
+            dataset_name:
+                Name of `dataset`.
+            max_seq_lens:
+                Maximum input sequence length of each tokenizer.
+            task:
+                Name of the fine-tune task.
+            tokenizers:
+                Tokenizers used to encode `dataset`.
+            num_workers:
+                Number of `torch.utils.data.DataLoader` worker processes
+                running tokenizers when building caches.
+
+        Returns:
+            Memory-mapped tokenized dataset cache of each tokenizer.
+        """
+        # Map identical tokenizers to the cache folder of the first one.
+        cache_dirs = []
+        fingerprints = []
+        shared_dirs = {}
+        for max_seq_len, tokenizer in zip(max_seq_lens, tokenizers):
+            fingerprints.append(tokenizer_fingerprint(tokenizer))
+            key = (max_seq_len, fingerprints[-1])
+            if key in shared_dirs:
+                logger.info(
+                    'Tokenizer %s is identical to an earlier tokenizer, ' +
+                    'share token cache %s.',
+                    tokenizer.name_or_path,
+                    shared_dirs[key]
+                )
+            else:
+                shared_dirs[key] = cls.cache_dir(
+                    dataset=dataset_name,
+                    max_seq_len=max_seq_len,
+                    task=task,
+                    tokenizer_name=tokenizer.name_or_path
+                )
+            cache_dirs.append(shared_dirs[key])
+
+        # Caches to be built. Same cache folder is only visited once.
+        build_args = {}
+        visited = set()
+        for cache_dir, max_seq_len, tokenizer, fingerprint in zip(
+                cache_dirs,
+                max_seq_lens,
+                tokenizers,
+                fingerprints
+        ):
+            if cache_dir in visited:
+                continue
+            visited.add(cache_dir)
+            try:
+                cache = cls(cache_dir)
+                if (
+                        len(cache) == len(dataset) and
+                        cache.checksum == dataset.checksum and
+                        cache.fingerprint == fingerprint
+                ):
+                    logger.info('Load token cache %s.', cache_dir)
+                    continue
+                logger.info('Token cache %s is stale.', cache_dir)
+            except (FileNotFoundError, KeyError, ValueError):
+                logger.info('Token cache %s not found.', cache_dir)
+            build_args[cache_dir] = (max_seq_len, tokenizer)
+
+        if build_args:
+            logger.info(
+                'Start building token cache %s.',
+                ', '.join(build_args)
+            )
+            cls.build_many(
+                cache_dirs=list(build_args),
+                dataset=dataset,
+                max_seq_lens=[args[0] for args in build_args.values()],
+                tokenizers=[args[1] for args in build_args.values()],
+                num_workers=num_workers
+            )
+            logger.info(
+                'Finish building token cache %s.',
+                ', '.join(build_args)
+            )
+
+        caches = {cache_dir: cls(cache_dir) for cache_dir in visited}
+        return [caches[cache_dir] for cache_dir in cache_dirs]
+
+
+class _CacheCollate:
+    r"""Gather mini-batch from `fine_tune.task.TokenCache`.
+
+    Returned by `fine_tune.task.TokenCache.create_collate_fn`. Defined at
+    module level so that it can be pickled into DataLoader workers.
+
+    Args:
+        cache:
+            Cache to gather samples from.
+        padding:
+            Padding strategy. See `fine_tune.task.TokenCache.padded_len`.
+        pad_to_multiple_of:
+            See `fine_tune.task.TokenCache.padded_len`.
+    """
+
+    def __init__(
+            self,
+            cache: TokenCache,
+            padding: str,
+            pad_to_multiple_of: int
+    ):
+        self.cache = cache
+        self.padding = padding
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, indices: List[int]) -> CacheCollateFnReturn:
+        r"""Gather samples into right padded tensors.
+
+        Args:
+            indices:
+                Sample indices of the mini-batch.
+
+        Returns:
+            `input_ids`, `attention_mask`, `token_type_ids` and label.
+        """
+        input_ids, attention_mask, token_type_ids = self.cache.get_batch(
+            indices=indices,
+            seq_len=self.cache.padded_len(
+                indices=indices,
+                padding=self.padding,
+                pad_to_multiple_of=self.pad_to_multiple_of
+            )
+        )
+        return (
+            input_ids,
+            attention_mask,
+            token_type_ids,
+            torch.from_numpy(self.cache.label[indices].astype(np.int64)),
+        )
+
+
+class _PairCollate:
+    r"""Gather teacher and student mini-batches from two token caches.
+
+    Returned by `fine_tune.task.TokenCache.create_pair_collate_fn`. Defined at
+    module level so that it can be pickled into DataLoader workers.
+
+    Args:
+        teacher_cache:
+            Cache built with teacher tokenizer.
+        student_cache:
+            Cache built with student tokenizer.
+        padding:
+            Padding strategy. See `fine_tune.task.TokenCache.padded_len`.
+        pad_to_multiple_of:
+            See `fine_tune.task.TokenCache.padded_len`.
+    """
+
+    def __init__(
+            self,
+            teacher_cache: TokenCache,
+            student_cache: TokenCache,
+            padding: str,
+            pad_to_multiple_of: int
+    ):
+        self.teacher_cache = teacher_cache
+        self.student_cache = student_cache
+        self.padding = padding
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, indices: List[int]) -> PairCollateFnReturn:
+        r"""Gather teacher and student inputs of the same samples.
+
+        Args:
+            indices:
+                Sample indices of the mini-batch.
+
+        Returns:
+            Teacher inputs, student inputs and label.
+        """
+        teacher_cache = self.teacher_cache
+        student_cache = self.student_cache
+        label = torch.from_numpy(
+            teacher_cache.label[indices].astype(np.int64)
+        )
+
+        # Teacher and student share the same encoding.
+        if teacher_cache is student_cache:
+            encoding = teacher_cache.get_batch(
+                indices=indices,
+                seq_len=teacher_cache.padded_len(
+                    indices=indices,
+                    padding=self.padding,
+                    pad_to_multiple_of=self.pad_to_multiple_of
+                )
+            )
+            return encoding, encoding, label
+
+        # Teacher and student share the same padded length.
+        seq_len = max(
+            teacher_cache.padded_len(
+                indices=indices,
+                padding=self.padding,
+                pad_to_multiple_of=self.pad_to_multiple_of
+            ),
+            student_cache.padded_len(
+                indices=indices,
+                padding=self.padding,
+                pad_to_multiple_of=self.pad_to_multiple_of
+            )
+        )
+
+        return (
+            teacher_cache.get_batch(
+                indices=indices,
+                seq_len=min(seq_len, teacher_cache.max_seq_len)
+            ),
+            student_cache.get_batch(
+                indices=indices,
+                seq_len=min(seq_len, student_cache.max_seq_len)
+            ),
+            label,
+        )
@@ -21,9 +21,16 @@ from __future__ import unicode_literals
 # my own modules
 
 from fine_tune.util.check_device import check_device
+from fine_tune.util.checkpoint import CheckpointWriter
+from fine_tune.util.checkpoint import load_checkpoint
+from fine_tune.util.dataloader import load_dataloader
+from fine_tune.util.dataloader import load_dataloader_by_config
 from fine_tune.util.amp_distill_mgpu import amp_distill_mgpu
+from fine_tune.util.ddp_distill import ddp_distill
+from fine_tune.util.ddp_distill import launch_ddp_distill
 from fine_tune.util.evaluation import evaluation
 from fine_tune.util.amp_evaluation import amp_evaluation
+from fine_tune.util.parallel_evaluation import parallel_evaluation
 from fine_tune.util.amp_gen_logits import amp_gen_logits
 from fine_tune.util.task import load_dataset
 from fine_tune.util.task import load_dataset_by_config
@@ -39,7 +46,19 @@ from fine_tune.util.tokenizer import load_student_tokenizer
 from fine_tune.util.tokenizer import load_student_tokenizer_by_config
 from fine_tune.util.tokenizer import load_teacher_tokenizer
 from fine_tune.util.tokenizer import load_teacher_tokenizer_by_config
+from fine_tune.util.token_cache import load_token_cache
+from fine_tune.util.token_cache import load_token_cache_by_config
+from fine_tune.util.token_cache import load_pair_token_cache
+from fine_tune.util.token_cache import load_pair_token_cache_by_config
+from fine_tune.util.pipeline import prefetch
+from fine_tune.util.teacher_store import distill_layers
+from fine_tune.util.teacher_store import dump_teacher_store
+from fine_tune.util.teacher_store import dump_teacher_store_by_config
+from fine_tune.util.teacher_store import load_teacher_store
+from fine_tune.util.teacher_store import load_teacher_store_by_config
 from fine_tune.util.train import train
+from fine_tune.util.ddp_train import ddp_train
+from fine_tune.util.ddp_train import launch_ddp_train
 from fine_tune.util.amp_train import amp_train
 from fine_tune.util.scheduler import load_scheduler
 from fine_tune.util.scheduler import load_scheduler_by_config
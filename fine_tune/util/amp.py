@@ -0,0 +1,91 @@
+r"""Helper functions for device-agnostic automatic mixed precision.
+
+On CUDA device we use `torch.float16` autocast with a gradient scaler. On CPU
+we use `torch.bfloat16` autocast only when CPU has native bfloat16 support,
+and gradient scaler is a no-op since bfloat16 has the same exponent range as
+`torch.float32`.
+
+Usage:
+    import fine_tune
+
+    scaler = fine_tune.util.amp.grad_scaler(device=device)
+    with fine_tune.util.amp.autocast(device=device):
+        loss = ...
+    scaler.scale(loss).backward()
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# 3rd party modules
+
+import torch
+
+
+def cpu_bf16_supported() -> bool:
+    r"""Check whether CPU has native bfloat16 support.
+
+    Without native support bfloat16 is emulated and runs slower than
+    `torch.float32`.
+
+    Returns:
+        `True` if oneDNN reports bfloat16 support.
+    """
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def autocast(device: torch.device, enabled: bool = True) -> torch.autocast:
+    r"""Create autocast context manager for `device`.
+
+    Args:
+        device:
+            Model running device.
+        enabled:
+            Enable autocast. Autocast on CPU is further disabled when CPU
+            has no native bfloat16 support.
+
+    Returns:
+        `torch.autocast` context manager with `torch.float16` on CUDA device
+        and `torch.bfloat16` on CPU.
+    """
+    if device.type == 'cuda':
+        return torch.autocast(
+            device_type='cuda',
+            dtype=torch.float16,
+            enabled=enabled
+        )
+    return torch.autocast(
+        device_type='cpu',
+        dtype=torch.bfloat16,
+        enabled=enabled and cpu_bf16_supported()
+    )
+
+
+def grad_scaler(
+        device: torch.device,
+        enabled: bool = True
+) -> torch.amp.GradScaler:
+    r"""Create gradient scaler for `device`.
+
+    Args:
+        device:
+            Model running device.
+        enabled:
+            Enable gradient scaling. Always disabled on CPU.
+
+    Returns:
+        Gradient scaler. Disabled scaler is a no-op: `scale` returns loss
+        unchanged, `unscale_` and `update` do nothing and `step` calls
+        `optimizer.step` directly.
+    """
+    return torch.amp.GradScaler(
+        device.type,
+        enabled=enabled and device.type == 'cuda'
+    )
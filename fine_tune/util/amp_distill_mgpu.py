@@ -1,6 +1,9 @@
 #TODO: replace `amp_distill` with this file.
 r"""Helper functions for knowledge distillation with automatic mixed precision.
-Note: This functions use 2 GPU device to perform distillation.
+Teacher and student can run on different GPUs, the same GPU or CPU. On CPU
+automatic mixed precision uses `torch.bfloat16`, see `fine_tune.util.amp`.
+Teacher outputs can be read from `fine_tune.task.TeacherStore` instead, in
+which case teacher model is not needed.
 Usage:
     import fine_tune
 
@@ -14,10 +17,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import logging
 import os
 
 # 3rd party modules
 
+import numpy as np
 import torch
 import torch.utils
 import torch.utils.data
@@ -31,7 +36,18 @@ from tqdm import tqdm
 import fine_tune.config
 import fine_tune.task
 import fine_tune.model
+import fine_tune.objective
 import fine_tune.path
+import fine_tune.util.amp
+import fine_tune.util.checkpoint
+import fine_tune.util.dataloader
+import fine_tune.util.pipeline
+import fine_tune.util.teacher_store
+import fine_tune.util.token_cache
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
 
 
 def amp_distill_mgpu(
@@ -42,16 +58,19 @@ def amp_distill_mgpu(
         student_model: fine_tune.model.StudentModel,
         optimizer: torch.optim.AdamW,
         scheduler: torch.optim.lr_scheduler.LambdaLR,
-        teacher_tokenizer: transformers.PreTrainedTokenizer,
-        student_tokenizer: transformers.PreTrainedTokenizer,
+        teacher_tokenizer: transformers.PreTrainedTokenizerBase,
+        student_tokenizer: transformers.PreTrainedTokenizerBase,
         use_logits_loss: bool = True,
         use_hidden_loss: bool = True,
-        use_attn_loss: bool = True
+        use_attn_loss: bool = True,
+        teacher_store: fine_tune.task.TeacherStore = None,
+        pipeline_depth: int = 0,
+        resume: bool = False
 ):
     r"""Perform knowledge distillation from given fine-tuned teacher model
     with automatic mixed precision.
-    Note: This function will use two gpu-device,
-    you should check it with `fine_tune.util.check_device` before calling this function.
+    Note: Teacher and student devices should be checked with
+    `fine_tune.util.check_device` before calling this function.
 
     Args:
         teacher_config:
@@ -65,6 +84,7 @@ def amp_distill_mgpu(
         teacher_model:
             A fine-tuned teacher model which is used to
             generate soft targets, hidden states and attentions.
+            Can be `None` when `teacher_store` is given.
         student_model:
             Model which will perform disitllation according to
             outputs from given teacher model.
@@ -76,20 +96,38 @@ def amp_distill_mgpu(
             Tokenizer paired with `teacher_model`.
         student_tokenizer:
             Tokenizer paired with `student_model`.
+        teacher_store:
+            Offline teacher outputs dumped by
+            `fine_tune.util.dump_teacher_store`. When given, teacher outputs
+            are read from store by sample index and `teacher_model` is not
+            used.
+        pipeline_depth:
+            Number of mini-batches prepared ahead by a background thread,
+            which tokenizes inputs, runs teacher forward pass and moves
+            teacher outputs to student device while student is training.
+            Set to `0` to run teacher and student one after the other.
+        resume:
+            Continue distillation from the latest checkpoint in student
+            experiment folder, including random states and sampler position.
+            Distillation starts from scratch if there is no checkpoint.
     """
-    # Create a GradScalaer.
-    scaler = torch.cuda.amp.GradScaler()
+    # Model running device of teacher and student model.
+    teacher_device = teacher_config.device
+    student_device = student_config.device
+
+    # Create a GradScalaer. It is a no-op on CPU.
+    scaler = fine_tune.util.amp.grad_scaler(
+        device=student_device,
+        enabled=student_config.amp
+    )
 
     # Set teacher model as evaluation mode.
-    teahcer_model.eval()
+    if teacher_store is None:
+        teahcer_model.eval()
 
     # Set student model as training mode.
     student_model.train()
 
-    # Model running device of teacher and student model.
-    teacher_device = teacher_config.device
-    student_device = student_config.device
-
     # Clean all gradient.
     optimizer.zero_grad()
 
@@ -104,12 +142,127 @@ def amp_distill_mgpu(
         experiment_name
     )
 
+    # Write checkpoints on background thread. Only keep the latest and the
+    # most accurate checkpoints when `student_config.keep_last > 0`.
+    # Checkpoints of previous runs are only managed when resuming.
+    ckpt_writer = fine_tune.util.checkpoint.CheckpointWriter(
+        experiment_dir,
+        keep_best=student_config.keep_best,
+        keep_last=student_config.keep_last,
+        resume=resume
+    )
+
+    # Load model and training states from the latest checkpoint.
+    resume_state = None
+    if resume:
+        resume_state = fine_tune.util.checkpoint.load_checkpoint(
+            experiment_dir=experiment_dir,
+            model=student_model,
+            optimizer=optimizer,
+            device=student_device,
+            scaler=scaler,
+            scheduler=scheduler
+        )
+        if resume_state is None:
+            logger.info('No checkpoint found, start training from scratch.')
+
+    # Load dataset evaluated at every checkpoint.
+    eval_config, eval_dataset = (
+        fine_tune.util.checkpoint.load_eval_dataset_by_config(
+            config=student_config
+        )
+    )
+
+    # Load tokenized dataset caches. Missing teacher and student caches are
+    # built in one pass over dataset.
+    if teacher_store is None:
+        teacher_cache, student_cache = (
+            fine_tune.util.token_cache.load_pair_token_cache_by_config(
+                dataset=dataset,
+                student_config=student_config,
+                student_tokenizer=student_tokenizer,
+                teacher_config=teacher_config,
+                teacher_tokenizer=teacher_tokenizer
+            )
+        )
+    else:
+        student_cache = fine_tune.util.token_cache.load_token_cache_by_config(
+            config=student_config,
+            dataset=dataset,
+            tokenizer=student_tokenizer
+        )
+
+    # Teacher layers paired with each student layer.
+    if teacher_store is None:
+        teacher_encoder_config = teahcer_model.encoder.config
+        num_teacher_layers = teacher_encoder_config.num_hidden_layers
+        teacher_hidden_size = teacher_encoder_config.hidden_size
+    else:
+        num_teacher_layers = teacher_store.num_hidden_layers
+        teacher_hidden_size = teacher_store.hidden_size
+
+    hidden_layers, attn_layers = fine_tune.util.teacher_store.distill_layers(
+        num_student_layers=student_config.num_hidden_layers,
+        num_teacher_layers=num_teacher_layers
+    )
+    if not use_hidden_loss:
+        hidden_layers = []
+    if not use_attn_loss:
+        attn_layers = []
+
+    # Student layers paired with teacher layers. Skip embedding output.
+    student_hidden_layers = list(
+        range(1, student_config.num_hidden_layers + 1)
+    )[:len(hidden_layers)]
+    student_attn_layers = list(
+        range(student_config.num_hidden_layers)
+    )[:len(attn_layers)]
+
+    if teacher_store is None:
+        teacher_lengths = teacher_cache.lengths
+        collate_fn = fine_tune.task.TokenCache.create_pair_collate_fn(
+            teacher_cache=teacher_cache,
+            student_cache=student_cache,
+            padding=student_config.padding,
+            pad_to_multiple_of=student_config.pad_to_multiple_of
+        )
+    else:
+        # Read teacher outputs from store.
+        teacher_lengths = teacher_store.lengths
+        collate_fn = fine_tune.task.TeacherStore.create_pair_collate_fn(
+            teacher_store=teacher_store,
+            student_cache=student_cache,
+            attn_layers=attn_layers,
+            hidden_layers=hidden_layers,
+            padding=student_config.padding,
+            pad_to_multiple_of=student_config.pad_to_multiple_of
+        )
+
+    # Group samples with similar length into the same mini-batch.
+    # Both teacher and student inputs are padded to the longer one.
+    sampler = fine_tune.task.BucketBatchSampler(
+        accum_step=student_config.accum_step,
+        batch_size=student_config.batch_size // student_config.accum_step,
+        bucket_size=student_config.bucket_size,
+        lengths=np.maximum(teacher_lengths, student_cache.lengths),
+        drop_last=True,
+        max_seq_len=student_config.max_seq_len,
+        max_tokens_per_batch=student_config.max_tokens_per_batch,
+        pad_to_multiple_of=student_config.pad_to_multiple_of,
+        padding=student_config.padding
+    )
+    logger.info('Padding efficiency: %.4f', sampler.padding_efficiency())
+
+    # Continue the epoch of resumed checkpoint.
+    if resume_state is not None:
+        sampler.load_state_dict(resume_state['sampler'])
+
     # Teacher and student share a dataloader.
-    dataloader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=teacher_config.batch_size // teacher_config.accum_step,
-        collate_fn=dataset.create_collate_fn(),
-        shuffle=True
+    dataloader = fine_tune.util.dataloader.load_dataloader_by_config(
+        collate_fn=collate_fn,
+        config=student_config,
+        dataset=student_cache,
+        batch_sampler=sampler
     )
 
     # Create tensorboard's `SummaryWriter`.
@@ -120,10 +273,8 @@ def amp_distill_mgpu(
         )
     )
 
-    # Create objective functions.
-    logits_objective = fine_tune.objective.distill_loss
-    attn_objective =fine_tune.objective.attention_KL_loss
-    hidden_objective = fine_tune.objective.hidden_MSE_loss
+    # Create objective function.
+    objective = fine_tune.objective.distill_objective
 
     # Create adaptive layer.
     # Transform dimension of student hidden states as teacher's.
@@ -132,16 +283,21 @@ def amp_distill_mgpu(
         adaptvive_layers.append(
             torch.nn.Linear(
                 in_features=student_config.d_model,
-                out_features=teahcer_model.allow_ptrain_ver[
-                    teacher_config.ptrain_ver
-                ]
-            ).to(student_config.device_id)
+                out_features=teacher_hidden_size
+            ).to(student_device)
         )
 
-    # Accumulation step counter.
+    # Step and accumulation sample counter. Number of mini-batches in each
+    # step varies when `student_config.max_tokens_per_batch > 0`, thus we
+    # count samples instead of mini-batches.
     step = 0
-    accum_step = 0
-    total_accum_step = student_config.total_step * student_config.accum_step
+    accum_sample = 0
+    if resume_state is not None:
+        step = resume_state['step']
+
+    # Number of mini-batches consumed in current epoch. Saved in checkpoints
+    # as sampler position.
+    epoch_batch = 0
 
     # Mini-batch loss and accmulate loss.
     # Update when accumulate to `config.batch_size`.
@@ -151,160 +307,178 @@ def amp_distill_mgpu(
     hidden_loss = 0
     attn_loss = 0
 
-    # torch.Tensor placeholder.
-    batch_logits_loss = 0
-    batch_hidden_loss = 0
-    batch_attn_loss = 0
-
     # `tqdm` CLI Logger. We will manually update progress bar.
     cli_logger = tqdm(
         desc=f'loss: {loss:.6f} ' +
             f'logits_loss: {logits_loss:.6f} ' +
             f'hidden_loss: {hidden_loss:.6f} ' +
             f'attn_loss: {attn_loss:.6f}',
+        initial=step,
         total=student_config.total_step
     )
 
-    # Total update times: `student_config.total_step`
-    while accum_step < total_accum_step:
-
-        # Mini-batch loop.
-        for text, text_pair, label in dataloader:
-
-            # Transform `label` to a Tensor.
-            label = torch.LongTensor(label)
-
-            # Get `input_ids`, `token_type_ids` and `attention_mask` from via tokenizer.
-            teacher_batch_encode = teacher_tokenizer(
-                text=text,
-                text_pair=text_pair,
-                padding='max_length',
-                max_length=teacher_config.max_seq_len,
-                return_tensors='pt',
-                truncation=True
-            )
-            teacher_input_ids = teacher_batch_encode['input_ids']
-            teacher_token_type_ids = teacher_batch_encode['token_type_ids']
-            teacher_attention_mask = teacher_batch_encode['attention_mask']
-
-            student_batch_encode = student_tokenizer(
-                text=text,
-                text_pair=text_pair,
-                padding='max_length',
-                max_length=student_config.max_seq_len,
-                return_tensors='pt',
-                truncation=True
-            )
-            student_input_ids = student_batch_encode['input_ids']
-            student_token_type_ids = student_batch_encode['token_type_ids']
-            student_attention_mask = student_batch_encode['attention_mask']
-
-            # Get output logits, hidden states and attentions from teacher and student.
-            with torch.no_grad():
+    def teacher_forward(batch):
+        teacher_batch, student_batch, label = batch
+
+        if teacher_store is None:
+            (
+                teacher_input_ids,
+                teacher_attention_mask,
+                teacher_token_type_ids
+            ) = teacher_batch
+
+            # Get output logits, hidden states and attentions from teacher.
+            # Only capture teacher layers paired with student layers, and
+            # reduce attentions to `torch.float16` before moving them to
+            # student device.
+            with torch.no_grad(), fine_tune.util.amp.autocast(
+                    device=teacher_device,
+                    enabled=teacher_config.amp
+            ):
                 teacher_logits, teacher_hiddens, teacher_attns = teahcer_model(
                     input_ids = teacher_input_ids.to(teacher_device),
                     token_type_ids=teacher_token_type_ids.to(teacher_device),
                     attention_mask=teacher_attention_mask.to(teacher_device),
-                    return_hidden_and_attn=True
+                    attn_layers=attn_layers,
+                    hidden_layers=hidden_layers,
+                    attn_dtype=torch.float16,
+                    attn_log_prob=True
                 )
+        else:
+            # Teacher outputs were gathered from store.
+            teacher_logits, teacher_hiddens, teacher_attns = teacher_batch
+
+        # Move teacher outputs and student inputs to student device.
+        return (
+            (
+                teacher_logits.to(student_device),
+                [hidden.to(student_device) for hidden in teacher_hiddens],
+                [attn.to(student_device) for attn in teacher_attns],
+            ),
+            tuple(tensor.to(student_device) for tensor in student_batch),
+            label.to(student_device)
+        )
 
-            with torch.cuda.amp.autocast():
+    def eval_step(step):
+        # Evaluate checkpoint on `student_config.eval_dataset` and log
+        # accuracy.
+        if eval_dataset is None:
+            return None
+
+        acc = fine_tune.util.checkpoint.eval_checkpoint(
+            config=eval_config,
+            dataset=eval_dataset,
+            model=student_model,
+            tokenizer=student_tokenizer
+        )
+        writer.add_scalar(
+            f'{student_config.task}/{student_config.eval_dataset}/accuracy',
+            acc,
+            step
+        )
+        return acc
+
+    # Restore random states and sampler position of resumed checkpoint.
+    # Random states are restored last, so that everything created above
+    # draws the same random numbers as the original run.
+    if resume_state is not None:
+        fine_tune.util.checkpoint.set_rng_state(resume_state['rng'])
+        epoch_batch = resume_state['sampler']['num_batches']
+
+    # Total update times: `student_config.total_step`
+    while step < student_config.total_step:
+
+        if resume_state is not None:
+            # Seeds of resumed epoch were drawn before checkpoint was saved.
+            # Dataloader still draws a worker seed when creating iterator,
+            # which must not consume restored random states.
+            with torch.random.fork_rng(devices=[]):
+                batches = iter(dataloader)
+            resume_state = None
+        else:
+            epoch_batch = 0
+            batches = iter(dataloader)
+
+        # Mini-batch loop. Teacher works on next mini-batch in background
+        # when `pipeline_depth > 0`.
+        for (
+                (teacher_logits, teacher_hiddens, teacher_attns),
+                (
+                    student_input_ids,
+                    student_attention_mask,
+                    student_token_type_ids
+                ),
+                label
+        ) in fine_tune.util.pipeline.prefetch(
+            batches=batches,
+            depth=pipeline_depth,
+            fn=teacher_forward
+        ):
+
+            # Increment consumed mini-batch.
+            epoch_batch += 1
+
+            with fine_tune.util.amp.autocast(
+                    device=student_device,
+                    enabled=student_config.amp
+            ):
                 # Get output logits, hidden states and attentions from student.
                 student_logits, student_hiddens, student_attns = student_model(
-                    input_ids = student_input_ids.to(student_device),
-                    token_type_ids=student_token_type_ids.to(student_device),
-                    attention_mask=student_attention_mask.to(student_device),
-                    return_hidden_and_attn=True
+                    input_ids = student_input_ids,
+                    token_type_ids=student_token_type_ids,
+                    attention_mask=student_attention_mask,
+                    attn_layers=student_attn_layers,
+                    hidden_layers=student_hidden_layers,
+                    attn_log_prob=True
                 )
 
-            # Calculate logits loss.
+            # Weight of mini-batch in current optimizer step.
+            weight = label.size(0) / sampler.group_size
+
+            # Combine all loss terms into one loss.
             # Cause parameter update in Mixed Precision Training use 32-bit fp.
             # We need to leave context manager before `backward`.
+            with fine_tune.util.amp.autocast(
+                    device=student_device,
+                    enabled=student_config.amp
+            ):
+                batch_loss, breakdown = objective(
+                    hard_target=label,
+                    student_outputs=(
+                        student_logits,
+                        student_hiddens,
+                        student_attns
+                    ),
+                    teacher_outputs=(
+                        teacher_logits,
+                        teacher_hiddens,
+                        teacher_attns
+                    ),
+                    adaptive_layers=adaptvive_layers,
+                    attn_weight=float(use_attn_loss),
+                    hidden_weight=float(use_hidden_loss),
+                    logits_weight=float(use_logits_loss)
+                )
 
-            # Enable autocast.
-            if use_logits_loss:
-                with torch.cuda.amp.autocast():
-                    # Calculate batch loss of logits.
-                    batch_logits_loss = logits_objective(
-                        hard_target=label.to(student_device),
-                        teacher_logits=teacher_logits.to(student_device),
-                        student_logits=student_logits
-                    )
+                # Normalize loss.
+                batch_loss = batch_loss * weight
 
-                    # Normalize loss.
-                    batch_logits_loss = batch_logits_loss / student_config.accum_step
-
-                # Log loss.
-                logits_loss += batch_logits_loss.item()
-                loss += batch_logits_loss.item()
-
-                # Accumulate gradients.
-                scaler.scale(batch_logits_loss).backward(retain_graph=True)
-
-            if use_hidden_loss:
-                # Calculate batch hidden states loss.
-                # Cause parameter update in Mixed Precision Training use 32-bit fp.
-                # We need to leave context manager before `backward`.
-                # TODO: can we use `map` function to summarize loss?
-                skip = (len(teacher_hiddens) - 1) // (len(student_hiddens) - 1)
-                for t_hidden, s_hidden, adaptive_layer in zip(
-                    teacher_hiddens[1::skip],
-                    student_hiddens[1:],
-                    adaptvive_layers
-                ):
-
-                    # Enable autocast.
-                    with torch.cuda.amp.autocast():
-                        batch_hidden_loss = hidden_objective(
-                            teacher_hidden=t_hidden.to(student_device),
-                            student_hidden= adaptive_layer(
-                                s_hidden
-                            )
-                        )
-
-                        # Normalize loss.
-                        batch_hidden_loss = batch_hidden_loss / student_config.accum_step
-
-                    # Log loss.
-                    hidden_loss += batch_hidden_loss.item()
-                    loss += batch_hidden_loss.item()
-
-                    # Accumulate gradient.
-                    scaler.scale(batch_hidden_loss).backward(retain_graph=True)
-
-            if use_attn_loss:
-                # Calculate batch attentions loss.
-                # Cause parameter update in Mixed Precision Training use 32-bit fp.
-                # We need to leave context manager before `backward`.
-                # TODO: can we use `map` function to summarize loss?
-                skip = len(teacher_attns) // len(student_attns)
-                for t_attn, s_attn in zip(
-                    teacher_attns[skip-1::skip],
-                    student_attns
-                ):
-
-                    # Enable autocast.
-                    with torch.cuda.amp.autocast():
-                        batch_attn_loss = attn_objective(
-                            teacher_attn=t_attn.to(student_device),
-                            student_attn=s_attn
-                        )
-
-                        # Normalize loss.
-                        batch_attn_loss = batch_attn_loss / student_config.accum_step
-
-                    # Log loss.
-                    attn_loss += batch_attn_loss.item()
-                    loss += batch_attn_loss.item()
-
-                    # Accumulate gradient.
-                    scaler.scale(batch_attn_loss).backward(retain_graph=True)
-
-            # Increment accumulation step.
-            accum_step += 1
+            # Log loss.
+            logits_loss += breakdown['logits'].item() * weight
+            hidden_loss += breakdown['hidden'].item() * weight
+            attn_loss += breakdown['attn'].item() * weight
+            loss += batch_loss.item()
+
+            # Accumulate gradients with only one backward pass.
+            scaler.scale(batch_loss).backward()
+
+            # Increment accumulation sample.
+            accum_sample += label.size(0)
 
             # Perform gradient descend when achieve actual mini-batch size.
-            if accum_step % student_config.accum_step == 0:
+            if accum_sample >= sampler.group_size:
+                accum_sample = 0
+
                 # Unscale the gradient by optimizer.
                 scaler.unscale_(optimizer)
 
@@ -376,24 +550,40 @@ def amp_distill_mgpu(
                 # Clean up gradient.
                 optimizer.zero_grad()
 
-                # Save model for each `student_config.ckpt_step` step.
+                # Save checkpoint for each `student_config.ckpt_step` step.
                 if step % student_config.ckpt_step == 0:
-                    torch.save(
-                        student_model.state_dict(),
-                        os.path.join(experiment_dir, f'model-{step}.pt')
+                    ckpt_writer.save(
+                        model=student_model,
+                        optimizer=optimizer,
+                        scaler=scaler,
+                        scheduler=scheduler,
+                        step=step,
+                        sampler_state=sampler.state_dict(
+                            num_batches=epoch_batch
+                        ),
+                        metric=eval_step(step)
                     )
 
             # Stop training condition.
-            if accum_step >= total_accum_step:
+            if step >= student_config.total_step:
                 break
 
+    # Save the latest checkpoint if it was not saved in loop.
+    if step % student_config.ckpt_step != 0:
+        ckpt_writer.save(
+            model=student_model,
+            optimizer=optimizer,
+            scaler=scaler,
+            scheduler=scheduler,
+            step=step,
+            sampler_state=sampler.state_dict(num_batches=epoch_batch),
+            metric=eval_step(step)
+        )
+
     # Release IO resources.
     writer.flush()
     writer.close()
     cli_logger.close()
 
-    # Save the latest model.
-    torch.save(
-        student_model.state_dict(),
-        os.path.join(experiment_dir, f'model-{step}.pt')
-    )
+    # Wait for all checkpoints written.
+    ckpt_writer.close()
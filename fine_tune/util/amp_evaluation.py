@@ -13,9 +13,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from typing import Optional
+
 # 3rd party modules
 
 import torch
+import torch.distributed
 import torch.utils
 import torch.utils.data
 import torch.utils.tensorboard
@@ -29,6 +32,9 @@ from tqdm import tqdm
 import fine_tune.config
 import fine_tune.task
 import fine_tune.model
+import fine_tune.util.amp
+import fine_tune.util.dataloader
+import fine_tune.util.token_cache
 
 
 @torch.no_grad()
@@ -36,7 +42,10 @@ def amp_evaluation(
         config: fine_tune.config.BaseConfig,
         dataset: fine_tune.task.Dataset,
         model: fine_tune.model.Model,
-        tokenizer: transformers.PreTrainedTokenizer
+        tokenizer: transformers.PreTrainedTokenizerBase,
+        cache: Optional[fine_tune.task.TokenCache] = None,
+        num_replicas: int = 1,
+        rank: int = 0
 ) -> float:
     r"""Evaluate model on task specific dataset with automatic mixed precision.
     Args:
@@ -49,6 +58,17 @@ def amp_evaluation(
             Model which will be evaluated on `dataset`.
         tokenizer:
             Tokenizer paired with `model`.
+        cache:
+            Tokenized cache of `dataset`. Loaded by `config` when `None`.
+            Pass a loaded cache to evaluate many checkpoints without loading
+            cache again.
+        num_replicas:
+            Number of distributed data parallel replicas. When
+            `num_replicas > 1`, each replica evaluates disjoint mini-batches
+            and correct predictions are all-reduced. All replicas must call
+            this function together.
+        rank:
+            Rank of current replica.
 
     Returns:
         Accuracy.
@@ -60,14 +80,42 @@ def amp_evaluation(
     # Model running device.
     device = config.device
 
-    # Create dataloader.
-    dataloader = torch.utils.data.DataLoader(
-        dataset,
+    # Load tokenized dataset cache.
+    if cache is None:
+        cache = fine_tune.util.token_cache.load_token_cache_by_config(
+            config=config,
+            dataset=dataset,
+            tokenizer=tokenizer
+        )
+
+    # Sort samples by length so that each mini-batch needs less padding.
+    # Prediction order does not matter since labels come with mini-batches.
+    sampler = fine_tune.task.BucketBatchSampler(
+        accum_step=1,
         batch_size=config.batch_size,
-        collate_fn=dataset.create_collate_fn(),
+        bucket_size=len(cache),
+        lengths=cache.lengths,
+        max_seq_len=config.max_seq_len,
+        max_tokens_per_batch=config.max_tokens_per_batch,
+        pad_to_multiple_of=config.pad_to_multiple_of,
+        num_replicas=num_replicas,
+        padding=config.padding,
+        rank=rank,
+        seed=config.seed,
         shuffle=False
     )
 
+    # Create dataloader.
+    dataloader = fine_tune.util.dataloader.load_dataloader_by_config(
+        collate_fn=cache.create_collate_fn(
+            padding=config.padding,
+            pad_to_multiple_of=config.pad_to_multiple_of
+        ),
+        config=config,
+        dataset=cache,
+        batch_sampler=sampler
+    )
+
     # Record label and prediction for calculating accuracy.
     all_label = []
     all_pred_label = []
@@ -75,22 +123,9 @@ def amp_evaluation(
     # Evaluate through mini-batch loop.
     mini_batch_iterator = tqdm(dataloader)
 
-    for text, text_pair, label in mini_batch_iterator:
-        # Get `input_ids`, `token_type_ids` and `attention_mask` from via tokenizer.
-        batch_encode = tokenizer(
-            text=text,
-            text_pair=text_pair,
-            padding='max_length',
-            max_length=config.max_seq_len,
-            return_tensors='pt',
-            truncation=True
-        )
-        input_ids = batch_encode['input_ids']
-        token_type_ids = batch_encode['token_type_ids']
-        attention_mask = batch_encode['attention_mask']
-
+    for input_ids, attention_mask, token_type_ids, label in mini_batch_iterator:
         # Enable autocast
-        with torch.cuda.amp.autocast():
+        with fine_tune.util.amp.autocast(device=device):
             # Mini-batch prediction.
             pred_label = model.predict(
                 input_ids=input_ids.to(device),
@@ -98,11 +133,24 @@ def amp_evaluation(
                 attention_mask=attention_mask.to(device)
             ).argmax(dim=-1).to('cpu')
 
-        all_label.extend(label)
+        all_label.extend(label.tolist())
         all_pred_label.extend(pred_label.tolist())
 
     # Calculate accuracy.
-    acc = accuracy_score(all_label, all_pred_label)
+    if num_replicas > 1:
+        # Sum up correct predictions and samples of all replicas.
+        count = torch.tensor(
+            [
+                accuracy_score(all_label, all_pred_label, normalize=False),
+                len(all_label),
+            ],
+            dtype=torch.float64,
+            device=device
+        )
+        torch.distributed.all_reduce(count)
+        acc = (count[0] / count[1]).item()
+    else:
+        acc = accuracy_score(all_label, all_pred_label)
 
     # Show accuracy.
     mini_batch_iterator.set_description(f'accuracy: {acc:.6f}')
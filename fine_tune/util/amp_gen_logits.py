@@ -1,10 +1,17 @@
 r"""Helper functions for generating logits
 from fine-tuned model with automatic mixed precision.
 
+Logits are streamed into `fine_tune.task.LogitsFile` batch by batch, thus
+memory usage does not grow with dataset size. Re-running on the same
+checkpoint and dataset resumes from the first sample not written yet. Logits
+file is generated again from scratch when dataset source file or model weights
+changed.
+
 Usage:
     import fine_tune
 
-    fine_tune.util.amp_gen_logits(...)
+    path = fine_tune.util.amp_gen_logits(...)
+    dataset.load_logits(path)
 """
 
 # built-in modules
@@ -14,6 +21,9 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
+import logging
+
 # 3rd party modules
 
 import torch
@@ -29,18 +39,50 @@ import fine_tune.config
 import fine_tune.task
 import fine_tune.model
 import fine_tune.path
+import fine_tune.util.amp
+import fine_tune.util.dataloader
+import fine_tune.util.token_cache
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+
+def model_checksum(model: torch.nn.Module) -> str:
+    r"""Compute SHA-1 checksum of model weights.
+
+    Args:
+        model:
+            Model to checksum.
+
+    Returns:
+        Hex SHA-1 digest of names and raw bytes of all tensors in
+        `model.state_dict()`.
+    """
+    digest = hashlib.sha1()
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode('utf-8'))
+        digest.update(str(tensor.dtype).encode('utf-8'))
+        digest.update(
+            tensor.detach().to('cpu').contiguous().view(-1)
+            .view(torch.uint8).numpy().tobytes()
+        )
+    return digest.hexdigest()
 
 
 @torch.no_grad()
 def amp_gen_logits(
+        ckpt: int,
         config: fine_tune.config.BaseConfig,
         dataset: fine_tune.task.Dataset,
         model: fine_tune.model.Model,
-        tokenizer: transformers.PreTrainedTokenizer
-):
-    r"""Generate fine-tuned model logits with `torch.cuda.amp` on task specific dataset.
+        tokenizer: transformers.PreTrainedTokenizerBase
+) -> str:
+    r"""Generate fine-tuned model logits with automatic mixed precision on task specific dataset.
 
     Args:
+        ckpt:
+            Checkpoint of `model`. Used to name logits file.
         config:
             `fine_tune.config.BaseConfig` subclass which attributes are used
             for experiment setup.
@@ -50,6 +92,9 @@ def amp_gen_logits(
             Model which will generate logits on `dataset`.
         tokenizer:
             Tokenizer paired with `model`.
+
+    Returns:
+        Path of logits file. See `fine_tune.task.LogitsFile.file_path`.
     """
     # Evaluation mode.
     model.eval()
@@ -57,54 +102,72 @@ def amp_gen_logits(
     # Model running device.
     device = config.device
 
-    # Get experiment name and model name.
+    # Get experiment name and logits file path.
     experiment_name = fine_tune.config.BaseConfig.experiment_name(
         experiment=config.experiment,
         model=config.model,
         task=config.task
     )
+    logits_path = fine_tune.task.LogitsFile.file_path(
+        ckpt=ckpt,
+        dataset=config.dataset,
+        experiment_name=experiment_name
+    )
 
-    # Create dataloader.
-    dataloader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=config.batch_size,
-        collate_fn=dataset.create_collate_fn(
-            max_seq_len=config.max_seq_len,
-            tokenizer=tokenizer
-        ),
-        shuffle=False
+    # Load tokenized dataset cache.
+    cache = fine_tune.util.token_cache.load_token_cache_by_config(
+        config=config,
+        dataset=dataset,
+        tokenizer=tokenizer
     )
 
-    # Sample index for updating logits.
-    sample_index = 0
+    # Skip samples written by previous interrupted run.
+    start = fine_tune.task.LogitsFile.resume(
+        path=logits_path,
+        num_class=config.num_class,
+        num_sample=len(cache),
+        checksum=dataset.checksum,
+        model_checksum=model_checksum(model)
+    )
+    if start:
+        logger.info(
+            'Resume logits file %s from sample %d.',
+            logits_path,
+            start
+        )
+
+    # Create dataloader. Samples must be visited in order.
+    dataloader = fine_tune.util.dataloader.load_dataloader_by_config(
+        collate_fn=cache.create_collate_fn(
+            padding=config.padding,
+            pad_to_multiple_of=config.pad_to_multiple_of
+        ),
+        config=config,
+        dataset=range(start, len(cache)),
+        batch_size=config.batch_size
+    )
 
     # Generate logits through mini-batch loop.
     for (
             input_ids,
             attention_mask,
             token_type_ids,
-            _,
             _
     ) in tqdm(dataloader):
 
         # Enable autocast.
-        with torch.cuda.amp.autocast():
+        with fine_tune.util.amp.autocast(device=device):
             # Get mini-batch logits.
             batch_logits = model(
                 input_ids=input_ids.to(device),
                 token_type_ids=token_type_ids.to(device),
                 attention_mask=attention_mask.to(device)
-            ).to('cpu').tolist()
-
-        # Update logits.
-        for index, logits in enumerate(batch_logits):
-            dataset.update_logits(
-                index=index + sample_index,
-                logits=logits
             )
 
-        # Shift sample index.
-        sample_index += len(batch_logits)
+        # Append logits to file.
+        fine_tune.task.LogitsFile.append(
+            path=logits_path,
+            logits=batch_logits.to('cpu', torch.float16).numpy()
+        )
 
-    # Save logits.
-    dataset.save_for_distill(experiment_name)
+    return logits_path
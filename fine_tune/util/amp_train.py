@@ -13,6 +13,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import logging
 import os
 
 # 3rd party modules
@@ -32,6 +33,14 @@ import fine_tune.config
 import fine_tune.task
 import fine_tune.model
 import fine_tune.path
+import fine_tune.util.amp
+import fine_tune.util.checkpoint
+import fine_tune.util.dataloader
+import fine_tune.util.token_cache
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
 
 
 def amp_train(
@@ -40,7 +49,8 @@ def amp_train(
         model: fine_tune.model.Model,
         optimizer: torch.optim.AdamW,
         scheduler: torch.optim.lr_scheduler.LambdaLR,
-        tokenizer: transformers.PreTrainedTokenizer,
+        tokenizer: transformers.PreTrainedTokenizerBase,
+        resume: bool = False
 ):
     r"""Fine-tune or distill model on task specific dataset with automatic mixed precision
 
@@ -58,6 +68,10 @@ def amp_train(
             Linear warmup scheduler provided by `transformers` package.
         tokenizer:
             Tokenizer paired with `model`.
+        resume:
+            Continue training from the latest checkpoint in experiment
+            folder, including random states and sampler position. Training
+            starts from scratch if there is no checkpoint.
     """
     # Training mode.
     model.train()
@@ -65,8 +79,8 @@ def amp_train(
     # Model running device.
     device = config.device
 
-    # Creates a GradScaler
-    scaler = torch.cuda.amp.GradScaler()
+    # Creates a GradScaler. It is a no-op on CPU.
+    scaler = fine_tune.util.amp.grad_scaler(device=device)
 
     # Clean all gradient.
     optimizer.zero_grad()
@@ -82,12 +96,71 @@ def amp_train(
         experiment_name
     )
 
-    # Create dataloader.
-    dataloader = torch.utils.data.DataLoader(
-        dataset,
+    # Write checkpoints on background thread. Only keep the latest and the
+    # most accurate checkpoints when `config.keep_last > 0`. Checkpoints of
+    # previous runs are only managed when resuming.
+    ckpt_writer = fine_tune.util.checkpoint.CheckpointWriter(
+        experiment_dir,
+        keep_best=config.keep_best,
+        keep_last=config.keep_last,
+        resume=resume
+    )
+
+    # Load model and training states from the latest checkpoint.
+    resume_state = None
+    if resume:
+        resume_state = fine_tune.util.checkpoint.load_checkpoint(
+            experiment_dir=experiment_dir,
+            model=model,
+            optimizer=optimizer,
+            device=device,
+            scaler=scaler,
+            scheduler=scheduler
+        )
+        if resume_state is None:
+            logger.info('No checkpoint found, start training from scratch.')
+
+    # Load dataset evaluated at every checkpoint.
+    eval_config, eval_dataset = (
+        fine_tune.util.checkpoint.load_eval_dataset_by_config(config=config)
+    )
+
+    # Load tokenized dataset cache.
+    cache = fine_tune.util.token_cache.load_token_cache_by_config(
+        config=config,
+        dataset=dataset,
+        tokenizer=tokenizer
+    )
+
+    # Group samples with similar length into the same mini-batch.
+    # Drop the last incomplete group so that each optimizer step sees exactly
+    # `sampler.group_size` samples.
+    sampler = fine_tune.task.BucketBatchSampler(
+        accum_step=config.accum_step,
         batch_size=config.batch_size // config.accum_step,
-        collate_fn=dataset.create_collate_fn(),
-        shuffle=True
+        bucket_size=config.bucket_size,
+        lengths=cache.lengths,
+        drop_last=True,
+        max_seq_len=config.max_seq_len,
+        max_tokens_per_batch=config.max_tokens_per_batch,
+        pad_to_multiple_of=config.pad_to_multiple_of,
+        padding=config.padding
+    )
+    logger.info('Padding efficiency: %.4f', sampler.padding_efficiency())
+
+    # Continue the epoch of resumed checkpoint.
+    if resume_state is not None:
+        sampler.load_state_dict(resume_state['sampler'])
+
+    # Create dataloader.
+    dataloader = fine_tune.util.dataloader.load_dataloader_by_config(
+        collate_fn=cache.create_collate_fn(
+            padding=config.padding,
+            pad_to_multiple_of=config.pad_to_multiple_of
+        ),
+        config=config,
+        dataset=cache,
+        batch_sampler=sampler
     )
 
     # Create tensorboard's `SummaryWriter`.
@@ -101,10 +174,17 @@ def amp_train(
     # Use cross-entropy as objective.
     objective = nn.CrossEntropyLoss()
 
-    # Step and accumulation step counter.
+    # Step and accumulation sample counter. Number of mini-batches in each
+    # step varies when `config.max_tokens_per_batch > 0`, thus we count
+    # samples instead of mini-batches.
     step = 0
-    accum_step = 0
-    total_accum_step = config.total_step * config.accum_step
+    accum_sample = 0
+    if resume_state is not None:
+        step = resume_state['step']
+
+    # Number of mini-batches consumed in current epoch. Saved in checkpoints
+    # as sampler position.
+    epoch_batch = 0
 
     # Mini-batch loss and accumulate loss.
     # Update when accumulate to `config.batch_size`.
@@ -114,37 +194,62 @@ def amp_train(
     # `tqdm` CLI Logger. We will manually update progress bar.
     cli_logger = tqdm(
         desc=f'loss: {loss:.6f}',
+        initial=step,
         total=config.total_step
     )
 
+    def eval_step(step):
+        # Evaluate checkpoint on `config.eval_dataset` and log accuracy.
+        if eval_dataset is None:
+            return None
+
+        acc = fine_tune.util.checkpoint.eval_checkpoint(
+            config=eval_config,
+            dataset=eval_dataset,
+            model=model,
+            tokenizer=tokenizer
+        )
+        writer.add_scalar(
+            f'{config.task}/{config.eval_dataset}/accuracy',
+            acc,
+            step
+        )
+        return acc
+
+    # Restore random states and sampler position of resumed checkpoint.
+    # Random states are restored last, so that everything created above
+    # draws the same random numbers as the original run.
+    if resume_state is not None:
+        fine_tune.util.checkpoint.set_rng_state(resume_state['rng'])
+        epoch_batch = resume_state['sampler']['num_batches']
+
     # Total update times: `config.total_step`.
-    while accum_step < total_accum_step:
+    while step < config.total_step:
+
+        if resume_state is not None:
+            # Seeds of resumed epoch were drawn before checkpoint was saved.
+            # Dataloader still draws a worker seed when creating iterator,
+            # which must not consume restored random states.
+            with torch.random.fork_rng(devices=[]):
+                batches = iter(dataloader)
+            resume_state = None
+        else:
+            epoch_batch = 0
+            batches = iter(dataloader)
 
         # Mini-batch loop.
         for (
-                text,
-                text_pair,
+                input_ids,
+                attention_mask,
+                token_type_ids,
                 label
-        ) in dataloader:
-
-            # Transform `label` to tensor.
-            label = torch.LongTensor(label)
-
-            # Get `input_ids`, `token_type_ids` and `attention_mask` from via tokenizer.
-            batch_encode = tokenizer(
-                text=text,
-                text_pair=text_pair,
-                padding='max_length',
-                max_length=config.max_seq_len,
-                return_tensors='pt',
-                truncation=True
-            )
-            input_ids = batch_encode['input_ids']
-            token_type_ids = batch_encode['token_type_ids']
-            attention_mask = batch_encode['attention_mask']
+        ) in batches:
+
+            # Increment consumed mini-batch.
+            epoch_batch += 1
 
             # Enable autocast.
-            with torch.cuda.amp.autocast():
+            with fine_tune.util.amp.autocast(device=device):
                 # Accumulate cross-entropy loss.
                 # Use `model(...)` to do forward pass.
                 accum_loss = objective(
@@ -154,7 +259,7 @@ def amp_train(
                         attention_mask=attention_mask.to(device)
                     ),
                     target=label.to(device)
-                ) / config.accum_step
+                ) * label.size(0) / sampler.group_size
 
             # Mini-batch cross-entropy loss. Only used as log.
             loss += accum_loss.item()
@@ -162,11 +267,13 @@ def amp_train(
             # Accumulate scaled gradients.
             scaler.scale(accum_loss).backward()
 
-            # Increment accumulation step.
-            accum_step += 1
+            # Increment accumulation sample.
+            accum_sample += label.size(0)
 
             # Perform gradient descend when achieve actual mini-batch size.
-            if accum_step % config.accum_step == 0:
+            if accum_sample >= sampler.group_size:
+                accum_sample = 0
+
                 # Unscale the gradient by optimizer.
                 scaler.unscale_(optimizer)
 
@@ -213,24 +320,40 @@ def amp_train(
                 # Clean up gradient.
                 optimizer.zero_grad()
 
-                # Save model for each `config.ckpt_step` step.
+                # Save checkpoint for each `config.ckpt_step` step.
                 if step % config.ckpt_step == 0:
-                    torch.save(
-                        model.state_dict(),
-                        os.path.join(experiment_dir, f'model-{step}.pt')
+                    ckpt_writer.save(
+                        model=model,
+                        optimizer=optimizer,
+                        scaler=scaler,
+                        scheduler=scheduler,
+                        step=step,
+                        sampler_state=sampler.state_dict(
+                            num_batches=epoch_batch
+                        ),
+                        metric=eval_step(step)
                     )
 
             # Stop training condition.
-            if accum_step >= total_accum_step:
+            if step >= config.total_step:
                 break
 
+    # Save the latest checkpoint if it was not saved in loop.
+    if step % config.ckpt_step != 0:
+        ckpt_writer.save(
+            model=model,
+            optimizer=optimizer,
+            scaler=scaler,
+            scheduler=scheduler,
+            step=step,
+            sampler_state=sampler.state_dict(num_batches=epoch_batch),
+            metric=eval_step(step)
+        )
+
     # Release IO resources.
     writer.flush()
     writer.close()
     cli_logger.close()
 
-    # Save the lastest model.
-    torch.save(
-        model.state_dict(),
-        os.path.join(experiment_dir, f'model-{step}.pt')
-    )
+    # Wait for all checkpoints written.
+    ckpt_writer.close()
@@ -1,13 +1,43 @@
-r""" Warning! It is a temporary module!
-Use this module during multi-GPU distillation to check GPU numbers.
+r"""Helper functions for checking model running devices.
+
+Usage:
+    import fine_tune
+
+    fine_tune.util.check_device(teacher_config.device, student_config.device)
 """
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+# 3rd party modules
+
 import torch
 
-def check_device() -> bool:
-    r"""
-    Check number of GPU during multi-GPU distillation
-    """
 
-    gpu_count = torch.cuda.device_count()
-    if  not ( torch.cuda.is_available() and gpu_count == 2 ):
-        raise ValueError(f'Insufficient GPU device, GPU count: {gpu_count}')
+def check_device(*devices: torch.device) -> None:
+    r"""Check all devices are available.
+
+    CPU is always available. Devices may be shared, e.g., teacher and student
+    can both run on CPU or on the same GPU.
+
+    Args:
+        devices:
+            Model running devices.
+
+    Raises:
+        ValueError:
+            When some CUDA device does not exist.
+    """
+    gpu_count = torch.cuda.device_count() if torch.cuda.is_available() else 0
+    for device in devices:
+        if device.type != 'cuda':
+            continue
+        index = 0 if device.index is None else device.index
+        if index >= gpu_count:
+            raise ValueError(
+                f'Device {device} is not available, GPU count: {gpu_count}'
+            )
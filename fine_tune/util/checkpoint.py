@@ -0,0 +1,714 @@
+r"""Helper class for saving checkpoints without blocking training loop.
+
+`fine_tune.util.CheckpointWriter.save` only copies model and training states
+to CPU on the calling thread. Serialization and disk IO run on a background
+thread while training continues. Each checkpoint of step `s` consists of the
+following files in experiment folder:
+
+- 'checkpoint-s.pt': optimizer, scheduler and gradient scaler states, random
+  states and sampler position, which are needed to resume training.
+- 'model-s.pt': model `state_dict`, loaded by evaluation scripts.
+
+Each file is written into a temporary file first and then renamed, and
+'model-s.pt' is always written last. Thus when 'model-s.pt' exists, the
+whole checkpoint is complete.
+
+Accuracy of each checkpoint on evaluation dataset (if any) is recorded in
+'checkpoint-metrics.json'. `fine_tune.util.CheckpointWriter` can keep only
+the latest checkpoints plus the most accurate ones, and deletes the others
+as training goes.
+
+Usage:
+    import fine_tune
+
+    ckpt_writer = fine_tune.util.CheckpointWriter(experiment_dir)
+    ckpt_writer.save(
+        model=model,
+        optimizer=optimizer,
+        scaler=scaler,
+        scheduler=scheduler,
+        step=step,
+        sampler_state=sampler.state_dict(num_batches=num_batches)
+    )
+    ckpt_writer.close()
+
+    state = fine_tune.util.load_checkpoint(
+        experiment_dir=experiment_dir,
+        model=model,
+        optimizer=optimizer,
+        device=device,
+        scaler=scaler,
+        scheduler=scheduler
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# 3rd party modules
+
+import numpy as np
+import torch
+import torch.nn as nn
+import transformers
+
+# my own modules
+
+import fine_tune.config
+import fine_tune.model
+import fine_tune.task
+import fine_tune.util.task
+
+from fine_tune.util.amp_evaluation import amp_evaluation
+from fine_tune.util.evaluation import evaluation
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+
+def snapshot(obj: Any) -> Any:
+    r"""Copy all tensors in nested containers to CPU.
+
+    Containers are rebuilt so that later in-place updates of training states
+    (e.g., parameters and optimizer moments) do not affect the snapshot.
+    `state_dict` metadata is preserved.
+
+    Args:
+        obj:
+            Tensor or nested `dict`, `list` and `tuple` of tensors.
+
+    Returns:
+        Same structure as `obj` with every tensor copied to CPU.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        copied = obj.__class__(
+            (key, snapshot(value))
+            for key, value in obj.items()
+        )
+        if hasattr(obj, '_metadata'):
+            copied._metadata = obj._metadata
+        return copied
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__(snapshot(value) for value in obj)
+    return obj
+
+
+def model_path(experiment_dir: str, step: int) -> str:
+    r"""Get model file path of a checkpoint.
+
+    Args:
+        experiment_dir:
+            Experiment folder.
+        step:
+            Checkpoint step.
+
+    Returns:
+        Path of 'model-step.pt'.
+    """
+    return os.path.join(experiment_dir, f'model-{step}.pt')
+
+
+def state_path(experiment_dir: str, step: int) -> str:
+    r"""Get training state file path of a checkpoint.
+
+    Args:
+        experiment_dir:
+            Experiment folder.
+        step:
+            Checkpoint step.
+
+    Returns:
+        Path of 'checkpoint-step.pt'.
+    """
+    return os.path.join(experiment_dir, f'checkpoint-{step}.pt')
+
+
+def metric_path(experiment_dir: str) -> str:
+    r"""Get file path of checkpoints' evaluation accuracy.
+
+    Args:
+        experiment_dir:
+            Experiment folder.
+
+    Returns:
+        Path of 'checkpoint-metrics.json'.
+    """
+    return os.path.join(experiment_dir, 'checkpoint-metrics.json')
+
+
+def list_steps(experiment_dir: str) -> List[int]:
+    r"""List steps of complete checkpoints.
+
+    A checkpoint is complete when both 'checkpoint-step.pt' and 'model-step.pt'
+    exist, see module docstring.
+
+    Args:
+        experiment_dir:
+            Experiment folder.
+
+    Returns:
+        Steps of complete checkpoints in ascending order.
+    """
+    if not os.path.isdir(experiment_dir):
+        return []
+
+    steps = []
+    for file_name in os.listdir(experiment_dir):
+        match = re.fullmatch(r'checkpoint-(\d+)\.pt', file_name)
+        if match is None:
+            continue
+        step = int(match.group(1))
+        if os.path.exists(model_path(experiment_dir, step)):
+            steps.append(step)
+
+    return sorted(steps)
+
+
+def latest_step(experiment_dir: str) -> Optional[int]:
+    r"""Find the latest complete checkpoint.
+
+    Args:
+        experiment_dir:
+            Experiment folder.
+
+    Returns:
+        Step of the latest complete checkpoint, or `None` if there is no
+        complete checkpoint.
+    """
+    steps = list_steps(experiment_dir)
+    if not steps:
+        return None
+    return steps[-1]
+
+
+def load_metrics(experiment_dir: str) -> Dict[int, float]:
+    r"""Load evaluation accuracy of checkpoints.
+
+    Args:
+        experiment_dir:
+            Experiment folder.
+
+    Returns:
+        Key and value pairs, where key is the checkpoint step and value is
+        its accuracy. Empty if no checkpoint was evaluated.
+    """
+    if not os.path.exists(metric_path(experiment_dir)):
+        return {}
+
+    with open(metric_path(experiment_dir), 'r', encoding='utf-8') as json_file:
+        return {
+            int(step): metric
+            for step, metric in json.load(json_file).items()
+        }
+
+
+def get_rng_state() -> Dict[str, Any]:
+    r"""Get random states of `random`, `numpy`, `torch` and CUDA.
+
+    `numpy` state is converted into built-in types, so that it can be loaded
+    by `torch.load` with `weights_only=True`.
+
+    Returns:
+        Random states, which are restored by `set_rng_state`.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state = {
+        'numpy': (
+            name,
+            keys.tolist(),
+            int(pos),
+            int(has_gauss),
+            float(cached_gaussian),
+        ),
+        'python': random.getstate(),
+        'torch': torch.get_rng_state(),
+        'cuda': None,
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: Dict[str, Any]) -> None:
+    r"""Restore random states returned by `get_rng_state`.
+
+    Args:
+        state:
+            Random states returned by `get_rng_state`.
+    """
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((
+        name,
+        np.array(keys, dtype=np.uint32),
+        pos,
+        has_gauss,
+        cached_gaussian,
+    ))
+
+    # `random.setstate` only accepts tuples.
+    version, internal_state, gauss_next = state['python']
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def load_checkpoint(
+        experiment_dir: str,
+        model: nn.Module,
+        optimizer: torch.optim.Optimizer,
+        device: torch.device,
+        scaler: Optional[torch.amp.GradScaler] = None,
+        scheduler: Optional[torch.optim.lr_scheduler.LambdaLR] = None,
+        step: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    r"""Load model and training states from a checkpoint.
+
+    Random states and sampler position are not restored here, since they
+    must be restored right before training loop starts. Callers restore them
+    from returned states with `set_rng_state` and
+    `fine_tune.task.BucketBatchSampler.load_state_dict`.
+
+    Args:
+        experiment_dir:
+            Experiment folder.
+        model:
+            Model to load `state_dict` into.
+        optimizer:
+            Optimizer of `model`.
+        device:
+            Device of `model`.
+        scaler:
+            Gradient scaler used with `optimizer`.
+        scheduler:
+            Learning rate scheduler of `optimizer`.
+        step:
+            Checkpoint step. Load the latest complete checkpoint if `None`.
+
+    Raises:
+        FileNotFoundError:
+            If checkpoint of `step` does not exist.
+        ValueError:
+            If checkpoint has no sampler position, e.g., checkpoints saved by
+            distributed data parallel training, which cannot be resumed.
+
+    Returns:
+        Training states saved by `CheckpointWriter.save`, including `step`,
+        `rng` and `sampler`. `None` if `step` is `None` and there is no
+        complete checkpoint.
+    """
+    if step is None:
+        step = latest_step(experiment_dir)
+        if step is None:
+            return None
+
+    state = torch.load(
+        state_path(experiment_dir, step),
+        map_location='cpu'
+    )
+    if state['sampler'] is None:
+        raise ValueError(
+            f'Checkpoint {state_path(experiment_dir, step)} has no sampler ' +
+            'position and cannot be resumed. Checkpoints saved by ' +
+            'distributed data parallel training cannot be resumed.'
+        )
+    model.load_state_dict(torch.load(
+        model_path(experiment_dir, step),
+        map_location=device
+    ))
+    optimizer.load_state_dict(state['optimizer'])
+    if scaler is not None and state['scaler'] is not None:
+        scaler.load_state_dict(state['scaler'])
+    if scheduler is not None and state['scheduler'] is not None:
+        scheduler.load_state_dict(state['scheduler'])
+
+    logger.info('Load checkpoint %s.', state_path(experiment_dir, step))
+    return state
+
+
+def load_eval_dataset_by_config(
+        config: fine_tune.config.BaseConfig
+) -> Tuple[fine_tune.config.BaseConfig, Optional[fine_tune.task.Dataset]]:
+    r"""Load dataset evaluated at every checkpoint during training.
+
+    Args:
+        config:
+            Configuration object which contains attributes `eval_dataset`,
+            `task` and `num_workers`.
+
+    Returns:
+        A copy of `config` whose `dataset` is `config.eval_dataset`, and the
+        evaluation dataset. Dataset is `None` if `config.eval_dataset` is
+        empty.
+    """
+    eval_config = copy.copy(config)
+    eval_config.dataset = config.eval_dataset
+    if not config.eval_dataset:
+        return eval_config, None
+
+    return eval_config, fine_tune.util.task.load_dataset_by_config(
+        config=eval_config
+    )
+
+
+def eval_checkpoint(
+        config: fine_tune.config.BaseConfig,
+        dataset: fine_tune.task.Dataset,
+        model: fine_tune.model.Model,
+        tokenizer: transformers.PreTrainedTokenizerBase,
+        num_replicas: int = 1,
+        rank: int = 0
+) -> float:
+    r"""Evaluate model in the middle of training.
+
+    Evaluation draws random seeds for its dataloader. `torch` random state is
+    forked, so training draws the same random numbers with or without
+    evaluation. Model is set back to training mode afterward.
+
+    Args:
+        config:
+            Evaluation configuration returned by
+            `load_eval_dataset_by_config`.
+        dataset:
+            Evaluation dataset.
+        model:
+            Model to be evaluated.
+        tokenizer:
+            Tokenizer paired with `model`.
+        num_replicas:
+            Number of distributed data parallel replicas. Each replica
+            evaluates its own share of `dataset`, see
+            `fine_tune.util.evaluation`.
+        rank:
+            Rank of current replica.
+
+    Returns:
+        Accuracy.
+    """
+    with torch.random.fork_rng(devices=[]):
+        if config.amp:
+            acc = amp_evaluation(
+                config=config,
+                dataset=dataset,
+                model=model,
+                tokenizer=tokenizer,
+                num_replicas=num_replicas,
+                rank=rank
+            )
+        else:
+            acc = evaluation(
+                config=config,
+                dataset=dataset,
+                model=model,
+                tokenizer=tokenizer,
+                num_replicas=num_replicas,
+                rank=rank
+            )
+
+    model.train()
+    return acc
+
+
+class CheckpointWriter:
+    r"""Write checkpoints on a background thread.
+
+    When `keep_last > 0`, only the latest `keep_last` checkpoints and the
+    `keep_best` checkpoints with the highest accuracy are kept. Other
+    checkpoints are deleted on background thread right after a new one is
+    written. Checkpoints are ranked by step, not by order of writing.
+
+    Complete checkpoints already in `experiment_dir` are only managed when
+    `resume=True`. Otherwise they are left untouched, so that starting a
+    fresh run never deletes checkpoints of a previous run. Their recorded
+    accuracy is kept in 'checkpoint-metrics.json' as well, unless this writer
+    overwrites the checkpoint of the same step.
+
+    Args:
+        experiment_dir:
+            Folder to save checkpoints.
+        max_pending:
+            Maximum number of checkpoints which are copied to CPU but not yet
+            written. `save` blocks until some checkpoint is written when limit
+            is reached, which bounds host memory used by snapshots.
+        keep_best:
+            Number of checkpoints with the highest accuracy to keep. Only
+            checkpoints saved with `metric` are ranked.
+        keep_last:
+            Number of latest checkpoints to keep. Set to `0` to keep all
+            checkpoints.
+        resume:
+            Whether training is resumed from checkpoints in
+            `experiment_dir`. If `True`, existing complete checkpoints are
+            kept or deleted as if they were saved by this writer.
+
+    Raises:
+        ValueError:
+            If `max_pending` is smaller than `1`, or `keep_best` or
+            `keep_last` is smaller than `0`.
+    """
+
+    def __init__(
+            self,
+            experiment_dir: str,
+            max_pending: int = 2,
+            keep_best: int = 0,
+            keep_last: int = 0,
+            resume: bool = False
+    ):
+        if max_pending < 1:
+            raise ValueError(
+                '`max_pending` must be bigger than or equal to `1`.'
+            )
+
+        if keep_best < 0:
+            raise ValueError(
+                '`keep_best` must be bigger than or equal to `0`.'
+            )
+
+        if keep_last < 0:
+            raise ValueError(
+                '`keep_last` must be bigger than or equal to `0`.'
+            )
+
+        self.experiment_dir = experiment_dir
+        self.keep_best = keep_best
+        self.keep_last = keep_last
+
+        # Managed complete checkpoints in ascending order of step, and their
+        # accuracy.
+        self.steps: List[int] = []
+        self.metrics: Dict[int, float] = {}
+        if resume:
+            self.steps = list_steps(experiment_dir)
+            self.metrics = {
+                step: metric
+                for step, metric in load_metrics(experiment_dir).items()
+                if step in self.steps
+            }
+
+        # Accuracy of checkpoints not managed by this writer, written back
+        # together with managed ones.
+        self.other_metrics: Dict[int, float] = {}
+        if not resume:
+            self.other_metrics = load_metrics(experiment_dir)
+
+        self.error: Optional[BaseException] = None
+        self.pending = threading.Semaphore(max_pending)
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._run,
+            name='checkpoint-writer',
+            daemon=True
+        )
+        self.thread.start()
+
+    def _run(self) -> None:
+        r"""Write queued checkpoints until `None` is received."""
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                step, metric, files = item
+                for path, obj in files:
+                    tmp_path = f'{path}.tmp-{os.getpid()}'
+                    torch.save(obj, tmp_path)
+                    os.replace(tmp_path, path)
+                logger.info('Save checkpoint %s.', files[-1][0])
+                self._retain(step=step, metric=metric)
+            except BaseException as error:
+                # Keep the first error, raised on caller thread later.
+                if self.error is None:
+                    self.error = error
+            finally:
+                if item is not None:
+                    self.pending.release()
+                self.queue.task_done()
+
+    def _retain(self, step: int, metric: Optional[float]) -> None:
+        r"""Record new checkpoint and delete checkpoints not kept.
+
+        Args:
+            step:
+                Step of checkpoint just written.
+            metric:
+                Accuracy of checkpoint just written.
+        """
+        # Checkpoint of the same step is overwritten.
+        if step not in self.steps:
+            bisect.insort(self.steps, step)
+        stale = self.other_metrics.pop(step, None) is not None
+        if metric is not None:
+            self.metrics[step] = metric
+        elif (
+                self.metrics.pop(step, None) is None and
+                not stale and
+                not self.keep_last
+        ):
+            # Nothing to record.
+            return
+
+        if self.keep_last:
+            # Ties are broken by earlier step.
+            best = sorted(
+                self.metrics,
+                key=lambda ckpt: (-self.metrics[ckpt], ckpt)
+            )[:self.keep_best]
+            keep = set(self.steps[-self.keep_last:]) | set(best)
+
+            for ckpt in [ckpt for ckpt in self.steps if ckpt not in keep]:
+                # Delete model file first, so that a partially deleted
+                # checkpoint is never treated as complete.
+                for path in [
+                        model_path(self.experiment_dir, ckpt),
+                        state_path(self.experiment_dir, ckpt),
+                ]:
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.steps.remove(ckpt)
+                self.metrics.pop(ckpt, None)
+                logger.info('Delete checkpoint of step %d.', ckpt)
+
+        path = metric_path(self.experiment_dir)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as json_file:
+            json.dump(
+                {
+                    str(ckpt): value
+                    for ckpt, value in sorted(
+                        {**self.other_metrics, **self.metrics}.items()
+                    )
+                },
+                json_file
+            )
+        os.replace(tmp_path, path)
+
+    def _raise_error(self) -> None:
+        r"""Re-raise error occurred on background thread.
+
+        Raises:
+            RuntimeError:
+                When some checkpoint failed to be written.
+        """
+        if self.error is not None:
+            raise RuntimeError(
+                'Failed to write checkpoint.'
+            ) from self.error
+
+    def save(
+            self,
+            model: nn.Module,
+            step: int,
+            optimizer: Optional[torch.optim.Optimizer] = None,
+            scaler: Optional[torch.amp.GradScaler] = None,
+            scheduler: Optional[torch.optim.lr_scheduler.LambdaLR] = None,
+            sampler_state: Optional[Dict[str, int]] = None,
+            metric: Optional[float] = None
+    ) -> None:
+        r"""Snapshot states to CPU and queue them for writing.
+
+        Random states are captured on the calling thread together with
+        training states.
+
+        Args:
+            model:
+                Model to be saved. Unwrap `DistributedDataParallel` before
+                passing in so that saved keys have no `module.` prefix.
+            step:
+                Current training step.
+            optimizer:
+                Optimizer of `model`. Training states are not saved if
+                `None`.
+            scaler:
+                Gradient scaler used with `optimizer`.
+            scheduler:
+                Learning rate scheduler of `optimizer`.
+            sampler_state:
+                Position of data sampler, see
+                `fine_tune.task.BucketBatchSampler.state_dict`.
+            metric:
+                Accuracy of `model` on evaluation dataset, used to select the
+                best checkpoints. Higher is better.
+
+        Raises:
+            RuntimeError:
+                When some previous checkpoint failed to be written.
+        """
+        self._raise_error()
+
+        # Bound number of snapshots held in memory.
+        self.pending.acquire()
+
+        files: List[Tuple[str, Any]] = []
+        if optimizer is not None:
+            files.append((
+                state_path(self.experiment_dir, step),
+                {
+                    'optimizer': snapshot(optimizer.state_dict()),
+                    'scaler': (
+                        None if scaler is None
+                        else snapshot(scaler.state_dict())
+                    ),
+                    'scheduler': (
+                        None if scheduler is None
+                        else snapshot(scheduler.state_dict())
+                    ),
+                    'rng': snapshot(get_rng_state()),
+                    'sampler': sampler_state,
+                    'step': step,
+                },
+            ))
+
+        # Model file is written last, see module docstring.
+        files.append((
+            model_path(self.experiment_dir, step),
+            snapshot(model.state_dict()),
+        ))
+
+        self.queue.put((step, metric, files))
+
+    def wait(self) -> None:
+        r"""Block until all queued checkpoints are written.
+
+        Raises:
+            RuntimeError:
+                When some checkpoint failed to be written.
+        """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        r"""Write all queued checkpoints and stop background thread.
+
+        Raises:
+            RuntimeError:
+                When some checkpoint failed to be written.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
@@ -0,0 +1,139 @@
+r"""Helper functions for creating dataloader.
+
+Mini-batches are gathered and padded by `torch.utils.data.DataLoader`
+workers, thus training loop only receives ready tensors.
+
+Usage:
+    import fine_tune
+
+    dataloader = fine_tune.util.load_dataloader(...)
+    dataloader = fine_tune.util.load_dataloader_by_config(...)
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+# 3rd party modules
+
+import torch
+import torch.utils
+import torch.utils.data
+
+# my own modules
+
+import fine_tune.config
+
+
+def load_dataloader(
+        collate_fn: Callable[[List[Any]], Any],
+        dataset: torch.utils.data.Dataset,
+        device: torch.device,
+        num_workers: int,
+        persistent_workers: bool,
+        pin_memory: bool,
+        prefetch_factor: int,
+        batch_sampler: Optional[Iterable[List[int]]] = None,
+        batch_size: int = 1
+) -> torch.utils.data.DataLoader:
+    r"""Create dataloader with worker settings.
+
+    Args:
+        collate_fn:
+            Function gathering a list of samples into tensors. `collate_fn`
+            runs in worker processes when `num_workers > 0`.
+        dataset:
+            Dataset to load from.
+        device:
+            Device which consumes mini-batches. Memory pinning is only
+            enabled on CUDA device.
+        num_workers:
+            Number of worker processes. Set to `0` to load data in main
+            process.
+        persistent_workers:
+            Keep workers alive across epochs. Only used when
+            `num_workers > 0`.
+        pin_memory:
+            Gather mini-batches into page-locked memory.
+        prefetch_factor:
+            Number of mini-batches loaded in advance by each worker. Only used
+            when `num_workers > 0`.
+        batch_sampler:
+            Sampler yielding sample indices of each mini-batch. When given,
+            `batch_size` is ignored.
+        batch_size:
+            Number of samples in each mini-batch. Samples are loaded in order.
+
+    Returns:
+        `torch.utils.data.DataLoader` instance.
+    """
+    kwargs = {}
+    if num_workers > 0:
+        kwargs['persistent_workers'] = persistent_workers
+        kwargs['prefetch_factor'] = prefetch_factor
+
+    if batch_sampler is None:
+        kwargs['batch_size'] = batch_size
+        kwargs['shuffle'] = False
+    else:
+        kwargs['batch_sampler'] = batch_sampler
+
+    return torch.utils.data.DataLoader(
+        dataset,
+        collate_fn=collate_fn,
+        num_workers=num_workers,
+        pin_memory=pin_memory and device.type == 'cuda',
+        **kwargs
+    )
+
+
+def load_dataloader_by_config(
+        collate_fn: Callable[[List[Any]], Any],
+        config: fine_tune.config.BaseConfig,
+        dataset: torch.utils.data.Dataset,
+        batch_sampler: Optional[Iterable[List[int]]] = None,
+        batch_size: int = 1,
+        device: Optional[torch.device] = None
+) -> torch.utils.data.DataLoader:
+    r"""Create dataloader with worker settings.
+
+    Args:
+        collate_fn:
+            Function gathering a list of samples into tensors.
+        config:
+            Configuration object which contains attributes `device`,
+            `num_workers`, `persistent_workers`, `pin_memory` and
+            `prefetch_factor`.
+        dataset:
+            Dataset to load from.
+        batch_sampler:
+            Sampler yielding sample indices of each mini-batch.
+        batch_size:
+            Number of samples in each mini-batch. Only used when
+            `batch_sampler` is `None`.
+        device:
+            Device which consumes mini-batches. Default to `config.device`.
+
+    Returns:
+        Same as `fine_tune.util.load_dataloader`.
+    """
+    return load_dataloader(
+        collate_fn=collate_fn,
+        dataset=dataset,
+        device=config.device if device is None else device,
+        num_workers=config.num_workers,
+        persistent_workers=config.persistent_workers,
+        pin_memory=config.pin_memory,
+        prefetch_factor=config.prefetch_factor,
+        batch_sampler=batch_sampler,
+        batch_size=batch_size
+    )
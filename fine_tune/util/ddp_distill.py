@@ -0,0 +1,733 @@
+r"""Helper functions for distributed data parallel distillation.
+
+Each process trains a student replica on disjoint groups of samples drawn by
+`fine_tune.task.BucketBatchSampler`. Teacher outputs are read from a shared
+on-disk `fine_tune.task.TeacherStore`, which is memory-mapped by every
+process, thus no teacher model runs during distillation and adding replicas
+scales throughput nearly linearly. Only rank `0` writes logs and
+checkpoints, while throughput of every rank is logged.
+
+Usage:
+    import fine_tune
+
+    fine_tune.util.launch_ddp_distill(
+        ckpt=ckpt,
+        student_config=student_config,
+        teacher_config=teacher_config,
+        world_size=4,
+        backend='gloo'
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import logging
+import os
+import time
+
+from typing import Optional
+
+# 3rd party modules
+
+import numpy as np
+import torch
+import torch.distributed
+import torch.multiprocessing
+import torch.nn.parallel
+import torch.utils
+import torch.utils.data
+import torch.utils.tensorboard
+import transformers
+
+from tqdm import tqdm
+
+# my own modules
+
+import fine_tune.config
+import fine_tune.task
+import fine_tune.model
+import fine_tune.objective
+import fine_tune.path
+import fine_tune.util.amp
+import fine_tune.util.checkpoint
+import fine_tune.util.dataloader
+import fine_tune.util.model
+import fine_tune.util.optimizer
+import fine_tune.util.scheduler
+import fine_tune.util.seed
+import fine_tune.util.task
+import fine_tune.util.teacher_store
+import fine_tune.util.token_cache
+import fine_tune.util.tokenizer
+
+from fine_tune.util.ddp_train import free_port
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+
+def ddp_distill(
+        student_config: fine_tune.config.StudentConfig,
+        dataset: fine_tune.task.Dataset,
+        student_model: fine_tune.model.StudentModel,
+        optimizer: torch.optim.AdamW,
+        scheduler: torch.optim.lr_scheduler.LambdaLR,
+        student_tokenizer: transformers.PreTrainedTokenizerBase,
+        teacher_store: fine_tune.task.TeacherStore,
+        use_logits_loss: bool = True,
+        use_hidden_loss: bool = True,
+        use_attn_loss: bool = True
+):
+    r"""Distill teacher store into student with distributed data parallel.
+
+    Default process group must be initialized by
+    `torch.distributed.init_process_group` before calling this function.
+    Each replica performs optimizer step on `student_config.batch_size`
+    samples, thus effective batch size is
+    `student_config.batch_size * world_size`. Automatic mixed precision is
+    enabled by `student_config.amp`.
+
+    Args:
+        student_config:
+            `fine_tune.config.StudentConfig` class which attributes are used
+            for experiment setup. `student_config.device` is the device of
+            current replica.
+        dataset:
+            Task specific dataset.
+        student_model:
+            Model which will perform disitllation according to teacher
+            outputs. `student_model` must already be on
+            `student_config.device`.
+        optimizer:
+            `torch.optim.AdamW` optimizer of `student_model`.
+        schduler:
+            Linear warmup scheduler provided by `transformers` package.
+        student_tokenizer:
+            Tokenizer paired with `student_model`.
+        teacher_store:
+            Offline teacher outputs dumped by
+            `fine_tune.util.dump_teacher_store`.
+    """
+    rank = torch.distributed.get_rank()
+    world_size = torch.distributed.get_world_size()
+
+    # Model running device.
+    device = student_config.device
+
+    # Wrap model. Parameters are broadcasted from rank 0. Pooler and
+    # classifier get no gradient without logits loss.
+    student_model = torch.nn.parallel.DistributedDataParallel(
+        student_model,
+        device_ids=[device] if device.type == 'cuda' else None,
+        find_unused_parameters=not use_logits_loss
+    )
+
+    # Set student model as training mode.
+    student_model.train()
+
+    # Create a GradScalaer. It is a no-op on CPU.
+    scaler = fine_tune.util.amp.grad_scaler(
+        device=device,
+        enabled=student_config.amp
+    )
+
+    # Clean all gradient.
+    optimizer.zero_grad()
+
+    # Get experiment name and path for student model.
+    experiment_name = fine_tune.config.BaseConfig.experiment_name(
+        experiment=student_config.experiment,
+        model=student_config.model,
+        task=student_config.task
+    )
+    experiment_dir = os.path.join(
+        fine_tune.path.FINE_TUNE_EXPERIMENT,
+        experiment_name
+    )
+
+    # Write checkpoints on background thread. Only rank 0 saves checkpoints.
+    # Only keep the latest and the most accurate checkpoints when
+    # `student_config.keep_last > 0`.
+    ckpt_writer = None
+    if rank == 0:
+        ckpt_writer = fine_tune.util.checkpoint.CheckpointWriter(
+            experiment_dir,
+            keep_best=student_config.keep_best,
+            keep_last=student_config.keep_last
+        )
+
+    # Load dataset evaluated at every checkpoint. Each replica evaluates its
+    # own share of the dataset.
+    eval_config, eval_dataset = (
+        fine_tune.util.checkpoint.load_eval_dataset_by_config(
+            config=student_config
+        )
+    )
+
+    # Load tokenized dataset cache of student. Let rank 0 build cache first
+    # so that replicas never build the same cache concurrently.
+    if rank != 0:
+        torch.distributed.barrier()
+    student_cache = fine_tune.util.token_cache.load_token_cache_by_config(
+        config=student_config,
+        dataset=dataset,
+        tokenizer=student_tokenizer
+    )
+    if eval_dataset is not None:
+        fine_tune.util.token_cache.load_token_cache_by_config(
+            config=eval_config,
+            dataset=eval_dataset,
+            tokenizer=student_tokenizer
+        )
+    if rank == 0:
+        torch.distributed.barrier()
+
+    # Teacher layers paired with each student layer.
+    hidden_layers, attn_layers = fine_tune.util.teacher_store.distill_layers(
+        num_student_layers=student_config.num_hidden_layers,
+        num_teacher_layers=teacher_store.num_hidden_layers
+    )
+    if not use_hidden_loss:
+        hidden_layers = []
+    if not use_attn_loss:
+        attn_layers = []
+
+    # Student layers paired with teacher layers. Skip embedding output.
+    student_hidden_layers = list(
+        range(1, student_config.num_hidden_layers + 1)
+    )[:len(hidden_layers)]
+    student_attn_layers = list(
+        range(student_config.num_hidden_layers)
+    )[:len(attn_layers)]
+
+    # Each replica draws disjoint groups of the same shuffled epoch.
+    # Both teacher and student inputs are padded to the longer one.
+    sampler = fine_tune.task.BucketBatchSampler(
+        accum_step=student_config.accum_step,
+        batch_size=student_config.batch_size // student_config.accum_step,
+        bucket_size=student_config.bucket_size,
+        lengths=np.maximum(teacher_store.lengths, student_cache.lengths),
+        drop_last=True,
+        max_seq_len=student_config.max_seq_len,
+        max_tokens_per_batch=student_config.max_tokens_per_batch,
+        num_replicas=world_size,
+        pad_to_multiple_of=student_config.pad_to_multiple_of,
+        padding=student_config.padding,
+        rank=rank,
+        seed=student_config.seed
+    )
+    if rank == 0:
+        logger.info('Padding efficiency: %.4f', sampler.padding_efficiency())
+
+    # Teacher outputs are gathered from store by sample index.
+    dataloader = fine_tune.util.dataloader.load_dataloader_by_config(
+        collate_fn=fine_tune.task.TeacherStore.create_pair_collate_fn(
+            teacher_store=teacher_store,
+            student_cache=student_cache,
+            attn_layers=attn_layers,
+            hidden_layers=hidden_layers,
+            padding=student_config.padding,
+            pad_to_multiple_of=student_config.pad_to_multiple_of
+        ),
+        config=student_config,
+        dataset=student_cache,
+        batch_sampler=sampler
+    )
+
+    # Create objective function.
+    objective = fine_tune.objective.distill_objective
+
+    # Create adaptive layer.
+    # Transform dimension of student hidden states as teacher's.
+    # Adaptive layers are fixed random projections shared by all replicas.
+    adaptive_layers = []
+    for _ in range(student_config.num_hidden_layers):
+        adaptive_layer = torch.nn.Linear(
+            in_features=student_config.d_model,
+            out_features=teacher_store.hidden_size
+        ).to(device)
+        for param in adaptive_layer.parameters():
+            torch.distributed.broadcast(param.data, src=0)
+            param.requires_grad_(False)
+        adaptive_layers.append(adaptive_layer)
+
+    # Only rank 0 writes logs.
+    writer = None
+    cli_logger = None
+    if rank == 0:
+        # Create tensorboard's `SummaryWriter`.
+        writer = torch.utils.tensorboard.SummaryWriter(
+            os.path.join(
+                fine_tune.path.LOG,
+                experiment_name
+            )
+        )
+
+        # `tqdm` CLI Logger. We will manually update progress bar.
+        cli_logger = tqdm(
+            desc=f'loss: {0:.6f}',
+            total=student_config.total_step
+        )
+
+    def eval_step(step):
+        # Evaluate checkpoint on `student_config.eval_dataset` and log
+        # accuracy. All replicas must call together.
+        if eval_dataset is None:
+            return None
+
+        acc = fine_tune.util.checkpoint.eval_checkpoint(
+            config=eval_config,
+            dataset=eval_dataset,
+            model=student_model.module,
+            tokenizer=student_tokenizer,
+            num_replicas=world_size,
+            rank=rank
+        )
+        if rank == 0:
+            writer.add_scalar(
+                f'{student_config.task}/{student_config.eval_dataset}'
+                '/accuracy',
+                acc,
+                step
+            )
+        return acc
+
+    # Step and accumulation sample counter. Number of mini-batches in each
+    # step varies when `student_config.max_tokens_per_batch > 0`, thus we
+    # count samples instead of mini-batches.
+    step = 0
+    accum_sample = 0
+
+    # Mini-batch loss and accmulate loss.
+    # Update when accumulate to `config.batch_size`.
+    # For CLI and tensorboard logger.
+    loss = 0
+    logits_loss = 0
+    hidden_loss = 0
+    attn_loss = 0
+
+    # Number of samples and real tokens since last throughput log.
+    num_sample = 0
+    num_token = 0
+    start = time.perf_counter()
+
+    # Total update times: `student_config.total_step`
+    while step < student_config.total_step:
+
+        # Mini-batch loop.
+        for (
+                (teacher_logits, teacher_hiddens, teacher_attns),
+                (
+                    student_input_ids,
+                    student_attention_mask,
+                    student_token_type_ids
+                ),
+                label
+        ) in dataloader:
+
+            # Only all-reduce gradients on the last mini-batch of each
+            # optimizer step. `no_sync` must cover both forward and backward
+            # pass.
+            is_last = accum_sample + label.size(0) >= sampler.group_size
+            if is_last:
+                sync_context = contextlib.nullcontext()
+            else:
+                sync_context = student_model.no_sync()
+
+            # Weight of mini-batch in current optimizer step.
+            weight = label.size(0) / sampler.group_size
+
+            with sync_context:
+                with fine_tune.util.amp.autocast(
+                        device=device,
+                        enabled=student_config.amp
+                ):
+                    # Get output logits, hidden states and attentions from
+                    # student.
+                    student_logits, student_hiddens, student_attns = student_model(
+                        input_ids=student_input_ids.to(device),
+                        token_type_ids=student_token_type_ids.to(device),
+                        attention_mask=student_attention_mask.to(device),
+                        attn_layers=student_attn_layers,
+                        hidden_layers=student_hidden_layers,
+                        attn_log_prob=True
+                    )
+
+                    # Combine all loss terms into one loss.
+                    batch_loss, breakdown = objective(
+                        hard_target=label,
+                        student_outputs=(
+                            student_logits,
+                            student_hiddens,
+                            student_attns
+                        ),
+                        teacher_outputs=(
+                            teacher_logits,
+                            teacher_hiddens,
+                            teacher_attns
+                        ),
+                        adaptive_layers=adaptive_layers,
+                        attn_weight=float(use_attn_loss),
+                        hidden_weight=float(use_hidden_loss),
+                        logits_weight=float(use_logits_loss)
+                    )
+
+                    # Normalize loss.
+                    batch_loss = batch_loss * weight
+
+                # Accumulate gradients. All-reduce overlaps with backward
+                # pass when `is_last`.
+                scaler.scale(batch_loss).backward()
+
+            # Log loss.
+            logits_loss += breakdown['logits'].item() * weight
+            hidden_loss += breakdown['hidden'].item() * weight
+            attn_loss += breakdown['attn'].item() * weight
+            loss += batch_loss.item()
+
+            # Count throughput.
+            num_sample += label.size(0)
+            num_token += int(student_attention_mask.sum().item())
+
+            # Increment accumulation sample.
+            accum_sample += label.size(0)
+
+            # Perform gradient descend when achieve actual mini-batch size.
+            if accum_sample >= sampler.group_size:
+                accum_sample = 0
+
+                # Unscale the gradient by optimizer.
+                scaler.unscale_(optimizer)
+
+                # Gradient clipping. Gradients are identical across
+                # replicas after all-reduce.
+                torch.nn.utils.clip_grad_norm_(
+                    student_model.parameters(),
+                    student_config.max_norm
+                )
+
+                # Gradient descend.
+                scaler.step(optimizer)
+
+                # Updates the scale for next iteration.
+                scaler.update()
+
+                # Update learning rate.
+                scheduler.step()
+
+                # Increment actual step.
+                step += 1
+
+                # Log on CLI.
+                if rank == 0:
+                    cli_logger.update()
+                    cli_logger.set_description(
+                        f'loss: {loss:.6f} ' +
+                        f'logits_loss: {logits_loss:.6f} ' +
+                        f'hidden_loss: {hidden_loss:.6f} ' +
+                        f'attn_loss: {attn_loss:.6f}'
+                    )
+
+                # Log average loss of all replicas, learning rate and
+                # throughput of each replica for each `student_config.log_step`.
+                if step % student_config.log_step == 0:
+                    elapsed = time.perf_counter() - start
+
+                    # `stats.size == (world_size, 6)`.
+                    stats = torch.zeros(world_size, 6, device=device)
+                    stats[rank] = torch.tensor(
+                        [
+                            loss,
+                            logits_loss,
+                            hidden_loss,
+                            attn_loss,
+                            num_sample / elapsed,
+                            num_token / elapsed,
+                        ],
+                        device=device
+                    )
+                    torch.distributed.all_reduce(stats)
+                    stats = stats.cpu()
+
+                    if rank == 0:
+                        prefix = (
+                            f'{student_config.task}/{student_config.dataset}/' +
+                            f'{student_config.model}'
+                        )
+                        avg_stats = stats[:, :4].mean(dim=0).tolist()
+                        for name, value in zip(
+                                ('loss', 'logits_loss', 'hidden_loss', 'attn_loss'),
+                                avg_stats
+                        ):
+                            writer.add_scalar(f'{prefix}/{name}', value, step)
+                        writer.add_scalar(
+                            f'{prefix}/lr',
+                            optimizer.state_dict()['param_groups'][0]['lr'],
+                            step
+                        )
+
+                        for replica in range(world_size):
+                            sample_per_sec, token_per_sec = (
+                                stats[replica, 4:].tolist()
+                            )
+                            writer.add_scalar(
+                                f'{prefix}/throughput/rank-{replica}',
+                                sample_per_sec,
+                                step
+                            )
+                            logger.info(
+                                'Step %d rank %d: %.1f samples/s, ' +
+                                '%.1f tokens/s.',
+                                step,
+                                replica,
+                                sample_per_sec,
+                                token_per_sec
+                            )
+                        writer.add_scalar(
+                            f'{prefix}/throughput/total',
+                            stats[:, 4].sum().item(),
+                            step
+                        )
+
+                    num_sample = 0
+                    num_token = 0
+                    start = time.perf_counter()
+
+                # Clean up mini-batch loss.
+                loss = 0
+                logits_loss = 0
+                hidden_loss = 0
+                attn_loss = 0
+
+                # Clean up gradient.
+                optimizer.zero_grad()
+
+                # Save checkpoint for each `student_config.ckpt_step` step.
+                if step % student_config.ckpt_step == 0:
+                    acc = eval_step(step)
+                    if rank == 0:
+                        ckpt_writer.save(
+                            model=student_model.module,
+                            optimizer=optimizer,
+                            scaler=scaler,
+                            scheduler=scheduler,
+                            step=step,
+                            metric=acc
+                        )
+
+            # Stop training condition.
+            if step >= student_config.total_step:
+                break
+
+    # Evaluate the latest checkpoint if it was not saved in loop.
+    acc = None
+    if step % student_config.ckpt_step != 0:
+        acc = eval_step(step)
+
+    if rank == 0:
+        # Save the latest checkpoint if it was not saved in loop.
+        if step % student_config.ckpt_step != 0:
+            ckpt_writer.save(
+                model=student_model.module,
+                optimizer=optimizer,
+                scaler=scaler,
+                scheduler=scheduler,
+                step=step,
+                metric=acc
+            )
+
+        # Release IO resources.
+        writer.flush()
+        writer.close()
+        cli_logger.close()
+
+        # Wait for all checkpoints written.
+        ckpt_writer.close()
+
+    # Wait for rank 0 to finish saving.
+    torch.distributed.barrier()
+
+
+def ddp_distill_worker(
+        rank: int,
+        ckpt: int,
+        student_config: fine_tune.config.StudentConfig,
+        teacher_config: fine_tune.config.TeacherConfig,
+        world_size: int,
+        backend: str,
+        init_method: str,
+        use_logits_loss: bool,
+        use_hidden_loss: bool,
+        use_attn_loss: bool
+):
+    r"""Entry point of each distributed data parallel distillation process.
+
+    Load dataset, teacher tokenizer, teacher store, student tokenizer,
+    student model, optimizer and scheduler by configurations and call
+    `fine_tune.util.ddp_distill`.
+    Replica of rank `r` runs on CPU if `student_config.device_id == -1`,
+    otherwise on CUDA device `student_config.device_id + r`.
+
+    Args:
+        rank:
+            Rank of current process.
+        ckpt:
+            Checkpoint of teacher model whose outputs were dumped into store.
+        student_config:
+            `fine_tune.config.StudentConfig` of distillation experiment.
+        teacher_config:
+            `fine_tune.config.TeacherConfig` of fine-tuned teacher model.
+        world_size:
+            Number of processes.
+        backend:
+            `torch.distributed` backend, e.g., `'gloo'` or `'nccl'`.
+        init_method:
+            URL used to initialize process group.
+    """
+    torch.distributed.init_process_group(
+        backend=backend,
+        init_method=init_method,
+        rank=rank,
+        world_size=world_size
+    )
+
+    try:
+        # Each replica runs on its own device.
+        if student_config.device_id != -1:
+            student_config.device_id = student_config.device_id + rank
+            torch.cuda.set_device(student_config.device)
+
+        # Same seed on all replicas so that sampler agrees on permutation.
+        fine_tune.util.seed.set_seed_by_config(config=student_config)
+
+        # Load distillation dataset.
+        dataset = fine_tune.util.task.load_dataset_by_config(
+            config=teacher_config
+        )
+
+        # Read teacher outputs from shared store. Teacher tokenizer is only
+        # used to check that store was dumped with it.
+        teacher_tokenizer = fine_tune.util.tokenizer.load_teacher_tokenizer_by_config(
+            config=teacher_config
+        )
+        teacher_store = fine_tune.util.teacher_store.load_teacher_store_by_config(
+            ckpt=ckpt,
+            config=teacher_config,
+            tokenizer=teacher_tokenizer
+        )
+
+        # Load student tokenizer and model.
+        student_tokenizer = fine_tune.util.tokenizer.load_student_tokenizer_by_config(
+            config=student_config
+        )
+        student_model = fine_tune.util.model.load_student_model_by_config(
+            config=student_config,
+            tokenizer=student_tokenizer
+        )
+
+        # Load optimizer.
+        optimizer = fine_tune.util.optimizer.load_optimizer_by_config(
+            config=student_config,
+            model=student_model
+        )
+
+        # Load scheduler.
+        scheduler = fine_tune.util.scheduler.load_scheduler_by_config(
+            config=student_config,
+            optimizer=optimizer
+        )
+
+        # Use different dropout masks on each replica.
+        torch.manual_seed(student_config.seed + rank)
+
+        start = time.perf_counter()
+        ddp_distill(
+            student_config=student_config,
+            dataset=dataset,
+            student_model=student_model,
+            optimizer=optimizer,
+            scheduler=scheduler,
+            student_tokenizer=student_tokenizer,
+            teacher_store=teacher_store,
+            use_logits_loss=use_logits_loss,
+            use_hidden_loss=use_hidden_loss,
+            use_attn_loss=use_attn_loss
+        )
+        logger.info(
+            'Rank %d finished %d steps in %.2f seconds.',
+            rank,
+            student_config.total_step,
+            time.perf_counter() - start
+        )
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+def launch_ddp_distill(
+        ckpt: int,
+        student_config: fine_tune.config.StudentConfig,
+        teacher_config: fine_tune.config.TeacherConfig,
+        world_size: int,
+        backend: str = 'gloo',
+        init_method: Optional[str] = None,
+        use_logits_loss: bool = True,
+        use_hidden_loss: bool = True,
+        use_attn_loss: bool = True
+):
+    r"""Spawn `world_size` processes to distill from shared teacher store.
+
+    Teacher store must be dumped beforehand by
+    `fine_tune.util.dump_teacher_store`.
+
+    Args:
+        ckpt:
+            Checkpoint of teacher model whose outputs were dumped into store.
+        student_config:
+            `fine_tune.config.StudentConfig` of distillation experiment.
+        teacher_config:
+            `fine_tune.config.TeacherConfig` of fine-tuned teacher model.
+        world_size:
+            Number of processes. `world_size` must be bigger than or equal to
+            `1`.
+        backend:
+            `torch.distributed` backend. Use `'gloo'` for CPU and `'nccl'`
+            for GPU.
+        init_method:
+            URL used to initialize process group. Use a free localhost TCP
+            port if `None`.
+
+    Raises:
+        ValueError:
+            If `world_size < 1`.
+    """
+    if world_size < 1:
+        raise ValueError(
+            '`world_size` must be bigger than or equal to `1`.'
+        )
+
+    if init_method is None:
+        init_method = f'tcp://127.0.0.1:{free_port()}'
+
+    torch.multiprocessing.spawn(
+        ddp_distill_worker,
+        args=(
+            ckpt,
+            student_config,
+            teacher_config,
+            world_size,
+            backend,
+            init_method,
+            use_logits_loss,
+            use_hidden_loss,
+            use_attn_loss,
+        ),
+        nprocs=world_size,
+        join=True
+    )
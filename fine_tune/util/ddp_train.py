@@ -0,0 +1,562 @@
+r"""Helper functions for distributed data parallel training.
+
+Each process trains a replica of the model on disjoint groups of samples
+drawn by `fine_tune.task.BucketBatchSampler`. Gradients are all-reduced by
+`torch.nn.parallel.DistributedDataParallel` while backward pass is still
+running. Mini-batches accumulated into the same optimizer step skip
+all-reduce by `no_sync` except the last one. Only rank `0` writes logs and
+checkpoints.
+
+`gloo` backend runs on CPU, thus training can be tested with several worker
+processes on a machine without GPU. Use `nccl` backend for GPU training.
+
+Usage:
+    import fine_tune
+
+    fine_tune.util.launch_ddp_train(
+        config=config,
+        world_size=4,
+        backend='gloo'
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import logging
+import os
+import socket
+import time
+
+from typing import Optional
+
+# 3rd party modules
+
+import torch
+import torch.distributed
+import torch.multiprocessing
+import torch.nn as nn
+import torch.nn.parallel
+import torch.utils
+import torch.utils.data
+import torch.utils.tensorboard
+import transformers
+
+from tqdm import tqdm
+
+# my own modules
+
+import fine_tune.config
+import fine_tune.task
+import fine_tune.model
+import fine_tune.path
+import fine_tune.util.amp
+import fine_tune.util.checkpoint
+import fine_tune.util.dataloader
+import fine_tune.util.model
+import fine_tune.util.optimizer
+import fine_tune.util.scheduler
+import fine_tune.util.seed
+import fine_tune.util.task
+import fine_tune.util.token_cache
+import fine_tune.util.tokenizer
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+
+def ddp_train(
+        config: fine_tune.config.BaseConfig,
+        dataset: fine_tune.task.Dataset,
+        model: fine_tune.model.Model,
+        optimizer: torch.optim.AdamW,
+        scheduler: torch.optim.lr_scheduler.LambdaLR,
+        tokenizer: transformers.PreTrainedTokenizerBase,
+):
+    r"""Fine-tune model with distributed data parallel.
+
+    Default process group must be initialized by
+    `torch.distributed.init_process_group` before calling this function.
+    Each replica performs optimizer step on `config.batch_size` samples,
+    thus effective batch size is `config.batch_size * world_size`.
+    Automatic mixed precision is enabled by `config.amp`.
+
+    Args:
+        config:
+            `fine_tune.config.BaseConfig` subclass which attributes are used
+            for experiment setup. `config.device` is the device of current
+            replica.
+        dataset:
+            Task specific dataset.
+        model:
+            Model which will be fine-tuned on `dataset`. `model` must already
+            be on `config.device`.
+        optimizer:
+            `torch.optim.AdamW` optimizer of `model`.
+        schduler:
+            Linear warmup scheduler provided by `transformers` package.
+        tokenizer:
+            Tokenizer paired with `model`.
+    """
+    rank = torch.distributed.get_rank()
+    world_size = torch.distributed.get_world_size()
+
+    # Model running device.
+    device = config.device
+
+    # Wrap model. Parameters are broadcasted from rank 0.
+    model = nn.parallel.DistributedDataParallel(
+        model,
+        device_ids=[device] if device.type == 'cuda' else None
+    )
+
+    # Training mode.
+    model.train()
+
+    # Creates a GradScaler. It is a no-op on CPU.
+    scaler = fine_tune.util.amp.grad_scaler(
+        device=device,
+        enabled=config.amp
+    )
+
+    # Clean all gradient.
+    optimizer.zero_grad()
+
+    # Get experiment name and path.
+    experiment_name = fine_tune.config.BaseConfig.experiment_name(
+        experiment=config.experiment,
+        model=config.model,
+        task=config.task
+    )
+    experiment_dir = os.path.join(
+        fine_tune.path.FINE_TUNE_EXPERIMENT,
+        experiment_name
+    )
+
+    # Write checkpoints on background thread. Only rank 0 saves checkpoints.
+    # Only keep the latest and the most accurate checkpoints when
+    # `config.keep_last > 0`.
+    ckpt_writer = None
+    if rank == 0:
+        ckpt_writer = fine_tune.util.checkpoint.CheckpointWriter(
+            experiment_dir,
+            keep_best=config.keep_best,
+            keep_last=config.keep_last
+        )
+
+    # Load dataset evaluated at every checkpoint. Each replica evaluates its
+    # own share of the dataset.
+    eval_config, eval_dataset = (
+        fine_tune.util.checkpoint.load_eval_dataset_by_config(
+            config=config
+        )
+    )
+
+    # Load tokenized dataset cache. Let rank 0 build cache first so that
+    # replicas never build the same cache concurrently.
+    if rank != 0:
+        torch.distributed.barrier()
+    cache = fine_tune.util.token_cache.load_token_cache_by_config(
+        config=config,
+        dataset=dataset,
+        tokenizer=tokenizer
+    )
+    if eval_dataset is not None:
+        fine_tune.util.token_cache.load_token_cache_by_config(
+            config=eval_config,
+            dataset=eval_dataset,
+            tokenizer=tokenizer
+        )
+    if rank == 0:
+        torch.distributed.barrier()
+
+    # Each replica draws disjoint groups of the same shuffled epoch.
+    # Drop the last incomplete groups so that all replicas perform the same
+    # number of optimizer steps.
+    sampler = fine_tune.task.BucketBatchSampler(
+        accum_step=config.accum_step,
+        batch_size=config.batch_size // config.accum_step,
+        bucket_size=config.bucket_size,
+        lengths=cache.lengths,
+        drop_last=True,
+        max_seq_len=config.max_seq_len,
+        max_tokens_per_batch=config.max_tokens_per_batch,
+        num_replicas=world_size,
+        pad_to_multiple_of=config.pad_to_multiple_of,
+        padding=config.padding,
+        rank=rank,
+        seed=config.seed
+    )
+    if rank == 0:
+        logger.info('Padding efficiency: %.4f', sampler.padding_efficiency())
+
+    # Create dataloader.
+    dataloader = fine_tune.util.dataloader.load_dataloader_by_config(
+        collate_fn=cache.create_collate_fn(
+            padding=config.padding,
+            pad_to_multiple_of=config.pad_to_multiple_of
+        ),
+        config=config,
+        dataset=cache,
+        batch_sampler=sampler
+    )
+
+    # Only rank 0 writes logs.
+    writer = None
+    cli_logger = None
+    if rank == 0:
+        # Create tensorboard's `SummaryWriter`.
+        writer = torch.utils.tensorboard.SummaryWriter(
+            os.path.join(
+                fine_tune.path.LOG,
+                experiment_name
+            )
+        )
+
+        # `tqdm` CLI Logger. We will manually update progress bar.
+        cli_logger = tqdm(
+            desc=f'loss: {0:.6f}',
+            total=config.total_step
+        )
+
+    def eval_step(step):
+        # Evaluate checkpoint on `config.eval_dataset` and log accuracy.
+        # All replicas must call together.
+        if eval_dataset is None:
+            return None
+
+        acc = fine_tune.util.checkpoint.eval_checkpoint(
+            config=eval_config,
+            dataset=eval_dataset,
+            model=model.module,
+            tokenizer=tokenizer,
+            num_replicas=world_size,
+            rank=rank
+        )
+        if rank == 0:
+            writer.add_scalar(
+                f'{config.task}/{config.eval_dataset}/accuracy',
+                acc,
+                step
+            )
+        return acc
+
+    # Use cross-entropy as objective.
+    objective = nn.CrossEntropyLoss()
+
+    # Step and accumulation sample counter. Number of mini-batches in each
+    # step varies when `config.max_tokens_per_batch > 0`, thus we count
+    # samples instead of mini-batches.
+    step = 0
+    accum_sample = 0
+
+    # Mini-batch loss and accumulate loss.
+    # Update when accumulate to `config.batch_size`.
+    loss = 0
+    accum_loss = 0
+
+    # Total update times: `config.total_step`.
+    while step < config.total_step:
+
+        # Mini-batch loop.
+        for (
+                input_ids,
+                attention_mask,
+                token_type_ids,
+                label
+        ) in dataloader:
+
+            # Only all-reduce gradients on the last mini-batch of each
+            # optimizer step. `no_sync` must cover both forward and backward
+            # pass.
+            is_last = accum_sample + label.size(0) >= sampler.group_size
+            if is_last:
+                sync_context = contextlib.nullcontext()
+            else:
+                sync_context = model.no_sync()
+
+            with sync_context:
+                # Enable autocast.
+                with fine_tune.util.amp.autocast(
+                        device=device,
+                        enabled=config.amp
+                ):
+                    # Accumulate cross-entropy loss.
+                    # Use `model(...)` to do forward pass.
+                    accum_loss = objective(
+                        input=model(
+                            input_ids=input_ids.to(device),
+                            token_type_ids=token_type_ids.to(device),
+                            attention_mask=attention_mask.to(device)
+                        ),
+                        target=label.to(device)
+                    ) * label.size(0) / sampler.group_size
+
+                # Mini-batch cross-entropy loss. Only used as log.
+                loss += accum_loss.item()
+
+                # Accumulate scaled gradients. All-reduce overlaps with
+                # backward pass when `is_last`.
+                scaler.scale(accum_loss).backward()
+
+            # Increment accumulation sample.
+            accum_sample += label.size(0)
+
+            # Perform gradient descend when achieve actual mini-batch size.
+            if accum_sample >= sampler.group_size:
+                accum_sample = 0
+
+                # Unscale the gradient by optimizer.
+                scaler.unscale_(optimizer)
+
+                # Gradient clipping. Gradients are identical across
+                # replicas after all-reduce.
+                torch.nn.utils.clip_grad_norm_(
+                    model.parameters(),
+                    config.max_norm
+                )
+
+                # Gradient descent.
+                scaler.step(optimizer)
+
+                # Updates the scale for next iteration.
+                scaler.update()
+
+                # Update learning rate.
+                scheduler.step()
+
+                # Increment actual step.
+                step += 1
+
+                # Log on CLI.
+                if rank == 0:
+                    cli_logger.update()
+                    cli_logger.set_description(
+                        f'loss: {loss:.6f}'
+                    )
+
+                # Log average loss of all replicas and learning rate for
+                # each `config.log_step` step.
+                if step % config.log_step == 0:
+                    avg_loss = torch.tensor(loss, device=device)
+                    torch.distributed.all_reduce(avg_loss)
+                    avg_loss = avg_loss.item() / world_size
+
+                    if rank == 0:
+                        writer.add_scalar(
+                            f'{config.task}/{config.dataset}/loss',
+                            avg_loss,
+                            step
+                        )
+                        writer.add_scalar(
+                            f'{config.task}/{config.dataset}/lr',
+                            optimizer.state_dict()['param_groups'][0]['lr'],
+                            step
+                        )
+
+                # Clean up mini-batch loss.
+                loss = 0
+
+                # Clean up gradient.
+                optimizer.zero_grad()
+
+                # Save checkpoint for each `config.ckpt_step` step.
+                if step % config.ckpt_step == 0:
+                    acc = eval_step(step)
+                    if rank == 0:
+                        ckpt_writer.save(
+                            model=model.module,
+                            optimizer=optimizer,
+                            scaler=scaler,
+                            scheduler=scheduler,
+                            step=step,
+                            metric=acc
+                        )
+
+            # Stop training condition.
+            if step >= config.total_step:
+                break
+
+    # Evaluate the latest checkpoint if it was not saved in loop.
+    acc = None
+    if step % config.ckpt_step != 0:
+        acc = eval_step(step)
+
+    if rank == 0:
+        # Save the latest checkpoint if it was not saved in loop.
+        if step % config.ckpt_step != 0:
+            ckpt_writer.save(
+                model=model.module,
+                optimizer=optimizer,
+                scaler=scaler,
+                scheduler=scheduler,
+                step=step,
+                metric=acc
+            )
+
+        # Release IO resources.
+        writer.flush()
+        writer.close()
+        cli_logger.close()
+
+        # Wait for all checkpoints written.
+        ckpt_writer.close()
+
+    # Wait for rank 0 to finish saving.
+    torch.distributed.barrier()
+
+
+def free_port() -> int:
+    r"""Find a free TCP port on localhost.
+
+    Returns:
+        Port number which is free at the time of calling.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def ddp_train_worker(
+        rank: int,
+        config: fine_tune.config.BaseConfig,
+        world_size: int,
+        backend: str,
+        init_method: str
+):
+    r"""Entry point of each distributed data parallel training process.
+
+    Load dataset, tokenizer, model, optimizer and scheduler by `config` and
+    call `fine_tune.util.ddp_train`. Replica of rank `r` runs on CPU if
+    `config.device_id == -1`, otherwise on CUDA device
+    `config.device_id + r`.
+
+    Args:
+        rank:
+            Rank of current process.
+        config:
+            `fine_tune.config.TeacherConfig` or
+            `fine_tune.config.StudentConfig`.
+        world_size:
+            Number of processes.
+        backend:
+            `torch.distributed` backend, e.g., `'gloo'` or `'nccl'`.
+        init_method:
+            URL used to initialize process group.
+    """
+    torch.distributed.init_process_group(
+        backend=backend,
+        init_method=init_method,
+        rank=rank,
+        world_size=world_size
+    )
+
+    try:
+        # Each replica runs on its own device.
+        if config.device_id != -1:
+            config.device_id = config.device_id + rank
+            torch.cuda.set_device(config.device)
+
+        # Same seed on all replicas so that sampler agrees on permutation.
+        fine_tune.util.seed.set_seed_by_config(config=config)
+
+        # Load fine-tune dataset.
+        dataset = fine_tune.util.task.load_dataset_by_config(config=config)
+
+        # Load tokenizer and model.
+        if isinstance(config, fine_tune.config.TeacherConfig):
+            tokenizer = fine_tune.util.tokenizer.load_teacher_tokenizer_by_config(
+                config=config
+            )
+            model = fine_tune.util.model.load_teacher_model_by_config(
+                config=config
+            )
+        else:
+            tokenizer = fine_tune.util.tokenizer.load_student_tokenizer_by_config(
+                config=config
+            )
+            model = fine_tune.util.model.load_student_model_by_config(
+                config=config,
+                tokenizer=tokenizer
+            )
+
+        # Load optimizer.
+        optimizer = fine_tune.util.optimizer.load_optimizer_by_config(
+            config=config,
+            model=model
+        )
+
+        # Load scheduler.
+        scheduler = fine_tune.util.scheduler.load_scheduler_by_config(
+            config=config,
+            optimizer=optimizer
+        )
+
+        # Use different dropout masks on each replica.
+        torch.manual_seed(config.seed + rank)
+
+        start = time.perf_counter()
+        ddp_train(
+            config=config,
+            dataset=dataset,
+            model=model,
+            optimizer=optimizer,
+            scheduler=scheduler,
+            tokenizer=tokenizer
+        )
+        logger.info(
+            'Rank %d finished %d steps in %.2f seconds.',
+            rank,
+            config.total_step,
+            time.perf_counter() - start
+        )
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+def launch_ddp_train(
+        config: fine_tune.config.BaseConfig,
+        world_size: int,
+        backend: str = 'gloo',
+        init_method: Optional[str] = None
+):
+    r"""Spawn `world_size` processes to fine-tune with distributed data parallel.
+
+    Args:
+        config:
+            `fine_tune.config.TeacherConfig` or
+            `fine_tune.config.StudentConfig`.
+        world_size:
+            Number of processes. `world_size` must be bigger than or equal to
+            `1`.
+        backend:
+            `torch.distributed` backend. Use `'gloo'` for CPU and `'nccl'`
+            for GPU.
+        init_method:
+            URL used to initialize process group. Use a free localhost TCP
+            port if `None`.
+
+    Raises:
+        ValueError:
+            If `world_size < 1`.
+    """
+    if world_size < 1:
+        raise ValueError(
+            '`world_size` must be bigger than or equal to `1`.'
+        )
+
+    if init_method is None:
+        init_method = f'tcp://127.0.0.1:{free_port()}'
+
+    torch.multiprocessing.spawn(
+        ddp_train_worker,
+        args=(config, world_size, backend, init_method),
+        nprocs=world_size,
+        join=True
+    )
@@ -121,7 +121,7 @@ def load_student_model(
 
 def load_student_model_by_config(
         config: fine_tune.config.StudentConfig,
-        tokenizer: transformers.PreTrainedTokenizer
+        tokenizer: transformers.PreTrainedTokenizerBase
 ) -> fine_tune.model.StudentModel:
     r"""Load student model.
 
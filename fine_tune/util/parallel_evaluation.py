@@ -0,0 +1,295 @@
+r"""Helper functions for evaluating many checkpoints concurrently.
+
+Dataset is tokenized at most once in the calling process. Worker processes
+share the same memory-mapped token cache and each worker loads one
+checkpoint at a time into its own copy of model. Accuracy of each checkpoint
+is yielded as soon as its evaluation finishes.
+
+Usage:
+    import fine_tune
+
+    for ckpt, acc in fine_tune.util.parallel_evaluation(...):
+        ...
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import concurrent.futures
+import copy
+import logging
+import multiprocessing
+import os
+
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# 3rd party modules
+
+import torch
+import transformers
+
+# my own modules
+
+import fine_tune.config
+import fine_tune.task
+import fine_tune.model
+import fine_tune.util.token_cache
+
+from fine_tune.util.amp_evaluation import amp_evaluation
+from fine_tune.util.evaluation import evaluation
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+# States of evaluation worker process, set by `_init_worker`.
+_WORKER = {}
+
+
+def _init_worker(
+        config: fine_tune.config.BaseConfig,
+        cache: fine_tune.task.TokenCache,
+        dataset: fine_tune.task.Dataset,
+        device_ids: multiprocessing.SimpleQueue,
+        experiment_dir: str,
+        model: fine_tune.model.Model,
+        num_threads: int,
+        tokenizer: transformers.PreTrainedTokenizerBase
+) -> None:
+    r"""Take a device and move model onto it in worker process.
+
+    Arguments are the same as `fine_tune.util.parallel_evaluation`, except
+    `device_ids` is a queue which each worker takes one device from, and
+    `num_threads` is number of CPU threads of each worker.
+    """
+    config = copy.deepcopy(config)
+    config.device_id = device_ids.get()
+    torch.set_num_threads(num_threads)
+
+    _WORKER.update(
+        cache=cache,
+        config=config,
+        dataset=dataset,
+        experiment_dir=experiment_dir,
+        model=model.to(config.device),
+        tokenizer=tokenizer
+    )
+
+
+def _eval_ckpt(ckpt: int) -> Tuple[int, float]:
+    r"""Evaluate checkpoint `ckpt` with states of current process.
+
+    Args:
+        ckpt:
+            Checkpoint step.
+
+    Returns:
+        Checkpoint step and its accuracy.
+    """
+    config = _WORKER['config']
+    model = _WORKER['model']
+
+    # Clean all gradient.
+    model.zero_grad()
+
+    # Load model from checkpoint.
+    model.load_state_dict(torch.load(
+        os.path.join(_WORKER['experiment_dir'], f'model-{ckpt}.pt'),
+        map_location=config.device
+    ))
+
+    # Calculate accuracy.
+    eval_fn = amp_evaluation if config.amp else evaluation
+    acc = eval_fn(
+        config=config,
+        dataset=_WORKER['dataset'],
+        model=model,
+        tokenizer=_WORKER['tokenizer'],
+        cache=_WORKER['cache']
+    )
+
+    return ckpt, acc
+
+
+def _peaked(
+        all_ckpts: List[int],
+        results: Dict[int, float],
+        patience: int
+) -> bool:
+    r"""Check whether accuracy stops improving.
+
+    Only consecutive finished checkpoints starting from the earliest one are
+    considered, thus the answer does not depend on finishing order.
+
+    Args:
+        all_ckpts:
+            Checkpoint steps in ascending order.
+        results:
+            Accuracy of each finished checkpoint.
+        patience:
+            Number of checkpoints without improvement to stop at.
+
+    Returns:
+        `True` if `patience` checkpoints after the most accurate one do not
+        improve accuracy.
+    """
+    max_acc = None
+    num_no_improve = 0
+    for ckpt in all_ckpts:
+        if ckpt not in results:
+            break
+        if max_acc is None or max_acc < results[ckpt]:
+            max_acc = results[ckpt]
+            num_no_improve = 0
+        else:
+            num_no_improve += 1
+        if num_no_improve >= patience:
+            return True
+    return False
+
+
+def parallel_evaluation(
+        all_ckpts: List[int],
+        config: fine_tune.config.BaseConfig,
+        dataset: fine_tune.task.Dataset,
+        experiment_dir: str,
+        model: fine_tune.model.Model,
+        tokenizer: transformers.PreTrainedTokenizerBase,
+        device_ids: Optional[List[int]] = None,
+        num_procs: int = 1,
+        patience: int = 0
+) -> Iterator[Tuple[int, float]]:
+    r"""Evaluate checkpoints concurrently on task specific dataset.
+
+    Checkpoints are submitted in ascending order. Worker `i` runs on device
+    `device_ids[i % len(device_ids)]`. CPU workers split CPU cores evenly.
+    With `num_procs == 1` all checkpoints are evaluated in calling process.
+
+    Args:
+        all_ckpts:
+            Checkpoint steps to evaluate. Each step `s` is loaded from
+            'model-s.pt' in `experiment_dir`.
+        config:
+            `fine_tune.config.BaseConfig` subclass which attributes are used
+            for experiment setup.
+        dataset:
+            Task specific dataset.
+        experiment_dir:
+            Folder which contains checkpoints.
+        model:
+            Model which will be evaluated on `dataset`. Checkpoints are
+            loaded into a copy of `model`, thus `model` itself is never
+            modified.
+        tokenizer:
+            Tokenizer paired with `model`.
+        device_ids:
+            Devices to run workers on. `-1` means CPU. Default to
+            `[config.device_id]`.
+        num_procs:
+            Number of worker processes.
+        patience:
+            Stop once `patience` checkpoints after the most accurate one do
+            not improve accuracy. Remaining checkpoints are not evaluated.
+            Set to `0` to evaluate all checkpoints.
+
+    Raises:
+        ValueError:
+            If `num_procs < 1` or `patience < 0`.
+
+    Yields:
+        Checkpoint step and its accuracy, in finishing order.
+    """
+    if num_procs < 1:
+        raise ValueError('`num_procs` must be bigger than or equal to `1`.')
+    if patience < 0:
+        raise ValueError('`patience` must be bigger than or equal to `0`.')
+    if not device_ids:
+        device_ids = [config.device_id]
+
+    all_ckpts = sorted(all_ckpts)
+
+    # Tokenize dataset once and share cache with all workers.
+    cache = fine_tune.util.token_cache.load_token_cache_by_config(
+        config=config,
+        dataset=dataset,
+        tokenizer=tokenizer
+    )
+
+    # Workers load mini-batches themselves to avoid oversubscribing CPU.
+    # Always spawn workers: CUDA must be initialized in freshly spawned
+    # processes, and forking a process which already runs threads (e.g.,
+    # OpenMP or tokenizer threads) may deadlock.
+    config = copy.deepcopy(config)
+    if num_procs > 1:
+        config.num_workers = 0
+    context = multiprocessing.get_context('spawn')
+
+    queue = context.SimpleQueue()
+    for idx in range(num_procs):
+        queue.put(device_ids[idx % len(device_ids)])
+
+    # Load checkpoints into a copy so that caller's model keeps its weights
+    # and device. Copy sent to worker processes is pickled from CPU.
+    model = copy.deepcopy(model)
+    if num_procs > 1:
+        model = model.to('cpu')
+
+    init_args = (
+        config,
+        cache,
+        dataset,
+        queue,
+        experiment_dir,
+        model,
+        max(1, (os.cpu_count() or 1) // num_procs),
+        tokenizer,
+    )
+
+    results = {}
+
+    # Evaluate in calling process.
+    if num_procs == 1:
+        _init_worker(*init_args)
+        for ckpt in all_ckpts:
+            ckpt, acc = _eval_ckpt(ckpt)
+            results[ckpt] = acc
+            yield ckpt, acc
+            if patience and _peaked(all_ckpts, results, patience):
+                logger.info(
+                    'Accuracy peaked, skip %d checkpoints.',
+                    len(all_ckpts) - len(results)
+                )
+                break
+        _WORKER.clear()
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_procs,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=init_args
+    ) as executor:
+        futures = [executor.submit(_eval_ckpt, ckpt) for ckpt in all_ckpts]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                ckpt, acc = future.result()
+                results[ckpt] = acc
+                yield ckpt, acc
+                if patience and _peaked(all_ckpts, results, patience):
+                    logger.info(
+                        'Accuracy peaked, skip %d checkpoints.',
+                        len(all_ckpts) - len(results)
+                    )
+                    break
+        finally:
+            # Drop pending checkpoints when stopped early or interrupted.
+            for future in futures:
+                future.cancel()
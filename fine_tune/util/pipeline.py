@@ -0,0 +1,132 @@
+r"""Helper functions for overlapping data production with model training.
+
+`fine_tune.util.prefetch` runs a producer function (e.g., tokenization and
+teacher forward pass) on a background thread and hands its results to the
+training loop through a bounded queue. While student is training on
+mini-batch `N`, producer is already working on mini-batch `N + 1`, thus
+teacher device and student device are both kept busy. PyTorch releases the
+GIL inside its kernels, so producer and training loop run concurrently on
+both GPU and CPU.
+
+Usage:
+    import fine_tune
+
+    for output in fine_tune.util.prefetch(
+            batches=dataloader,
+            depth=2,
+            fn=teacher_forward
+    ):
+        ...
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import queue
+import threading
+
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+
+# Sentinel put into queue when producer is exhausted.
+
+_END = object()
+
+
+class _ProducerError:
+    r"""Wrap exception raised in producer thread.
+
+    Args:
+        error:
+            Exception raised in producer thread.
+    """
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def prefetch(
+        batches: Iterable[Any],
+        depth: int,
+        fn: Callable[[Any], Any]
+) -> Iterator[Any]:
+    r"""Apply `fn` on each batch in a background thread.
+
+    Results are yielded in the same order as `batches`. At most `depth`
+    results are waiting in queue, thus producer never runs too far ahead of
+    consumer. Exception raised by producer is re-raised in consumer thread.
+    Producer stops as soon as consumer stops iterating.
+
+    Args:
+        batches:
+            Input mini-batches, e.g., `torch.utils.data.DataLoader`.
+        depth:
+            Maximum number of results waiting in queue. Set to `0` to run
+            `fn` sequentially in consumer thread.
+        fn:
+            Function applied on each mini-batch. `fn` runs in producer
+            thread, thus thread-local states such as `torch.no_grad` must be
+            set inside `fn`.
+
+    Raises:
+        ValueError:
+            If `depth < 0`.
+
+    Yields:
+        `fn(batch)` for each batch in `batches`.
+    """
+    if depth < 0:
+        raise ValueError(
+            '`depth` must be bigger than or equal to `0`.'
+        )
+
+    # Run sequentially.
+    if depth == 0:
+        for batch in batches:
+            yield fn(batch)
+        return
+
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item: Any) -> bool:
+        # Wake up periodically to check whether consumer has stopped.
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for batch in batches:
+                if not put(fn(batch)):
+                    return
+        except BaseException as error:  # pylint: disable=broad-except
+            put(_ProducerError(error))
+            return
+        put(_END)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = results.get()
+            if item is _END:
+                break
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        # Release producer blocked on full queue.
+        stop.set()
+        producer.join()
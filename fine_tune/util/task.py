@@ -23,6 +23,7 @@ import fine_tune.task
 def load_dataset(
         dataset: str,
         task: str,
+        num_workers: int = 0
 ) -> fine_tune.task.Dataset:
     r"""Load fine-tune task's dataset.
 
@@ -33,6 +34,8 @@ def load_dataset(
             the model of that experiment.
         task:
             Name of the fine-tune task.
+        num_workers:
+            Number of processes parsing dataset file in parallel.
 
     Raises:
         ValueError:
@@ -45,9 +48,9 @@ def load_dataset(
             If `task` is 'boolq'.
     """
     if task == 'mnli':
-        return fine_tune.task.MNLI(dataset)
+        return fine_tune.task.MNLI(dataset, num_workers=num_workers)
     if task == 'boolq':
-        return fine_tune.task.BoolQ(dataset)
+        return fine_tune.task.BoolQ(dataset, num_workers=num_workers)
 
     raise ValueError(
         f'`task` {task} is not supported.\nSupported options:' +
@@ -68,13 +71,14 @@ def load_dataset_by_config(
 
     Args:
         config:
-            Configuration object which contains attributes `task`
-            and `dataset`.
+            Configuration object which contains attributes `task`,
+            `dataset` and `num_workers`.
 
     Returns:
         Same as `fine_tune.util.load_data`.
     """
     return load_dataset(
         dataset=config.dataset,
-        task=config.task
+        task=config.task,
+        num_workers=config.num_workers
     )
@@ -0,0 +1,286 @@
+r"""Helper functions for dumping and loading teacher outputs store.
+
+Usage:
+    import fine_tune
+
+    hidden_layers, attn_layers = fine_tune.util.distill_layers(...)
+
+    store = fine_tune.util.dump_teacher_store(...)
+    store = fine_tune.util.dump_teacher_store_by_config(...)
+
+    store = fine_tune.util.load_teacher_store(...)
+    store = fine_tune.util.load_teacher_store_by_config(...)
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+# 3rd party modules
+
+import torch
+import transformers
+
+# my own modules
+
+import fine_tune.config
+import fine_tune.model
+import fine_tune.task
+import fine_tune.util.token_cache
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+
+def distill_layers(
+        num_student_layers: int,
+        num_teacher_layers: int
+) -> Tuple[List[int], List[int]]:
+    r"""Get teacher layers paired with each student layer.
+
+    Teacher layers are picked uniformly with stride
+    `num_teacher_layers // num_student_layers`.
+
+    Args:
+        num_student_layers:
+            Number of student Transformer layers.
+        num_teacher_layers:
+            Number of teacher Transformer layers.
+
+    Returns:
+        Teacher hidden state layer indices and teacher attention layer
+        indices. Hidden state index `0` refers to embedding output, thus
+        hidden state index `i` and attention index `i - 1` come from the same
+        Transformer layer.
+    """
+    skip = num_teacher_layers // num_student_layers
+    hidden_layers = list(range(1, num_teacher_layers + 1, skip))
+    attn_layers = list(range(skip - 1, num_teacher_layers, skip))
+    return (
+        hidden_layers[:num_student_layers],
+        attn_layers[:num_student_layers],
+    )
+
+
+def dump_teacher_store(
+        amp: bool,
+        attn_layers: Sequence[int],
+        batch_size: int,
+        ckpt: int,
+        dataset: fine_tune.task.Dataset,
+        dataset_name: str,
+        device: torch.device,
+        experiment_name: str,
+        hidden_layers: Sequence[int],
+        max_seq_len: int,
+        model: fine_tune.model.TeacherModel,
+        task: str,
+        tokenizer: transformers.PreTrainedTokenizerBase,
+        num_workers: int = 0
+) -> fine_tune.task.TeacherStore:
+    r"""Run teacher model over `dataset` once and save its outputs.
+
+    Args:
+        amp:
+            Run teacher forward pass with automatic mixed precision.
+        attn_layers:
+            Teacher attention layer indices to save.
+        batch_size:
+            Number of samples in each teacher forward pass.
+        ckpt:
+            Checkpoint of teacher model.
+        dataset:
+            Task specific dataset.
+        dataset_name:
+            Name of `dataset`.
+        device:
+            Teacher model running device.
+        experiment_name:
+            Teacher experiment name.
+        hidden_layers:
+            Teacher hidden state layer indices to save.
+        max_seq_len:
+            Maximum input sequence length.
+        model:
+            Fine-tuned teacher model.
+        task:
+            Name of the fine-tune task.
+        tokenizer:
+            Tokenizer paired with `model`.
+        num_workers:
+            Number of `torch.utils.data.DataLoader` worker processes running
+            tokenizer when building token cache.
+
+    Returns:
+        Memory-mapped teacher outputs store.
+    """
+    cache = fine_tune.util.token_cache.load_token_cache(
+        dataset=dataset,
+        dataset_name=dataset_name,
+        max_seq_len=max_seq_len,
+        task=task,
+        tokenizer=tokenizer,
+        num_workers=num_workers
+    )
+
+    store_dir = fine_tune.task.TeacherStore.store_dir(
+        ckpt=ckpt,
+        dataset=dataset_name,
+        experiment_name=experiment_name
+    )
+
+    logger.info('Start dumping teacher outputs to %s.', store_dir)
+    fine_tune.task.TeacherStore.build(
+        store_dir=store_dir,
+        attn_layers=attn_layers,
+        batch_size=batch_size,
+        cache=cache,
+        device=device,
+        hidden_layers=hidden_layers,
+        model=model,
+        amp=amp
+    )
+    logger.info('Finish dumping teacher outputs to %s.', store_dir)
+
+    return fine_tune.task.TeacherStore(store_dir)
+
+
+def dump_teacher_store_by_config(
+        attn_layers: Sequence[int],
+        ckpt: int,
+        config: fine_tune.config.TeacherConfig,
+        dataset: fine_tune.task.Dataset,
+        hidden_layers: Sequence[int],
+        model: fine_tune.model.TeacherModel,
+        tokenizer: transformers.PreTrainedTokenizerBase
+) -> fine_tune.task.TeacherStore:
+    r"""Run teacher model over `dataset` once and save its outputs.
+
+    Args:
+        attn_layers:
+            Teacher attention layer indices to save.
+        ckpt:
+            Checkpoint of teacher model.
+        config:
+            Teacher configuration object which contains attributes `amp`,
+            `batch_size`, `dataset`, `device`, `experiment`, `max_seq_len`,
+            `model`, `num_workers` and `task`.
+        dataset:
+            Task specific dataset.
+        hidden_layers:
+            Teacher hidden state layer indices to save.
+        model:
+            Fine-tuned teacher model.
+        tokenizer:
+            Tokenizer paired with `model`.
+
+    Returns:
+        Same as `fine_tune.util.dump_teacher_store`.
+    """
+    return dump_teacher_store(
+        amp=config.amp,
+        attn_layers=attn_layers,
+        batch_size=config.batch_size,
+        ckpt=ckpt,
+        dataset=dataset,
+        dataset_name=config.dataset,
+        device=config.device,
+        experiment_name=fine_tune.config.BaseConfig.experiment_name(
+            experiment=config.experiment,
+            model=config.model,
+            task=config.task
+        ),
+        hidden_layers=hidden_layers,
+        max_seq_len=config.max_seq_len,
+        model=model,
+        task=config.task,
+        tokenizer=tokenizer,
+        num_workers=config.num_workers
+    )
+
+
+def load_teacher_store(
+        ckpt: int,
+        dataset_name: str,
+        experiment_name: str,
+        tokenizer: transformers.PreTrainedTokenizerBase
+) -> fine_tune.task.TeacherStore:
+    r"""Load teacher outputs store dumped by
+    `fine_tune.util.dump_teacher_store`.
+
+    Args:
+        ckpt:
+            Checkpoint of teacher model.
+        dataset_name:
+            Name of the dataset.
+        experiment_name:
+            Teacher experiment name.
+        tokenizer:
+            Teacher tokenizer. Store must be dumped with the same tokenizer.
+
+    Raises:
+        FileNotFoundError:
+            When store does not exist.
+        ValueError:
+            When store was dumped with a different teacher tokenizer.
+
+    Returns:
+        Memory-mapped teacher outputs store.
+    """
+    store_dir = fine_tune.task.TeacherStore.store_dir(
+        ckpt=ckpt,
+        dataset=dataset_name,
+        experiment_name=experiment_name
+    )
+    logger.info('Load teacher store %s.', store_dir)
+    store = fine_tune.task.TeacherStore(store_dir)
+
+    if store.fingerprint != fine_tune.task.tokenizer_fingerprint(tokenizer):
+        raise ValueError(
+            f'Teacher store {store_dir} was dumped with a different ' +
+            'teacher tokenizer. Dump teacher store again.'
+        )
+
+    return store
+
+
+def load_teacher_store_by_config(
+        ckpt: int,
+        config: fine_tune.config.TeacherConfig,
+        tokenizer: transformers.PreTrainedTokenizerBase
+) -> fine_tune.task.TeacherStore:
+    r"""Load teacher outputs store dumped by
+    `fine_tune.util.dump_teacher_store_by_config`.
+
+    Args:
+        ckpt:
+            Checkpoint of teacher model.
+        config:
+            Teacher configuration object which contains attributes `dataset`,
+            `experiment`, `model` and `task`.
+        tokenizer:
+            Teacher tokenizer. See `fine_tune.util.load_teacher_store`.
+
+    Returns:
+        Same as `fine_tune.util.load_teacher_store`.
+    """
+    return load_teacher_store(
+        ckpt=ckpt,
+        dataset_name=config.dataset,
+        experiment_name=fine_tune.config.BaseConfig.experiment_name(
+            experiment=config.experiment,
+            model=config.model,
+            task=config.task
+        ),
+        tokenizer=tokenizer
+    )
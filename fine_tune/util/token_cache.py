@@ -0,0 +1,206 @@
+r"""Helper functions for loading tokenized dataset cache.
+
+Usage:
+    import fine_tune
+
+    cache = fine_tune.util.load_token_cache(...)
+    cache = fine_tune.util.load_token_cache_by_config(...)
+
+    teacher_cache, student_cache = fine_tune.util.load_pair_token_cache(...)
+    teacher_cache, student_cache = (
+        fine_tune.util.load_pair_token_cache_by_config(...)
+    )
+"""
+
+# built-in modules
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+
+from typing import Tuple
+
+# 3rd party modules
+
+import transformers
+
+# my own modules
+
+import fine_tune.config
+import fine_tune.task
+
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+
+def load_token_cache(
+        dataset: fine_tune.task.Dataset,
+        dataset_name: str,
+        max_seq_len: int,
+        task: str,
+        tokenizer: transformers.PreTrainedTokenizerBase,
+        num_workers: int = 0
+) -> fine_tune.task.TokenCache:
+    r"""Load tokenized dataset cache, build it first if not exists.
+
+    Args:
+        dataset:
+            Task specific dataset.
+        dataset_name:
+            Name of `dataset`.
+        max_seq_len:
+            Maximum input sequence length.
+        task:
+            Name of the fine-tune task.
+        tokenizer:
+            Tokenizer used to encode `dataset`.
+        num_workers:
+            Number of `torch.utils.data.DataLoader` worker processes running
+            tokenizer when building cache.
+
+    Returns:
+        Memory-mapped tokenized dataset cache.
+    """
+    return fine_tune.task.TokenCache.load_or_build(
+        dataset=dataset,
+        dataset_name=dataset_name,
+        max_seq_len=max_seq_len,
+        task=task,
+        tokenizer=tokenizer,
+        num_workers=num_workers
+    )
+
+
+def load_token_cache_by_config(
+        config: fine_tune.config.BaseConfig,
+        dataset: fine_tune.task.Dataset,
+        tokenizer: transformers.PreTrainedTokenizerBase
+) -> fine_tune.task.TokenCache:
+    r"""Load tokenized dataset cache, build it first if not exists.
+
+    Args:
+        config:
+            Configuration object which contains attributes `dataset`,
+            `max_seq_len`, `num_workers` and `task`.
+        dataset:
+            Task specific dataset.
+        tokenizer:
+            Tokenizer used to encode `dataset`.
+
+    Returns:
+        Same as `fine_tune.util.load_token_cache`.
+    """
+    return load_token_cache(
+        dataset=dataset,
+        dataset_name=config.dataset,
+        max_seq_len=config.max_seq_len,
+        task=config.task,
+        tokenizer=tokenizer,
+        num_workers=config.num_workers
+    )
+
+
+def load_pair_token_cache(
+        dataset: fine_tune.task.Dataset,
+        dataset_name: str,
+        student_max_seq_len: int,
+        student_tokenizer: transformers.PreTrainedTokenizerBase,
+        task: str,
+        teacher_max_seq_len: int,
+        teacher_tokenizer: transformers.PreTrainedTokenizerBase,
+        num_workers: int = 0
+) -> Tuple[fine_tune.task.TokenCache, fine_tune.task.TokenCache]:
+    r"""Load teacher and student tokenized dataset caches.
+
+    When teacher and student tokenizers are identical (see
+    `fine_tune.task.tokenizer_fingerprint`) and have the same maximum
+    sequence length, dataset is encoded only once and both returned caches
+    are the same object. Otherwise missing caches are built together, thus
+    each sample is read once and encoded by both tokenizers in the same
+    worker.
+
+    Args:
+        dataset:
+            Task specific dataset.
+        dataset_name:
+            Name of `dataset`.
+        student_max_seq_len:
+            Maximum input sequence length of student.
+        student_tokenizer:
+            Tokenizer paired with student model.
+        task:
+            Name of the fine-tune task.
+        teacher_max_seq_len:
+            Maximum input sequence length of teacher.
+        teacher_tokenizer:
+            Tokenizer paired with teacher model.
+        num_workers:
+            Number of `torch.utils.data.DataLoader` worker processes running
+            tokenizers when building caches.
+
+    Returns:
+        Memory-mapped teacher cache and student cache.
+    """
+    caches = fine_tune.task.TokenCache.load_or_build_many(
+        dataset=dataset,
+        dataset_name=dataset_name,
+        max_seq_lens=[teacher_max_seq_len, student_max_seq_len],
+        task=task,
+        tokenizers=[teacher_tokenizer, student_tokenizer],
+        num_workers=num_workers
+    )
+
+    if caches[0] is caches[1]:
+        logger.info(
+            'Teacher and student tokenizers are identical, encode dataset ' +
+            'once.'
+        )
+    else:
+        logger.info(
+            'Teacher and student tokenizers differ, encode dataset with ' +
+            'both tokenizers.'
+        )
+
+    return caches[0], caches[1]
+
+
+def load_pair_token_cache_by_config(
+        dataset: fine_tune.task.Dataset,
+        student_config: fine_tune.config.StudentConfig,
+        student_tokenizer: transformers.PreTrainedTokenizerBase,
+        teacher_config: fine_tune.config.TeacherConfig,
+        teacher_tokenizer: transformers.PreTrainedTokenizerBase
+) -> Tuple[fine_tune.task.TokenCache, fine_tune.task.TokenCache]:
+    r"""Load teacher and student tokenized dataset caches.
+
+    Args:
+        dataset:
+            Task specific dataset.
+        student_config:
+            Student configuration object which contains attributes `dataset`,
+            `max_seq_len`, `num_workers` and `task`.
+        student_tokenizer:
+            Tokenizer paired with student model.
+        teacher_config:
+            Teacher configuration object which contains attribute
+            `max_seq_len`.
+        teacher_tokenizer:
+            Tokenizer paired with teacher model.
+
+    Returns:
+        Same as `fine_tune.util.load_pair_token_cache`.
+    """
+    return load_pair_token_cache(
+        dataset=dataset,
+        dataset_name=student_config.dataset,
+        student_max_seq_len=student_config.max_seq_len,
+        student_tokenizer=student_tokenizer,
+        task=student_config.task,
+        teacher_max_seq_len=teacher_config.max_seq_len,
+        teacher_tokenizer=teacher_tokenizer,
+        num_workers=student_config.num_workers
+    )
@@ -3,6 +3,11 @@ r"""Helper functions for loading tokenizer.
 In future, this module might need to split into multiple files, each file
 contains only one model specific tokenizer.
 
+Rust-backed fast tokenizers (`transformers.PreTrainedTokenizerFast`) are
+preferred. When fast tokenizer cannot be loaded (e.g., package `tokenizers`
+is not installed or conversion from slow tokenizer failed) we fall back to
+slow Python tokenizers. Both backends produce the same token ids.
+
 Usage:
     import fine_tune
 
@@ -20,6 +25,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import logging
+
+from typing import Dict
+from typing import Tuple
+from typing import Type
+
 # 3rd party modules
 
 import transformers
@@ -29,11 +40,72 @@ import transformers
 import fine_tune.config
 import fine_tune.model
 
+# Get logger.
+
+logger = logging.getLogger('fine_tune.util')
+
+# Slow and fast tokenizer classes of each model.
+
+_TOKENIZER_CLASSES: Dict[
+    str,
+    Tuple[
+        Type[transformers.PreTrainedTokenizer],
+        Type[transformers.PreTrainedTokenizerFast]
+    ]
+] = {
+    'albert': (
+        transformers.AlbertTokenizer,
+        transformers.AlbertTokenizerFast,
+    ),
+    'bert': (
+        transformers.BertTokenizer,
+        transformers.BertTokenizerFast,
+    ),
+}
+
+
+def _from_pretrained(
+        model: str,
+        ptrain_ver: str,
+        use_fast: bool = True
+) -> transformers.PreTrainedTokenizerBase:
+    r"""Load pretrained tokenizer, prefer fast tokenizer when available.
+
+    Args:
+        model:
+            Name of the model. Must be one of the keys in
+            `_TOKENIZER_CLASSES`.
+        ptrain_ver:
+            Pretrained tokenizer version provided by `transformers` package.
+        use_fast:
+            Try fast tokenizer first. Set to `False` to always use slow
+            tokenizer.
+
+    Returns:
+        Fast tokenizer if `use_fast` and it can be loaded, otherwise slow
+        tokenizer.
+    """
+    slow_cls, fast_cls = _TOKENIZER_CLASSES[model]
+
+    if use_fast:
+        try:
+            return fast_cls.from_pretrained(ptrain_ver)
+        except (ImportError, OSError, ValueError) as error:
+            logger.warning(
+                'Fast tokenizer %s is not available, fall back to %s: %s',
+                fast_cls.__name__,
+                slow_cls.__name__,
+                error
+            )
+
+    return slow_cls.from_pretrained(ptrain_ver)
+
 
 def load_teacher_tokenizer(
         model: str,
-        ptrain_ver: str
-) -> transformers.PreTrainedTokenizer:
+        ptrain_ver: str,
+        use_fast: bool = True
+) -> transformers.PreTrainedTokenizerBase:
     r"""Load teacher model paired tokenizer.
 
     Args:
@@ -41,25 +113,26 @@ def load_teacher_tokenizer(
             Name of the teacher model.
         ptrain_ver:
             Pretrained model version provided by `transformers` package.
+        use_fast:
+            Prefer fast tokenizer and fall back to slow tokenizer when fast
+            tokenizer cannot be loaded.
 
     Raises:
         ValueError:
             If `model` does not supported.
 
     Returns:
-        `transformers.AlbertTokenizer`:
+        `transformers.AlbertTokenizerFast` or `transformers.AlbertTokenizer`:
             If `model == 'albert'`.
-        `transformers.BertTokenizer`:
+        `transformers.BertTokenizerFast` or `transformers.BertTokenizer`:
             If `model == 'bert'`.
     """
 
-    if model == 'albert':
-        return transformers.AlbertTokenizer.from_pretrained(
-            ptrain_ver
-        )
-    if model == 'bert':
-        return transformers.BertTokenizer.from_pretrained(
-            ptrain_ver
+    if model in _TOKENIZER_CLASSES:
+        return _from_pretrained(
+            model=model,
+            ptrain_ver=ptrain_ver,
+            use_fast=use_fast
         )
 
     raise ValueError(
@@ -76,7 +149,7 @@ def load_teacher_tokenizer(
 
 def load_teacher_tokenizer_by_config(
         config: fine_tune.config.TeacherConfig
-) -> transformers.PreTrainedTokenizer:
+) -> transformers.PreTrainedTokenizerBase:
     r"""Load teacher model paired tokenizer.
 
     Args:
@@ -94,34 +167,42 @@ def load_teacher_tokenizer_by_config(
 
 
 def load_student_tokenizer(
-        model: str
-) -> transformers.PreTrainedTokenizer:
+        model: str,
+        use_fast: bool = True
+) -> transformers.PreTrainedTokenizerBase:
     r"""Load student model paired tokenizer.
 
     Args:
         model:
             Name of the teacher model.
+        use_fast:
+            Prefer fast tokenizer and fall back to slow tokenizer when fast
+            tokenizer cannot be loaded.
 
     Raises:
         ValueError:
             If `model` does not supported.
 
     Returns:
-        `transformers.AlbertTokenizer`:
+        `transformers.AlbertTokenizerFast` or `transformers.AlbertTokenizer`:
             If `model == 'albert'`. Using pre-trained tokenizer version
             'albert-base-v2'.
-        `transformers.BertTokenizer`:
+        `transformers.BertTokenizerFast` or `transformers.BertTokenizer`:
             If `model == 'bert'`. Using pre-trained tokenizer version
             'bert-base-uncased'.
     """
 
     if model == 'albert':
-        return transformers.AlbertTokenizer.from_pretrained(
-            'albert-base-v2'
+        return _from_pretrained(
+            model=model,
+            ptrain_ver='albert-base-v2',
+            use_fast=use_fast
         )
     if model == 'bert':
-        return transformers.BertTokenizer.from_pretrained(
-            'bert-base-uncased'
+        return _from_pretrained(
+            model=model,
+            ptrain_ver='bert-base-uncased',
+            use_fast=use_fast
         )
 
     raise ValueError(
@@ -139,7 +220,7 @@ def load_student_tokenizer(
 
 def load_student_tokenizer_by_config(
         config: fine_tune.config.StudentConfig
-) -> transformers.PreTrainedTokenizer:
+) -> transformers.PreTrainedTokenizerBase:
     r"""Load student model paired tokenizer.
 
     Args:
@@ -0,0 +1,86 @@
+r"""Pack bertgang pre-train data into sharded binary files.
+
+Packed data is read by `bertgang.bertgang_data.PackedPreTrainData`.
+
+Usage:
+    python run_bertgang_pack.py ...
+
+Run `python run_bertgang_pack.py -h` for help.
+"""
+
+# built-in modules
+
+import argparse
+import logging
+import time
+
+# my own modules
+
+import bertgang
+import bertgang.bertgang_pack
+
+# Get main logger.
+logger = logging.getLogger('bertgang.pack')
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+    datefmt='%Y/%m/%d %H:%M:%S',
+    level=logging.INFO
+)
+
+if __name__ == '__main__':
+    # Parse arguments from STDIN.
+    parser = argparse.ArgumentParser()
+
+    # Required parameters.
+    parser.add_argument(
+        '--src_path',
+        help='Directory containing one directory per pre-train data.',
+        required=True,
+        type=str,
+    )
+    parser.add_argument(
+        '--dst_path',
+        help='Directory to save packed pre-train data.',
+        required=True,
+        type=str,
+    )
+    parser.add_argument(
+        '--teachers',
+        help='Teachers whose tensors are packed.',
+        nargs='+',
+        required=True,
+        type=str,
+    )
+
+    # Optional parameters.
+    parser.add_argument(
+        '--ignore_files',
+        default=None,
+        help='Directories in `src_path` to be ignored.',
+        nargs='*',
+        type=str,
+    )
+    parser.add_argument(
+        '--shard_size',
+        default=1 << 30,
+        help='Maximum number of bytes of each shard.',
+        type=int,
+    )
+
+    # Parse arguments.
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    num_data = bertgang.bertgang_pack.pack_pre_train_data(
+        src_path=args.src_path,
+        dst_path=args.dst_path,
+        teachers=args.teachers,
+        ignore_files=args.ignore_files,
+        shard_size=args.shard_size
+    )
+    logger.info(
+        'Pack %d pre-train data into %s in %.2f s.',
+        num_data,
+        args.dst_path,
+        time.perf_counter() - start
+    )
@@ -102,6 +102,13 @@ if __name__ == '__main__':
         help="Optimizer `torch.optim.AdamW`'s beta coefficients.",
         type=float,
     )
+    parser.add_argument(
+        '--bucket_size',
+        default=0,
+        help='Number of samples sorted by length together to form ' +
+            'mini-batches. Set to `0` to disable length bucketing.',
+        type=int,
+    )
     parser.add_argument(
         '--ckpt_step',
         default=1000,
@@ -120,6 +127,27 @@ if __name__ == '__main__':
         help="Optimizer `torch.optim.AdamW`'s epsilon.",
         type=float,
     )
+    parser.add_argument(
+        '--eval_dataset',
+        default='',
+        help='Dataset evaluated at every checkpoint during training. ' +
+            'Required by `--keep_best`.',
+        type=str,
+    )
+    parser.add_argument(
+        '--keep_best',
+        default=0,
+        help='Number of checkpoints with the highest `--eval_dataset` ' +
+            'accuracy to keep in addition to `--keep_last`.',
+        type=int,
+    )
+    parser.add_argument(
+        '--keep_last',
+        default=0,
+        help='Number of latest checkpoints to keep. Other checkpoints are ' +
+            'deleted during training. Set to `0` to keep all checkpoints.',
+        type=int,
+    )
     parser.add_argument(
         '--log_step',
         default=500,
@@ -144,12 +172,74 @@ if __name__ == '__main__':
         help='Maximum input sequence length for fine-tune model.',
         type=int,
     )
+    parser.add_argument(
+        '--max_tokens_per_batch',
+        default=0,
+        help='Maximum number of padded tokens in each mini-batch. ' +
+            'Set to `0` to use fixed size mini-batches.',
+        type=int,
+    )
+    parser.add_argument(
+        '--backend',
+        default='gloo',
+        choices=['gloo', 'nccl'],
+        help='`torch.distributed` backend used when `--world_size > 1`. ' +
+            'Use `gloo` for CPU and `nccl` for GPU.',
+        type=str,
+    )
     parser.add_argument(
         '--num_gpu',
         default=1,
         help='Number of GPUs to perform training.',
         type=int,
     )
+    parser.add_argument(
+        '--num_workers',
+        default=0,
+        help='Number of dataloader worker processes. Set to `0` to load ' +
+            'data in main process.',
+        type=int,
+    )
+    parser.add_argument(
+        '--pad_to_multiple_of',
+        default=1,
+        help='Round padded sequence length up to a multiple of this value.',
+        type=int,
+    )
+    parser.add_argument(
+        '--padding',
+        choices=['longest', 'max_length'],
+        default='longest',
+        help='Pad each mini-batch to its longest sequence or to ' +
+            '`max_seq_len`.',
+        type=str,
+    )
+    parser.add_argument(
+        '--persistent_workers',
+        default=False,
+        help='Keep dataloader workers alive across epochs.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--pin_memory',
+        default=False,
+        help='Gather mini-batches into page-locked memory.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--prefetch_factor',
+        default=2,
+        help='Number of mini-batches loaded in advance by each dataloader ' +
+            'worker.',
+        type=int,
+    )
+    parser.add_argument(
+        '--resume',
+        default=False,
+        help='Continue training from the latest checkpoint of the ' +
+            'experiment, including random states and data order.',
+        action='store_true'
+    )
     parser.add_argument(
         '--seed',
         default=42,
@@ -168,6 +258,13 @@ if __name__ == '__main__':
         help='Linear scheduler warmup step.',
         type=int,
     )
+    parser.add_argument(
+        '--world_size',
+        default=1,
+        help='Number of distributed data parallel processes. Each process ' +
+            'trains on `batch_size` samples per step.',
+        type=int,
+    )
     parser.add_argument(
         '--weight_decay',
         default=0.01,
@@ -178,6 +275,12 @@ if __name__ == '__main__':
     # Parse arguments.
     args = parser.parse_args()
 
+    # Only single process training can be resumed.
+    if args.resume and args.world_size > 1:
+        raise ValueError(
+            '`--resume` is not supported when `--world_size > 1`.'
+        )
+
     # Construct configuration.
     config = fine_tune.config.TeacherConfig(
         accum_step=args.accum_step,
@@ -185,18 +288,29 @@ if __name__ == '__main__':
         batch_size=args.batch_size,
         beta1=args.beta1,
         beta2=args.beta2,
+        bucket_size=args.bucket_size,
         ckpt_step=args.ckpt_step,
         dataset=args.dataset,
         dropout=args.dropout,
         eps=args.eps,
+        eval_dataset=args.eval_dataset,
         experiment=args.experiment,
+        keep_best=args.keep_best,
+        keep_last=args.keep_last,
         log_step=args.log_step,
         lr=args.lr,
         max_norm=args.max_norm,
         max_seq_len=args.max_seq_len,
+        max_tokens_per_batch=args.max_tokens_per_batch,
         model=args.model,
         num_class=args.num_class,
         num_gpu=args.num_gpu,
+        num_workers=args.num_workers,
+        pad_to_multiple_of=args.pad_to_multiple_of,
+        padding=args.padding,
+        persistent_workers=args.persistent_workers,
+        pin_memory=args.pin_memory,
+        prefetch_factor=args.prefetch_factor,
         ptrain_ver=args.ptrain_ver,
         seed=args.seed,
         task=args.task,
@@ -211,55 +325,66 @@ if __name__ == '__main__':
     # Save configuration.
     config.save()
 
-    # Control random seed for reproducibility.
-    fine_tune.util.set_seed_by_config(
-        config=config
-    )
-
-    # Load fine-tune dataset.
-    dataset = fine_tune.util.load_dataset_by_config(
-        config=config
-    )
-
-    # Load tokenizer.
-    tokenizer = fine_tune.util.load_teacher_tokenizer_by_config(
-        config=config
-    )
+    # Fine-tune with distributed data parallel. Each process loads its own
+    # dataset, tokenizer and model.
+    if args.world_size > 1:
+        fine_tune.util.launch_ddp_train(
+            config=config,
+            world_size=args.world_size,
+            backend=args.backend
+        )
+    else:
+        # Control random seed for reproducibility.
+        fine_tune.util.set_seed_by_config(
+            config=config
+        )
 
-    # Load model.
-    model = fine_tune.util.load_teacher_model_by_config(
-        config=config
-    )
+        # Load fine-tune dataset.
+        dataset = fine_tune.util.load_dataset_by_config(
+            config=config
+        )
 
-    # Load optimizer.
-    optimizer = fine_tune.util.optimizer.load_optimizer_by_config(
-        config=config,
-        model=model
-    )
+        # Load tokenizer.
+        tokenizer = fine_tune.util.load_teacher_tokenizer_by_config(
+            config=config
+        )
 
-    # Load scheduler.
-    scheduler = fine_tune.util.scheduler.load_scheduler_by_config(
-        config=config,
-        optimizer=optimizer
-    )
+        # Load model.
+        model = fine_tune.util.load_teacher_model_by_config(
+            config=config
+        )
 
-    # Fine-tune model.
-    if args.amp:
-        # Use automatic mixed precision training
-        fine_tune.util.amp_train(
+        # Load optimizer.
+        optimizer = fine_tune.util.optimizer.load_optimizer_by_config(
             config=config,
-            dataset=dataset,
-            model=model,
-            optimizer=optimizer,
-            scheduler=scheduler,
-            tokenizer=tokenizer
+            model=model
         )
-    else:
-        fine_tune.util.train(
+
+        # Load scheduler.
+        scheduler = fine_tune.util.scheduler.load_scheduler_by_config(
             config=config,
-            dataset=dataset,
-            model=model,
-            optimizer=optimizer,
-            scheduler=scheduler,
-            tokenizer=tokenizer
+            optimizer=optimizer
         )
+
+        # Fine-tune model.
+        if args.amp:
+            # Use automatic mixed precision training
+            fine_tune.util.amp_train(
+                config=config,
+                dataset=dataset,
+                model=model,
+                optimizer=optimizer,
+                scheduler=scheduler,
+                tokenizer=tokenizer,
+                resume=args.resume
+            )
+        else:
+            fine_tune.util.train(
+                config=config,
+                dataset=dataset,
+                model=model,
+                optimizer=optimizer,
+                scheduler=scheduler,
+                tokenizer=tokenizer,
+                resume=args.resume
+            )
@@ -37,12 +37,6 @@ for handler in logging.getLogger().handlers:
     handler.addFilter(logging.Filter('fine_tune'))
 
 if __name__ == "__main__":
-    #TODO: Refactor this block.
-    # Check GPU device count.
-    # If we don't have two GPU device.
-    # Then raise ValueError
-    fine_tune.util.check_device()
-
     # Parse arguments from STDIN.
     parser = argparse.ArgumentParser()
 
@@ -70,6 +64,43 @@ if __name__ == "__main__":
         help='Use attention distribution only during distillation',
         action='store_true'
     )
+    parser.add_argument(
+        '--teacher_store',
+        help='Read teacher outputs dumped by ' +
+            '`run_fine_tune_dump_teacher.py` instead of running teacher model',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--world_size',
+        default=1,
+        help='Number of distributed data parallel student replicas. ' +
+            'Each replica trains on `batch_size` samples per step and reads ' +
+            'teacher outputs from the shared teacher store. Requires ' +
+            '`--teacher_store` when bigger than `1`',
+        type=int,
+    )
+    parser.add_argument(
+        '--backend',
+        default='gloo',
+        choices=['gloo', 'nccl'],
+        help='`torch.distributed` backend used when `--world_size > 1`. ' +
+            'Use `gloo` for CPU and `nccl` for GPU',
+        type=str,
+    )
+    parser.add_argument(
+        '--pipeline_depth',
+        default=0,
+        help='Number of mini-batches prepared ahead by teacher in a ' +
+            'background thread while student is training. ' +
+            'Set to `0` to run teacher and student one after the other',
+        type=int,
+    )
+    parser.add_argument(
+        '--resume',
+        help='Continue distillation from the latest checkpoint of the ' +
+            'student experiment, including random states and data order',
+        action='store_true'
+    )
 
     # Arguments of teacher model.
     parser.add_argument(
@@ -90,6 +121,13 @@ if __name__ == "__main__":
         required=True,
         type=int,
     )
+    parser.add_argument(
+        '--tdevice_id',
+        default=None,
+        help='Device ID of teacher model. Run on CPU if set to `-1`. ' +
+            'Use device ID saved in teacher configuration if not set.',
+        type=int,
+    )
 
     # Arguments of student model.
     parser.add_argument(
@@ -106,7 +144,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         '--device_id',
-        help='Device ID of student model.',
+        help='Device ID of student model. Run on CPU if set to `-1`.',
         required=True,
         type=int,
     )
@@ -125,6 +163,46 @@ if __name__ == "__main__":
         help='Distillation batch size.',
         type=int,
     )
+    parser.add_argument(
+        '--num_workers',
+        default=0,
+        help='Number of dataloader worker processes. Set to `0` to load ' +
+            'data in main process.',
+        type=int,
+    )
+    parser.add_argument(
+        '--pad_to_multiple_of',
+        default=1,
+        help='Round padded sequence length up to a multiple of this value.',
+        type=int,
+    )
+    parser.add_argument(
+        '--padding',
+        choices=['longest', 'max_length'],
+        default='longest',
+        help='Pad each mini-batch to its longest sequence or to ' +
+            '`max_seq_len`.',
+        type=str,
+    )
+    parser.add_argument(
+        '--persistent_workers',
+        default=False,
+        help='Keep dataloader workers alive across epochs.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--pin_memory',
+        default=False,
+        help='Gather mini-batches into page-locked memory.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--prefetch_factor',
+        default=2,
+        help='Number of mini-batches loaded in advance by each dataloader ' +
+            'worker.',
+        type=int,
+    )
 
     # Arguments of student model.
     parser.add_argument(
@@ -139,6 +217,13 @@ if __name__ == "__main__":
         help="Optimizer `torch.optim.AdamW`'s beta coefficients.",
         type=float,
     )
+    parser.add_argument(
+        '--bucket_size',
+        default=0,
+        help='Number of samples sorted by length together to form ' +
+            'mini-batches. Set to `0` to disable length bucketing.',
+        type=int,
+    )
     parser.add_argument(
         '--ckpt_step',
         default=1000,
@@ -175,6 +260,27 @@ if __name__ == "__main__":
         help="Optimizer `torch.optim.AdamW`'s epsilon.",
         type=float,
     )
+    parser.add_argument(
+        '--eval_dataset',
+        default='',
+        help='Dataset evaluated at every checkpoint during training. ' +
+            'Required by `--keep_best`.',
+        type=str,
+    )
+    parser.add_argument(
+        '--keep_best',
+        default=0,
+        help='Number of checkpoints with the highest `--eval_dataset` ' +
+            'accuracy to keep in addition to `--keep_last`.',
+        type=int,
+    )
+    parser.add_argument(
+        '--keep_last',
+        default=0,
+        help='Number of latest checkpoints to keep. Other checkpoints are ' +
+            'deleted during training. Set to `0` to keep all checkpoints.',
+        type=int,
+    )
     parser.add_argument(
         '--log_step',
         default=500,
@@ -193,6 +299,13 @@ if __name__ == "__main__":
         help='Maximum norm of gradient.',
         type=float,
     )
+    parser.add_argument(
+        '--max_tokens_per_batch',
+        default=0,
+        help='Maximum number of padded tokens in each mini-batch. ' +
+            'Set to `0` to use fixed size mini-batches.',
+        type=int,
+    )
     parser.add_argument(
         '--num_attention_heads',
         default=16,
@@ -233,6 +346,18 @@ if __name__ == "__main__":
     # Parse arguments.
     args = parser.parse_args()
 
+    # Student replicas share teacher outputs through teacher store.
+    if args.world_size > 1 and not args.teacher_store:
+        raise ValueError(
+            '`--teacher_store` is required when `--world_size > 1`.'
+        )
+
+    # Only single process distillation can be resumed.
+    if args.resume and args.world_size > 1:
+        raise ValueError(
+            '`--resume` is not supported when `--world_size > 1`.'
+        )
+
     # Check use forgot to indicate loss.
     if not ( args.use_logits_loss or args.use_hidden_loss or args.use_attn_loss ):
         raise ValueError("You forgot to specify loss function!\n" +
@@ -246,10 +371,26 @@ if __name__ == "__main__":
         task=args.task
     )
 
+    # Change teacher device.
+    if args.tdevice_id is not None:
+        teacher_config.device_id = args.tdevice_id
+
     # Sync batch size and accumulation steps.
     teacher_config.batch_size = args.batch_size
     teacher_config.accum_step = args.accum_step
 
+    # Sync padding strategy so that teacher and student inputs are aligned.
+    teacher_config.padding = args.padding
+    teacher_config.pad_to_multiple_of = args.pad_to_multiple_of
+    teacher_config.bucket_size = args.bucket_size
+    teacher_config.max_tokens_per_batch = args.max_tokens_per_batch
+
+    # Sync dataloader settings.
+    teacher_config.num_workers = args.num_workers
+    teacher_config.persistent_workers = args.persistent_workers
+    teacher_config.pin_memory = args.pin_memory
+    teacher_config.prefetch_factor = args.prefetch_factor
+
     # Construct student model configuration.
     student_config = fine_tune.config.StudentConfig(
         accum_step=args.accum_step,
@@ -257,6 +398,7 @@ if __name__ == "__main__":
         batch_size=args.batch_size,
         beta1=args.beta1,
         beta2=args.beta2,
+        bucket_size=args.bucket_size,
         ckpt_step=args.ckpt_step,
         d_emb=args.d_emb,
         d_ff=args.d_ff,
@@ -264,15 +406,25 @@ if __name__ == "__main__":
         dataset=teacher_config.dataset,
         dropout=args.dropout,
         eps=args.eps,
+        eval_dataset=args.eval_dataset,
         experiment=args.experiment,
+        keep_best=args.keep_best,
+        keep_last=args.keep_last,
         log_step=args.log_step,
         lr=args.lr,
         max_norm=args.max_norm,
         max_seq_len=teacher_config.max_seq_len,
+        max_tokens_per_batch=args.max_tokens_per_batch,
         model=args.model,
         num_attention_heads=args.num_attention_heads,
         num_class=teacher_config.num_class,
         num_hidden_layers=args.num_hidden_layers,
+        num_workers=args.num_workers,
+        pad_to_multiple_of=args.pad_to_multiple_of,
+        padding=args.padding,
+        persistent_workers=args.persistent_workers,
+        pin_memory=args.pin_memory,
+        prefetch_factor=args.prefetch_factor,
         seed=teacher_config.seed,
         task=args.task,
         total_step=args.total_step,
@@ -282,6 +434,17 @@ if __name__ == "__main__":
         device_id=args.device_id
     )
 
+    # Check teacher and student devices. Teacher and student may share the
+    # same device, including CPU. Offline distillation does not need teacher
+    # device.
+    if args.teacher_store:
+        fine_tune.util.check_device(student_config.device)
+    else:
+        fine_tune.util.check_device(
+            teacher_config.device,
+            student_config.device
+        )
+
     # Log configuration.
     logger.info(teacher_config)
     logger.info(student_config)
@@ -289,62 +452,88 @@ if __name__ == "__main__":
     # Save student config.
     student_config.save()
 
-    # Control random seed for reproducibility.
-    fine_tune.util.set_seed_by_config(
-        config=teacher_config
-    )
-
-    # Load distillation dataset.
-    dataset = fine_tune.util.load_dataset_by_config(
-        config=teacher_config
-    )
+    # Distill with distributed data parallel. Each process loads its own
+    # dataset, student tokenizer and student model.
+    if args.world_size > 1:
+        fine_tune.util.launch_ddp_distill(
+            ckpt=args.tckpt,
+            student_config=student_config,
+            teacher_config=teacher_config,
+            world_size=args.world_size,
+            backend=args.backend,
+            use_logits_loss=args.use_logits_loss,
+            use_hidden_loss=args.use_hidden_loss,
+            use_attn_loss=args.use_attn_loss
+        )
+    else:
+        # Control random seed for reproducibility.
+        fine_tune.util.set_seed_by_config(
+            config=teacher_config
+        )
 
-    # Load teacher and student tokenizer.
-    teacher_tokenizer = fine_tune.util.load_teacher_tokenizer_by_config(
-        config=teacher_config
-    )
-    student_tokenizer = fine_tune.util.load_student_tokenizer_by_config(
-        config=student_config
-    )
+        # Load distillation dataset.
+        dataset = fine_tune.util.load_dataset_by_config(
+            config=teacher_config
+        )
 
-    # Load teacher model from given checkpoint.
-    teacher_model = fine_tune.util.load_teacher_model_by_config(
-        config=teacher_config
-    )
-    experiment_name = fine_tune.config.BaseConfig.experiment_name(
-        experiment=teacher_config.experiment,
-        model=teacher_config.model,
-        task=teacher_config.task
-    )
-    model_name = os.path.join(
-        fine_tune.path.FINE_TUNE_EXPERIMENT,
-        experiment_name,
-        f'model-{args.tckpt}.pt'
-    )
-    # Load model from checkpoint.
-    teacher_model.load_state_dict(torch.load(model_name))
+        # Load teacher and student tokenizer.
+        teacher_tokenizer = fine_tune.util.load_teacher_tokenizer_by_config(
+            config=teacher_config
+        )
+        student_tokenizer = fine_tune.util.load_student_tokenizer_by_config(
+            config=student_config
+        )
 
-    # Load student model.
-    student_model = fine_tune.util.load_student_model_by_config(
-        config=student_config,
-        tokenizer=student_tokenizer
-    )
+        # Read teacher outputs from store.
+        if args.teacher_store:
+            teacher_model = None
+            teacher_store = fine_tune.util.load_teacher_store_by_config(
+                ckpt=args.tckpt,
+                config=teacher_config,
+                tokenizer=teacher_tokenizer
+            )
+        # Load teacher model from given checkpoint.
+        else:
+            teacher_store = None
+            teacher_model = fine_tune.util.load_teacher_model_by_config(
+                config=teacher_config
+            )
+            experiment_name = fine_tune.config.BaseConfig.experiment_name(
+                experiment=teacher_config.experiment,
+                model=teacher_config.model,
+                task=teacher_config.task
+            )
+            model_name = os.path.join(
+                fine_tune.path.FINE_TUNE_EXPERIMENT,
+                experiment_name,
+                f'model-{args.tckpt}.pt'
+            )
+            # Load model from checkpoint.
+            teacher_model.load_state_dict(torch.load(
+                model_name,
+                map_location=teacher_config.device
+            ))
+
+        # Load student model.
+        student_model = fine_tune.util.load_student_model_by_config(
+            config=student_config,
+            tokenizer=student_tokenizer
+        )
 
-    # Load optimizer.
-    optimizer = fine_tune.util.optimizer.load_optimizer_by_config(
-        config=student_config,
-        model=student_model
-    )
+        # Load optimizer.
+        optimizer = fine_tune.util.optimizer.load_optimizer_by_config(
+            config=student_config,
+            model=student_model
+        )
 
-    # Load scheduler.
-    scheduler = fine_tune.util.scheduler.load_scheduler_by_config(
-        config=student_config,
-        optimizer=optimizer
-    )
+        # Load scheduler.
+        scheduler = fine_tune.util.scheduler.load_scheduler_by_config(
+            config=student_config,
+            optimizer=optimizer
+        )
 
-    # Perform disitllation.
-    if teacher_config.amp:
-        # perform amp distillation.
+        # Perform disitllation. Automatic mixed precision is enabled by
+        # `student_config.amp`.
         fine_tune.util.amp_distill_mgpu(
             teacher_config=teacher_config,
             student_config=student_config,
@@ -357,8 +546,8 @@ if __name__ == "__main__":
             student_tokenizer=student_tokenizer,
             use_logits_loss=args.use_logits_loss,
             use_hidden_loss=args.use_hidden_loss,
-            use_attn_loss=args.use_attn_loss
+            use_attn_loss=args.use_attn_loss,
+            teacher_store=teacher_store,
+            pipeline_depth=args.pipeline_depth,
+            resume=args.resume
         )
-    else:
-        # perform distillation.
-        raise NotImplementedError("Call 'distill_mgpu'")
@@ -0,0 +1,183 @@
+r"""Dump fine-tuned teacher model's outputs for offline distillation.
+
+Usage:
+    python run_fine_tune_dump_teacher.py ...
+
+Run `python run_fine_tune_dump_teacher.py -h` for help, or see
+'doc/fine_tune_*.md' for more information.
+"""
+
+# built-in modules
+
+import argparse
+import logging
+import os
+
+# 3rd-party modules
+
+import torch
+
+# my own modules
+
+import fine_tune
+
+# Get main logger.
+logger = logging.getLogger('fine_tune.dump')
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(name)s -   %(message)s',
+    datefmt='%Y/%m/%d %H:%M:%S',
+    level=logging.INFO
+)
+
+# Filter out message not begin with name 'fine_tune'.
+for handler in logging.getLogger().handlers:
+    handler.addFilter(logging.Filter('fine_tune'))
+
+if __name__ == '__main__':
+    # Parse arguments from STDIN.
+    parser = argparse.ArgumentParser()
+
+    # Required parameters.
+    parser.add_argument(
+        '--experiment',
+        help='Experiment name of the fine-tuned teacher model.',
+        required=True,
+        type=str,
+    )
+    parser.add_argument(
+        '--model',
+        help='Name of the teacher model.',
+        required=True,
+        type=str,
+    )
+    parser.add_argument(
+        '--task',
+        help='Name of the fine-tune task.',
+        required=True,
+        type=str,
+    )
+    parser.add_argument(
+        '--ckpt',
+        help='Checkpoint of teacher model to generate logits, hidden ' +
+            'states and attentions.',
+        required=True,
+        type=int,
+    )
+
+    # Optional parameters.
+    parser.add_argument(
+        '--batch_size',
+        default=0,
+        help='Teacher forward pass batch size.',
+        type=int,
+    )
+    parser.add_argument(
+        '--device_id',
+        default=-1,
+        help='Device ID of teacher model.',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_workers',
+        default=-1,
+        help='Number of dataloader worker processes. Set to `-1` to use ' +
+            'value in configuration.',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_student_layers',
+        default=0,
+        help='Number of student Transformer layers. Teacher layers paired ' +
+            'with student layers are dumped. Set to `0` to dump logits only.',
+        type=int,
+    )
+    parser.add_argument(
+        '--use_hidden_loss',
+        help='Dump hidden states for hidden states loss.',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--use_attn_loss',
+        help='Dump attentions for attention loss.',
+        action='store_true'
+    )
+
+    # Parse arguments.
+    args = parser.parse_args()
+
+    # Load fine-tune teacher model configuration.
+    config = fine_tune.config.TeacherConfig.load(
+        experiment=args.experiment,
+        model=args.model,
+        task=args.task
+    )
+
+    # Change batch size for faster forward pass.
+    if args.batch_size:
+        config.batch_size = args.batch_size
+
+    # Check user specify device or not.
+    if args.device_id > -1:
+        config.device_id = args.device_id
+    logger.info("Use device: %s to dump teacher outputs", config.device_id)
+
+    # Change number of dataloader workers.
+    if args.num_workers > -1:
+        config.num_workers = args.num_workers
+
+    # Log configuration.
+    logger.info(config)
+
+    # Load fine-tune dataset.
+    dataset = fine_tune.util.load_dataset_by_config(
+        config=config
+    )
+
+    # Load teacher tokenizer and model.
+    tokenizer = fine_tune.util.load_teacher_tokenizer_by_config(
+        config=config
+    )
+    model = fine_tune.util.load_teacher_model_by_config(
+        config=config
+    )
+
+    # Load model from checkpoint.
+    experiment_name = fine_tune.config.BaseConfig.experiment_name(
+        experiment=config.experiment,
+        model=config.model,
+        task=config.task
+    )
+    model.load_state_dict(torch.load(
+        os.path.join(
+            fine_tune.path.FINE_TUNE_EXPERIMENT,
+            experiment_name,
+            f'model-{args.ckpt}.pt'
+        ),
+        map_location=config.device
+    ))
+
+    # Teacher layers paired with student layers.
+    hidden_layers = []
+    attn_layers = []
+    if args.num_student_layers:
+        hidden_layers, attn_layers = fine_tune.util.distill_layers(
+            num_student_layers=args.num_student_layers,
+            num_teacher_layers=model.encoder.config.num_hidden_layers
+        )
+    if not args.use_hidden_loss:
+        hidden_layers = []
+    if not args.use_attn_loss:
+        attn_layers = []
+    logger.info('Dump hidden state layers: %s', hidden_layers)
+    logger.info('Dump attention layers: %s', attn_layers)
+
+    # Run teacher model once and save its outputs.
+    fine_tune.util.dump_teacher_store_by_config(
+        attn_layers=attn_layers,
+        ckpt=args.ckpt,
+        config=config,
+        dataset=dataset,
+        hidden_layers=hidden_layers,
+        model=model,
+        tokenizer=tokenizer
+    )
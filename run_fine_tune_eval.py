@@ -76,8 +76,33 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         '--device_id',
+        default=[-1],
+        help='Evaluation devices. Workers are spread over given devices. ' +
+            'Set to `-1` to use device in configuration.',
+        nargs='+',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_procs',
+        default=1,
+        help='Number of processes evaluating checkpoints concurrently. ' +
+            'Set to `0` to use one process per device, or one process per ' +
+            'CPU core when running on CPU.',
+        type=int,
+    )
+    parser.add_argument(
+        '--patience',
+        default=0,
+        help='Stop once `patience` checkpoints after the most accurate ' +
+            'one do not improve accuracy. Set to `0` to evaluate all ' +
+            'checkpoints.',
+        type=int,
+    )
+    parser.add_argument(
+        '--num_workers',
         default=-1,
-        help='Evaluation batch size.',
+        help='Number of dataloader worker processes. Set to `-1` to use ' +
+            'value in configuration.',
         type=int,
     )
 
@@ -106,9 +131,26 @@ if __name__ == '__main__':
         config.batch_size = args.batch_size
 
     # Check user specify device or not.
-    if args.device_id > -1:
-        config.device_id = args.device_id
-    logger.info("Use device: %s to run evaluation", config.device_id)
+    device_ids = [
+        device_id for device_id in args.device_id if device_id > -1
+    ]
+    if device_ids:
+        config.device_id = device_ids[0]
+    else:
+        device_ids = [config.device_id]
+    logger.info("Use device: %s to run evaluation", device_ids)
+
+    # One process per device, or per CPU core on CPU.
+    num_procs = args.num_procs
+    if num_procs == 0:
+        if config.device_id > -1:
+            num_procs = len(device_ids)
+        else:
+            num_procs = os.cpu_count() or 1
+
+    # Change number of dataloader workers.
+    if args.num_workers > -1:
+        config.num_workers = args.num_workers
 
     # Set evaluation dataset.
     config.dataset = args.dataset
@@ -177,45 +219,31 @@ if __name__ == '__main__':
     max_acc = 0.0
     max_acc_ckpt = 0
 
-    # Evaluate every checkpoints.
-    for ckpt in all_ckpts:
-
-        # Clean all gradient.
-        model.zero_grad()
-
-        # Load model from checkpoint.
-        model.load_state_dict(torch.load(os.path.join(
-            experiment_dir,
-            f'model-{ckpt}.pt'
-        )))
-
-        # Calculate accuracy.
-        if config.amp:
-            acc = fine_tune.util.amp_evaluation(
-                config=config,
-                dataset=dataset,
-                model=model,
-                tokenizer=tokenizer
-            )
-        else:
-            acc = fine_tune.util.evaluation(
-                config=config,
-                dataset=dataset,
-                model=model,
-                tokenizer=tokenizer
-            )
-
+    # Evaluate checkpoints and log accuracy as soon as each one finishes.
+    for ckpt, acc in fine_tune.util.parallel_evaluation(
+            all_ckpts=all_ckpts,
+            config=config,
+            dataset=dataset,
+            experiment_dir=experiment_dir,
+            model=model,
+            tokenizer=tokenizer,
+            device_ids=device_ids,
+            num_procs=num_procs,
+            patience=args.patience
+    ):
         # Update max accuracy.
-        if max_acc <= acc:
+        if max_acc < acc or (max_acc == acc and max_acc_ckpt < ckpt):
             max_acc = acc
             max_acc_ckpt = ckpt
 
         # Log accuracy.
+        logger.info('checkpoint %d accuracy: %f', ckpt, acc)
         writer.add_scalar(
             f'{config.task}/{config.dataset}/accuracy',
             acc,
             ckpt
         )
+        writer.flush()
 
     # Release IO resources.
     writer.flush()